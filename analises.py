@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+import functools
+from datetime import date, datetime, time, timedelta
+
+# ==============================================================================
+# ANÁLISES FINANCEIRAS
+# ==============================================================================
+# Cada visão (aging, receita por turma e mês, recebido x faturado) é uma única
+# consulta: GROUPING SETS entrega os detalhes e os totais de uma vez e as
+# funções de janela calculam participação, variação e acumulados. Só linhas
+# já agregadas chegam ao pandas.
+#
+# "Recebido" é o valor das cobranças do período com status Pago (a tabela não
+# guarda a data do pagamento). O período vai até hoje: cobranças a vencer
+# ainda não contam como faturadas.
+
+FAIXAS_ATRASO = (30, 60, 90)
+FAIXAS_ROTULOS = ['0-30', '31-60', '61-90', '90+']
+MESES_PADRAO = 12
+TABELAS_ANALISES = ('financeiro', 'alunos', 'turmas')
+
+def agrupar(origem, conjuntos, medidas, dialeto='postgres'):
+    """GROUP BY GROUPING SETS sobre a subconsulta `origem`. A coluna `nivel`
+    é o GROUPING() das dimensões: 0 no detalhe, um bit a mais por dimensão
+    totalizada. O SQLite não tem GROUPING SETS: lá cada conjunto vira um
+    GROUP BY e os resultados são unidos com UNION ALL."""
+    dimensoes = list(dict.fromkeys(d for conjunto in conjuntos for d in conjunto))
+
+    if dialeto != 'sqlite':
+        grupos = ', '.join(f"({', '.join(conjunto)})" for conjunto in conjuntos)
+        return (f"SELECT {', '.join(dimensoes)}, GROUPING({', '.join(dimensoes)}) AS nivel, {medidas} "
+                f"FROM ({origem}) AS base GROUP BY GROUPING SETS ({grupos})")
+
+    partes = []
+    for conjunto in conjuntos:
+        colunas = [d if d in conjunto else f"NULL AS {d}" for d in dimensoes]
+        nivel = sum(1 << (len(dimensoes) - 1 - i) for i, d in enumerate(dimensoes) if d not in conjunto)
+        grupo = f" GROUP BY {', '.join(conjunto)}" if conjunto else ""
+        partes.append(f"SELECT {', '.join(colunas)}, {nivel} AS nivel, {medidas} FROM ({origem}) AS base{grupo}")
+    return " UNION ALL ".join(partes)
+
+# ==============================================================================
+# CONSULTAS
+# ==============================================================================
+
+ORIGEM_ATRASO = f"""
+SELECT CASE WHEN f.vencimento >= %(limite_30)s THEN '{FAIXAS_ROTULOS[0]}'
+            WHEN f.vencimento >= %(limite_60)s THEN '{FAIXAS_ROTULOS[1]}'
+            WHEN f.vencimento >= %(limite_90)s THEN '{FAIXAS_ROTULOS[2]}'
+            ELSE '{FAIXAS_ROTULOS[3]}' END AS faixa,
+       COALESCE(t.nome_turma, 'Sem turma') AS turma,
+       f.aluno_id,
+       f.valor
+FROM financeiro f
+JOIN alunos a ON a.id = f.aluno_id
+LEFT JOIN turmas t ON t.id = a.turma_id
+WHERE f.status = 'Pendente' AND f.vencimento < %(hoje)s
+"""
+
+ORIGEM_PERIODO = """
+SELECT TO_CHAR(f.vencimento, 'YYYY-MM') AS mes,
+       COALESCE(t.nome_turma, 'Sem turma') AS turma,
+       f.valor,
+       CASE WHEN f.status = 'Pago' THEN f.valor ELSE 0 END AS recebido
+FROM financeiro f
+JOIN alunos a ON a.id = f.aluno_id
+LEFT JOIN turmas t ON t.id = a.turma_id
+WHERE f.vencimento >= %(inicio)s AND f.vencimento <= %(hoje)s
+"""
+
+@functools.lru_cache(maxsize=None)
+def consulta_aging(dialeto='postgres'):
+    # nivel 0: faixa x turma; 1: total da faixa; 3: total geral.
+    grupos = agrupar(ORIGEM_ATRASO, [('faixa', 'turma'), ('faixa',), ()],
+                     "COUNT(*) AS cobrancas, COUNT(DISTINCT aluno_id) AS alunos, COALESCE(SUM(valor), 0) AS valor", dialeto)
+    return f"""
+    SELECT g.*,
+           ROUND(100.0 * valor / NULLIF(MAX(CASE WHEN nivel = 3 THEN valor END) OVER (), 0), 1) AS percentual,
+           RANK() OVER (PARTITION BY nivel, faixa ORDER BY valor DESC) AS posicao
+    FROM ({grupos}) AS g
+    ORDER BY nivel, faixa, valor DESC
+    """
+
+@functools.lru_cache(maxsize=None)
+def consulta_receita_turmas(dialeto='postgres'):
+    # nivel 0: mês x turma; 1: total do mês; 2: total da turma no período.
+    grupos = agrupar(ORIGEM_PERIODO, [('mes', 'turma'), ('mes',), ('turma',)],
+                     "COALESCE(SUM(valor), 0) AS faturado, COALESCE(SUM(recebido), 0) AS recebido", dialeto)
+    return f"""
+    SELECT g.*,
+           ROUND(100.0 * recebido / NULLIF(faturado, 0), 1) AS taxa,
+           ROUND(100.0 * recebido / NULLIF(SUM(recebido) OVER (PARTITION BY nivel, mes), 0), 1) AS participacao,
+           recebido - LAG(recebido) OVER (PARTITION BY nivel, turma ORDER BY mes) AS variacao
+    FROM ({grupos}) AS g
+    ORDER BY nivel, mes, turma
+    """
+
+@functools.lru_cache(maxsize=None)
+def consulta_recebido_faturado(dialeto='postgres'):
+    # nivel 0: mês; 1: período inteiro.
+    grupos = agrupar(ORIGEM_PERIODO, [('mes',), ()],
+                     "COUNT(*) AS cobrancas, COALESCE(SUM(valor), 0) AS faturado, COALESCE(SUM(recebido), 0) AS recebido", dialeto)
+    return f"""
+    SELECT g.*,
+           ROUND(100.0 * recebido / NULLIF(faturado, 0), 1) AS taxa,
+           SUM(faturado) OVER (PARTITION BY nivel ORDER BY mes ROWS UNBOUNDED PRECEDING) AS faturado_acumulado,
+           SUM(recebido) OVER (PARTITION BY nivel ORDER BY mes ROWS UNBOUNDED PRECEDING) AS recebido_acumulado
+    FROM ({grupos}) AS g
+    ORDER BY nivel, mes
+    """
+
+def parametros_analises(hoje=None, meses=MESES_PADRAO):
+    hoje = hoje or date.today()
+    ano, mes = divmod(hoje.year * 12 + hoje.month - 1 - (meses - 1), 12)
+    parametros = {'hoje': hoje, 'inicio': date(ano, mes + 1, 1)}
+    for dias in FAIXAS_ATRASO:
+        parametros[f'limite_{dias}'] = hoje - timedelta(days=dias)
+    return parametros
+
+def segundos_ate_amanha(agora=None):
+    # Os resultados valem até a virada do dia (as faixas de atraso mudam).
+    agora = agora or datetime.now()
+    return max(60, int((datetime.combine(agora.date() + timedelta(days=1), time.min) - agora).total_seconds()))
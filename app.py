@@ -1,19 +1,33 @@
 # -*- coding: utf-8 -*-
 import streamlit as st
+from streamlit.errors import StreamlitAPIException
 import pandas as pd
-import hashlib
-import smtplib
+import pyarrow as pa
 import random
 import string
-import urllib.parse
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+import functools
+import tempfile
+import sqlite3
 from datetime import date, datetime, timedelta
-from fpdf import FPDF
 import psycopg2
 from psycopg2.extras import RealDictCursor
-from psycopg2 import pool
-import plotly.graph_objects as go
+from psycopg2.extensions import DECIMAL, new_type, register_type
+from banco import PoolEsgotado, dialeto, pool_de_config
+from migracoes import aplicar_migracoes
+from rastreamento import Rastreador, marcar_cache, pagina_atual, rastrear
+from cache_tabelas import CacheTabelas, tabelas_da_consulta, tabelas_da_escrita
+from notificacoes import OuvinteTabelas
+from conciliacao import TOLERANCIA_DIAS_PADRAO, ler_extrato, conciliar, baixar_pagamentos
+from mensalidades import QUERY_PREVIA, parametros_geracao, gerar_mensalidades
+from exportacao import EXPORTACOES, FORMATOS_EXPORTACAO, exportar, nome_arquivo_exportacao, parametros_exportacao
+from importacao import ENTIDADES_IMPORTACAO, ler_arquivo, sugerir_mapeamento, so_digitos, validar, carregar_copy
+from email_lote import enviar_emails_lote, config_smtp, CHAVES_CONFIG_EMAIL
+from autenticacao import CUSTO_PADRAO, SessoesAtivas, autenticar, criar_codigo_recuperacao, gerar_hash, redefinir_senha
+from analises import FAIXAS_ROTULOS, MESES_PADRAO, TABELAS_ANALISES, consulta_aging, consulta_receita_turmas, consulta_recebido_faturado, parametros_analises, segundos_ate_amanha
+# plotly e os geradores de PDF (carnes, historico -> fpdf) são importados
+# dentro das páginas que os usam: a tela de login não espera por eles.
+from avisos import DIAS_ANTECEDENCIA, QUERY_AVISOS_DIA, QUERY_WHATSAPP_DIA, enfileirar_avisos, janelas_avisos, registrar_envios
+from mensagens import CAMPOS_MODELO, MODELOS_AVISO, MODELOS_EMAIL_PADRAO, MODELOS_WHATSAPP_PADRAO, QUERY_MODELOS_EMAIL, QUERY_MODELOS_WHATSAPP, SUFIXO_WHATSAPP, compilar, modelos_email, modelos_whatsapp, renderizar_emails, planilha_whatsapp, renderizar_lote, renderizar_whatsapp
 
 # ==============================================================================
 # CONFIGURAÇÃO GERAL
@@ -144,19 +158,15 @@ def aplicar_css_profissional():
 # CONEXÃO COM BANCO - OTIMIZADA
 # ==============================================================================
 
+# Colunas NUMERIC (valor, salario_base) chegam como float, não Decimal.
+register_type(new_type(DECIMAL.values, 'DEC2FLOAT', lambda valor, cursor: float(valor) if valor is not None else None))
+
 @st.cache_resource
 def init_connection_pool():
+    # Tamanho e tempos opcionais em [database]: pool_min, pool_max,
+    # pool_espera (s) e statement_timeout (ms).
     try:
-        db_config = st.secrets["database"]
-        return pool.SimpleConnectionPool(
-            minconn=1,
-            maxconn=10,
-            host=db_config["host"],
-            database=db_config["dbname"],
-            user=db_config["user"],
-            password=db_config["password"],
-            port=db_config["port"]
-        )
+        return pool_de_config(st.secrets["database"])
     except Exception as e:
         st.error(f"⚠️ Erro ao conectar: {e}")
         return None
@@ -164,29 +174,84 @@ def init_connection_pool():
 def get_db_connection():
     pool_obj = init_connection_pool()
     if pool_obj:
-        return pool_obj.getconn()
+        try:
+            return pool_obj.obter()
+        except PoolEsgotado as e:
+            st.error(f"⚠️ Sistema ocupado, tente novamente: {e}")
+        except (psycopg2.Error, sqlite3.Error) as e:
+            st.error(f"⚠️ Erro ao conectar: {e}")
     return None
 
 def return_db_connection(conn):
     pool_obj = init_connection_pool()
     if pool_obj and conn:
-        pool_obj.putconn(conn)
+        pool_obj.devolver(conn)
 
 # ==============================================================================
 # FUNÇÕES DE BANCO
 # ==============================================================================
 
-def run_query(query, params=(), return_id=False):
+@st.cache_resource
+def get_cache():
+    return CacheTabelas()
+
+# Com o ouvinte conectado, toda escrita (deste ou de outro processo) chega
+# como aviso e invalida o cache: o TTL só precisa cobrir a virada do dia
+# (consultas com CURRENT_DATE). Sem ele, valem os TTLs curtos de cada leitura.
+TTL_COM_AVISOS = 6 * 3600
+
+@st.cache_resource
+def get_ouvinte():
+    pool_obj = init_connection_pool()
+    return OuvinteTabelas(pool_obj, get_cache()).iniciar() if pool_obj else None
+
+def ttl_cache(ttl):
+    ouvinte = get_ouvinte()
+    if ouvinte is None or not ouvinte.ativo:
+        return ttl
+    return max(ttl, min(TTL_COM_AVISOS, segundos_ate_amanha()))
+
+@st.cache_resource
+def get_rastreador():
+    return Rastreador(init_connection_pool)
+
+def cache_por_tabelas(*tabelas, ttl=60):
+    # Guarda o resultado da função no cache compartilhado, marcado com as
+    # tabelas de que ele depende. O valor devolvido é compartilhado: não alterar.
+    def decorador(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            cache = get_cache()
+            chave = (func.__qualname__, args, tuple(sorted(kwargs.items())))
+            achou, valor = cache.obter(chave)
+            marcar_cache(achou)
+            if achou:
+                return valor
+            marca = cache.marca(tabelas)
+            valor = func(*args, **kwargs)
+            cache.guardar(chave, valor, tabelas, ttl_cache(ttl), marca)
+            return valor
+        wrapper.clear = lambda: get_cache().invalidar(tabelas)
+        return wrapper
+    return decorador
+
+def invalidar_cache(*tabelas):
+    get_cache().invalidar(tabelas)
+
+@rastrear(get_rastreador)
+def run_query(query, params=(), return_id=False, tabelas=None):
+    final_query = query.replace('?', '%s')
+    tabelas = tabelas or tabelas_da_escrita(final_query)
+    
     conn = get_db_connection()
     if not conn:
         return False
     
-    final_query = query.replace('?', '%s')
-    
     try:
         with conn.cursor() as c:
             c.execute(final_query, params)
             conn.commit()
+            invalidar_cache(*tabelas)
             
             if return_id:
                 c.execute("SELECT lastval()")
@@ -199,8 +264,20 @@ def run_query(query, params=(), return_id=False):
     finally:
         return_db_connection(conn)
 
-@st.cache_data(ttl=60)
-def get_data(query, params=(), limit=None):
+@rastrear(get_rastreador)
+def get_data(query, params=(), limit=None, tabelas=None, ttl=60):
+    # tabelas: de quais tabelas o resultado depende (por padrão, as que
+    # aparecem em FROM/JOIN). Escritas nessas tabelas invalidam a entrada.
+    # O DataFrame do cache é compartilhado entre sessões: cada chamada recebe
+    # uma cópia rasa (com Copy-on-Write, alterar colunas não toca o cache).
+    cache = get_cache()
+    chave = ('get_data', query, tuple(sorted(params.items())) if isinstance(params, dict) else tuple(params), limit)
+    
+    achou, df = cache.obter(chave)
+    marcar_cache(achou)
+    if achou:
+        return df.copy(deep=False)
+    
     conn = get_db_connection()
     if not conn:
         return pd.DataFrame()
@@ -209,17 +286,61 @@ def get_data(query, params=(), limit=None):
     
     if limit and 'LIMIT' not in final_query.upper():
         final_query += f" LIMIT {limit}"
+    tabelas = tabelas or tabelas_da_consulta(final_query)
+    marca = cache.marca(tabelas)
     
     try:
         df = pd.read_sql(final_query, conn, params=params)
-        return df
     except Exception as e:
         st.error(f"Erro: {e}")
         return pd.DataFrame()
     finally:
         return_db_connection(conn)
+    
+    cache.guardar(chave, df, tabelas, ttl_cache(ttl), marca)
+    return df.copy(deep=False)
 
-@st.cache_data(ttl=300)
+@rastrear(get_rastreador)
+def get_data_arrow(query, params=(), tabelas=None, ttl=60):
+    # Leitura opcional em Apache Arrow para listas grandes. A pyarrow.Table é
+    # imutável, então fica no cache sem cópia e vai direto para o
+    # st.dataframe, sem a conversão pandas -> Arrow a cada rerun.
+    cache = get_cache()
+    chave = ('get_data_arrow', query, tuple(sorted(params.items())) if isinstance(params, dict) else tuple(params))
+    
+    achou, tabela = cache.obter(chave)
+    marcar_cache(achou)
+    if achou:
+        return tabela
+    
+    conn = get_db_connection()
+    if not conn:
+        return pa.table({})
+    
+    final_query = query.replace('?', '%s')
+    tabelas = tabelas or tabelas_da_consulta(final_query)
+    marca = cache.marca(tabelas)
+    
+    try:
+        with conn.cursor() as c:
+            c.execute(final_query, params)
+            nomes = [d.name for d in c.description]
+            linhas = c.fetchall()
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        st.error(f"Erro: {e}")
+        return pa.table({})
+    finally:
+        return_db_connection(conn)
+    
+    colunas = list(zip(*linhas)) if linhas else [()] * len(nomes)
+    tabela = pa.table({nome: pa.array(col) for nome, col in zip(nomes, colunas)})
+    
+    cache.guardar(chave, tabela, tabelas, ttl_cache(ttl), marca)
+    return tabela
+
+@cache_por_tabelas('config_sistema', ttl=300)
 def get_config_sistema(chave):
     df = get_data("SELECT valor FROM config_sistema WHERE chave=%s", (chave,))
     return df.iloc[0]['valor'] if not df.empty else ""
@@ -228,43 +349,33 @@ def get_config_sistema(chave):
 # INICIALIZAÇÃO DE TABELAS
 # ==============================================================================
 
-@st.cache_resource
-def verificar_e_atualizar_tabelas():
+# Uma vez por processo, e fora do caminho da tela de login: o formulário é
+# desenhado antes e só quem vai usar o banco (entrar, recuperar a senha, as
+# páginas) espera pelas migrações. Uma falha não fica em cache: a próxima
+# execução tenta de novo.
+
+@st.cache_resource(show_spinner=False)
+def esquema_atualizado():
     conn = get_db_connection()
     if not conn:
-        return
-    
-    tabelas = [
-        '''CREATE TABLE IF NOT EXISTS professores (id SERIAL PRIMARY KEY, nome TEXT, telefone TEXT, cargo TEXT DEFAULT 'Professor', cpf TEXT, rg TEXT, data_admissao TEXT, salario_base REAL, carga_horaria TEXT, endereco TEXT, status_rh TEXT DEFAULT 'Ativo')''',
-        '''CREATE TABLE IF NOT EXISTS turmas (id SERIAL PRIMARY KEY, nome_turma TEXT UNIQUE, professor_id INTEGER, ativa INTEGER DEFAULT 1, FOREIGN KEY(professor_id) REFERENCES professores(id))''',
-        '''CREATE TABLE IF NOT EXISTS alunos (id SERIAL PRIMARY KEY, nome TEXT, data_nascimento TEXT, naturalidade TEXT, cpf TEXT, rg TEXT, pai_nome TEXT, mae_nome TEXT, turma_id INTEGER, status TEXT DEFAULT 'Cursando', endereco TEXT, bairro TEXT, cep TEXT, cidade TEXT, telefone_contato TEXT, email_responsavel TEXT, saude_alergias TEXT, saude_problemas TEXT, saude_plano TEXT, seguranca_autorizados TEXT, seguranca_transporte TEXT, FOREIGN KEY(turma_id) REFERENCES turmas(id))''',
-        '''CREATE TABLE IF NOT EXISTS config_sistema (chave TEXT PRIMARY KEY, valor TEXT)''',
-        '''CREATE TABLE IF NOT EXISTS financeiro (id SERIAL PRIMARY KEY, aluno_id INTEGER, descricao TEXT, valor REAL, vencimento TEXT, status TEXT DEFAULT 'Pendente', FOREIGN KEY(aluno_id) REFERENCES alunos(id))''',
-        '''CREATE TABLE IF NOT EXISTS usuarios (id SERIAL PRIMARY KEY, username TEXT UNIQUE, password TEXT, setor TEXT, email TEXT)''',
-        '''CREATE TABLE IF NOT EXISTS templates_email (id SERIAL PRIMARY KEY, nome_interno TEXT UNIQUE, assunto TEXT, corpo TEXT)''',
-        '''CREATE TABLE IF NOT EXISTS templates_whatsapp (id SERIAL PRIMARY KEY, nome_interno TEXT UNIQUE, mensagem TEXT)''',
-        '''CREATE TABLE IF NOT EXISTS log_envios (id SERIAL PRIMARY KEY, financeiro_id INTEGER, tipo_aviso TEXT, data_envio TEXT, canal TEXT, FOREIGN KEY(financeiro_id) REFERENCES financeiro(id))'''
-    ]
+        raise ConnectionError("sem conexão para verificar as tabelas")
     
     try:
-        with conn.cursor() as c:
-            for cmd in tabelas:
-                c.execute(cmd)
-            conn.commit()
-            
-            c.execute("SELECT * FROM usuarios WHERE username='admin'")
-            if not c.fetchall():
-                hash_pw = hashlib.sha256("1234".encode()).hexdigest()
-                c.execute("INSERT INTO usuarios (username, password, setor, email) VALUES (%s, %s, %s, %s)", 
-                          ("admin", hash_pw, "Administrador", "admin@escola.com"))
-                conn.commit()
-    except Exception as e:
+        aplicadas = aplicar_migracoes(conn)
+        if aplicadas:
+            print(f"Log: migrações aplicadas {aplicadas}")
+        return aplicadas
+    except Exception:
         conn.rollback()
-        print(f"Log: {e}")
+        raise
     finally:
         return_db_connection(conn)
 
-verificar_e_atualizar_tabelas()
+def verificar_e_atualizar_tabelas():
+    try:
+        esquema_atualizado()
+    except Exception as e:
+        print(f"Log: {e}")
 
 # ==============================================================================
 # COMPONENTES VISUAIS
@@ -298,58 +409,292 @@ def render_status_badge(status):
     classe, icone = badges.get(status, ("badge-success", "●"))
     return f'<span class="badge {classe}">{icone} {status}</span>'
 
+def fragmento(funcao):
+    # st.fragment: um clique dentro da função refaz só ela, sem o menu, o CSS
+    # e as consultas do resto da página. O tempo dessas execuções parciais
+    # aparece no painel de desempenho como "Página › função".
+    @st.fragment
+    @functools.wraps(funcao)
+    def executar(*args, **kwargs):
+        if pagina_atual() is not None:
+            return funcao(*args, **kwargs)
+        with get_rastreador().pagina(f"{st.session_state.get('menu', '-')} › {funcao.__name__}"):
+            return funcao(*args, **kwargs)
+    return executar
+
+def refazer_fragmento():
+    # Só dá para refazer o fragmento numa execução parcial; se ele rodou junto
+    # com a página inteira, refaz a página.
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
+
 # ==============================================================================
-# FUNÇÕES UTILITÁRIAS
+# LISTAS PAGINADAS (KEYSET)
 # ==============================================================================
 
-def make_hashes(p):
-    return hashlib.sha256(str.encode(p)).hexdigest()
+TAMANHO_PAGINA = 50
 
-def check_login(username, password):
-    hashed = make_hashes(password)
-    df = get_data('SELECT * FROM usuarios WHERE username=%s AND password=%s', (username, hashed))
-    return df.iloc[0] if not df.empty else None
+@st.cache_data(ttl=300)
+def contar_aproximado(query, params=()):
+    # Estimativa do planejador (EXPLAIN), sem varrer a tabela como faria um COUNT(*).
+    # O SQLite não estima linhas: lá a contagem é exata (bases pequenas).
+    conn = get_db_connection()
+    if not conn:
+        return None
+    
+    try:
+        with conn.cursor() as c:
+            if dialeto(conn) == 'sqlite':
+                c.execute(f"SELECT COUNT(*) FROM ({query}) AS sub", params)
+                return int(c.fetchone()[0])
+            c.execute(f"EXPLAIN (FORMAT JSON) SELECT 1 FROM ({query}) AS sub", params)
+            return int(c.fetchone()[0][0]['Plan']['Plan Rows'])
+    except Exception:
+        conn.rollback()
+        return None
+    finally:
+        return_db_connection(conn)
 
-def enviar_email_real(destinatario, assunto, corpo):
-    email_escola = get_config_sistema('email_envio')
-    senha_app = get_config_sistema('senha_app')
+def _mudar_pagina(estado_key, destino, cursor=None):
+    estado = st.session_state[estado_key]
+    
+    if destino == 'proxima':
+        if len(estado['cursores']) == estado['pagina'] + 1:
+            estado['cursores'].append(cursor)
+        estado['pagina'] += 1
+    elif destino == 'anterior':
+        estado['pagina'] = max(0, estado['pagina'] - 1)
+    else:
+        estado['pagina'] = 0
+
+def _depois_do_cursor(colunas_ordem, cursor):
+    # Equivale a (colunas) > (cursor) com NULL depois de qualquer valor:
+    # k1 "maior" OR (k1 = v1 AND k2 "maior") OR ... Um NULL no cursor só é
+    # igualado por IS NULL e nada vem depois dele naquela coluna.
+    alternativas, p = [], []
+    iguais, p_iguais = [], []
+    for col, valor in zip(colunas_ordem, cursor):
+        if valor is not None:
+            alternativas.append(" AND ".join(iguais + [f"({col} > %s OR {col} IS NULL)"]))
+            p += p_iguais + [valor]
+            iguais.append(f"{col} = %s")
+            p_iguais.append(valor)
+        else:
+            iguais.append(f"{col} IS NULL")
+    return "(" + (" OR ".join(f"({a})" for a in alternativas) or "1 = 0") + ")", p
+
+def consulta_paginada(chave, select_sql, colunas_ordem, where=(), params=(), por_pagina=TAMANHO_PAGINA, contar=True, arrow=False):
+    # Paginação por busca (seek): cada página começa depois da última chave de
+    # ordenação da anterior, então a página N custa o mesmo que a página 1.
+    # Chaves NULL vão para o fim nos dois bancos (NULLS LAST; o SQLite as
+    # poria primeiro) e entram na busca, em vez de encerrar a paginação.
+    estado_key = f"pag_{chave}"
+    assinatura = (select_sql, tuple(where), tuple(params))
+    
+    estado = st.session_state.get(estado_key)
+    if not estado or estado['assinatura'] != assinatura:
+        estado = {'assinatura': assinatura, 'cursores': [None], 'pagina': 0}
+        st.session_state[estado_key] = estado
+    
+    condicoes = list(where)
+    p = list(params)
+    cursor = estado['cursores'][estado['pagina']]
+    
+    if cursor is not None:
+        condicao, p_cursor = _depois_do_cursor(colunas_ordem, cursor)
+        condicoes.append(condicao)
+        p += p_cursor
+    
+    q = select_sql
+    if condicoes:
+        q += " WHERE " + " AND ".join(condicoes)
+    q += f" ORDER BY {', '.join(f'{col} NULLS LAST' for col in colunas_ordem)} LIMIT {por_pagina + 1}"
+    
+    # Com arrow=True o resultado é uma pyarrow.Table (somente leitura).
+    if arrow:
+        df = get_data_arrow(q, tuple(p))
+    else:
+        df = get_data(q, tuple(p))
+    
+    tem_proxima = len(df) > por_pagina
+    df = df.slice(0, por_pagina) if arrow else df.iloc[:por_pagina]
     
-    if not email_escola or not senha_app:
-        return False, "Configure o e-mail."
+    proximo_cursor = None
+    if tem_proxima:
+        nomes = [col.split('.')[-1] for col in colunas_ordem]
+        if arrow:
+            proximo_cursor = tuple(df.column(n)[len(df) - 1].as_py() for n in nomes)
+        else:
+            ultima = df.iloc[-1]
+            proximo_cursor = tuple(None if pd.isna(v) else v.item() if hasattr(v, 'item') else v
+                                   for v in (ultima[n] for n in nomes))
+    
+    legenda = f"Página {estado['pagina'] + 1}"
+    if contar:
+        total = contar_aproximado(select_sql + (" WHERE " + " AND ".join(where) if where else ""), tuple(params))
+        if total is not None:
+            legenda += f" · ~{total:,} registros".replace(",", ".")
+    
+    c1, c2, c3, c4 = st.columns([1, 1, 3, 1])
+    c1.button("⏮", key=f"{estado_key}_inicio", disabled=estado['pagina'] == 0,
+              on_click=_mudar_pagina, args=(estado_key, 'inicio'), use_container_width=True)
+    c2.button("◀", key=f"{estado_key}_anterior", disabled=estado['pagina'] == 0,
+              on_click=_mudar_pagina, args=(estado_key, 'anterior'), use_container_width=True)
+    c3.markdown(f"<p style='text-align: center; color: #64748b; margin-top: 8px;'>{legenda}</p>", unsafe_allow_html=True)
+    c4.button("▶", key=f"{estado_key}_proxima", disabled=not tem_proxima,
+              on_click=_mudar_pagina, args=(estado_key, 'proxima', proximo_cursor), use_container_width=True)
+    
+    return df
+
+# ==============================================================================
+# BUSCA (PG_TRGM + UNACCENT)
+# ==============================================================================
+
+LIMITE_BUSCA = 50
+LIMITE_SIMILARIDADE = 0.6   # pg_trgm.word_similarity_threshold padrão
+
+def buscar_registros(select_sql, alias, termo, where=(), params=(), limite=LIMITE_BUSCA):
+    # Busca por nome (sem acentos, tolerante a erros de digitação) ou por CPF
+    # (só dígitos), usando os índices GIN de trigramas. Resultados ordenados
+    # pela similaridade com o termo. No SQLite não há o operador <% nem índice:
+    # word_similarity (banco_sqlite) compara com o mesmo limite do pg_trgm.
+    termo = termo.strip()
+    digitos = ''.join(filter(str.isdigit, termo))
+    
+    if dialeto(init_connection_pool()) == 'sqlite':
+        parecido = f"word_similarity(lower(f_unaccent(%s)), {alias}.nome_busca) >= {LIMITE_SIMILARIDADE}"
+    else:
+        parecido = f"lower(f_unaccent(%s)) <%% {alias}.nome_busca"
+    condicao = f"({alias}.nome_busca LIKE '%%' || lower(f_unaccent(%s)) || '%%' OR {parecido}"
+    p_busca = [termo, termo]
     
-    if not destinatario or "@" not in destinatario:
-        return False, "E-mail inválido."
+    if len(digitos) >= 3:
+        condicao += f" OR {alias}.cpf_digitos LIKE %s"
+        p_busca.append(f'%{digitos}%')
+    condicao += ")"
+    
+    q = select_sql + " WHERE " + " AND ".join(list(where) + [condicao])
+    q += f" ORDER BY word_similarity(lower(f_unaccent(%s)), {alias}.nome_busca) DESC, {alias}.nome, {alias}.id LIMIT {int(limite)}"
+    
+    return get_data(q, tuple(params) + tuple(p_busca) + (termo,))
+
+# ==============================================================================
+# FUNÇÕES UTILITÁRIAS
+# ==============================================================================
+
+def custo_hash():
+    # [auth] custo_hash no secrets.toml: log2 do N do scrypt.
+    return int(st.secrets.get("auth", {}).get("custo_hash", CUSTO_PADRAO))
+
+def check_login(username, password):
+    # Direto no banco, fora do cache de consultas.
+    verificar_e_atualizar_tabelas()
+    conn = get_db_connection()
+    if not conn:
+        return None
     
     try:
-        msg = MIMEMultipart()
-        msg['From'] = email_escola
-        msg['To'] = destinatario
-        msg['Subject'] = assunto
-        msg.attach(MIMEText(corpo, 'plain'))
-        
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.starttls()
-        server.login(email_escola, senha_app)
-        server.sendmail(email_escola, destinatario, msg.as_string())
-        server.quit()
-        return True, "E-mail enviado!"
+        return autenticar(conn, username, password, custo_hash())
     except Exception as e:
-        return False, str(e)
+        conn.rollback()
+        print(f"Log: {e}")
+        return None
+    finally:
+        return_db_connection(conn)
+
+@cache_por_tabelas('config_sistema', ttl=300)
+def get_config_email():
+    df = get_data("SELECT chave, valor FROM config_sistema WHERE chave IN %s", (CHAVES_CONFIG_EMAIL,))
+    return config_smtp(dict(zip(df['chave'], df['valor'])) if not df.empty else {})
+
+def enviar_emails(mensagens):
+    config = get_config_email()
+    
+    if not config['email'] or not config['senha']:
+        return [dict(m, ok=False, detalhe="Configure o e-mail.") for m in mensagens]
+    
+    return enviar_emails_lote(config, mensagens)
+
+def enviar_email_real(destinatario, assunto, corpo):
+    resultado = enviar_emails([{'destinatario': destinatario, 'assunto': assunto, 'corpo': corpo}])[0]
+    return resultado['ok'], resultado['detalhe']
 
-def processar_template(texto, dados_dict):
-    for chave, valor in dados_dict.items():
-        valor_str = str(valor) if valor is not None else ""
-        texto = texto.replace(f"{{{chave}}}", valor_str)
-    return texto
+TTL_MODELOS = 3600
 
-def limpar_telefone(telefone):
-    if not telefone: return ""
-    return ''.join(filter(str.isdigit, str(telefone)))
+def get_modelos():
+    # Modelos de e-mail e WhatsApp (gravados ou padrão). Só mudam quando
+    # editados, e a edição invalida o cache das duas tabelas.
+    email = get_data(QUERY_MODELOS_EMAIL, ttl=TTL_MODELOS)
+    whatsapp = get_data(QUERY_MODELOS_WHATSAPP, ttl=TTL_MODELOS)
+    return (modelos_email(email.itertuples(index=False, name=None)),
+            modelos_whatsapp(whatsapp.itertuples(index=False, name=None)))
 
 # ==============================================================================
 # LOGIN
 # ==============================================================================
 
+PARAM_SESSAO = "sessao"
+
+@st.cache_resource
+def get_sessoes():
+    return SessoesAtivas()
+
+def iniciar_sessao(user_data):
+    st.session_state['logged_in'] = True
+    st.session_state['user_data'] = user_data
+    st.session_state['menu'] = "Dashboard"
+    st.query_params[PARAM_SESSAO] = get_sessoes().criar(user_data)
+
+def restaurar_sessao():
+    # O login vale enquanto o token da URL for válido: checagem só em memória,
+    # sem consultar usuarios a cada rerun, recarga ou nova aba.
+    user_data = get_sessoes().validar(st.query_params.get(PARAM_SESSAO))
+    st.session_state['logged_in'] = user_data is not None
+    st.session_state['user_data'] = user_data
+    if user_data is not None and 'menu' not in st.session_state:
+        st.session_state['menu'] = "Dashboard"
+
+def encerrar_sessao():
+    get_sessoes().revogar(st.query_params.get(PARAM_SESSAO))
+    if PARAM_SESSAO in st.query_params:
+        del st.query_params[PARAM_SESSAO]
+    st.session_state['logged_in'] = False
+    st.session_state['user_data'] = None
+
+def enviar_codigo_recuperacao(email):
+    verificar_e_atualizar_tabelas()
+    conn = get_db_connection()
+    if not conn:
+        return
+    
+    try:
+        codigo = criar_codigo_recuperacao(conn, email)
+    except Exception as e:
+        conn.rollback()
+        st.error(f"❌ Erro: {e}")
+        return
+    finally:
+        return_db_connection(conn)
+    
+    if codigo:
+        corpo = f"""Olá,
+
+Seu código para redefinir a senha do sistema é: {codigo}
+
+Ele vale por 15 minutos. Se você não pediu a troca, ignore este e-mail.
+
+Atenciosamente,
+Secretaria
+"""
+        ok, detalhe = enviar_email_real(email.strip(), "Código de Recuperação de Senha", corpo)
+        if not ok:
+            st.error(f"❌ Não foi possível enviar o e-mail: {detalhe}")
+            return
+    # A mesma resposta para e-mails cadastrados ou não.
+    st.success("📧 Se o e-mail estiver cadastrado, você receberá um código válido por 15 minutos.")
+
 def login_page():
     aplicar_css_profissional()
     
@@ -366,30 +711,67 @@ def login_page():
         if st.button("🚀 Entrar", use_container_width=True):
             user_data = check_login(username, password)
             if user_data is not None:
-                st.session_state['logged_in'] = True
-                st.session_state['user_data'] = user_data
-                st.session_state['menu'] = "Dashboard"
+                iniciar_sessao(user_data)
                 st.rerun()
             else:
                 st.error("❌ Usuário ou senha incorretos.")
+        
+        with st.expander("🔑 Esqueci minha senha"):
+            email = st.text_input("📧 E-mail cadastrado", key="rec_email")
+            if st.button("Enviar código", use_container_width=True, key="rec_enviar"):
+                if email.strip():
+                    enviar_codigo_recuperacao(email)
+                else:
+                    st.error("⚠️ Informe o e-mail.")
+            
+            codigo = st.text_input("Código recebido", max_chars=6, key="rec_codigo")
+            nova = st.text_input("Nova senha", type="password", key="rec_nova")
+            confirmacao = st.text_input("Confirme a nova senha", type="password", key="rec_confirmacao")
+            
+            if st.button("✅ Redefinir senha", use_container_width=True, key="rec_redefinir"):
+                if not (email.strip() and codigo and nova):
+                    st.error("⚠️ Preencha e-mail, código e a nova senha.")
+                elif nova != confirmacao:
+                    st.error("⚠️ As senhas não conferem.")
+                else:
+                    alterados = None
+                    verificar_e_atualizar_tabelas()
+                    conn = get_db_connection()
+                    if conn:
+                        try:
+                            alterados = redefinir_senha(conn, email, codigo, nova, custo_hash())
+                        except Exception as e:
+                            st.error(f"❌ Erro: {e}")
+                        finally:
+                            return_db_connection(conn)
+                    
+                    if alterados:
+                        for username_alterado in alterados:
+                            get_sessoes().revogar_usuario(username_alterado)
+                        st.success(f"✅ Senha redefinida ({', '.join(alterados)}). Faça login com a nova senha.")
+                    elif alterados is not None:
+                        st.error("❌ Código inválido ou expirado.")
 
 # ==============================================================================
 # DASHBOARD
 # ==============================================================================
 
-@st.cache_data(ttl=120)
+@rastrear(get_rastreador, sql="get_dashboard_metrics()")
+@cache_por_tabelas('alunos', 'turmas', 'financeiro', 'professores', ttl=120)
 def get_dashboard_metrics():
     conn = get_db_connection()
     if not conn:
         return {}
     
     try:
+        # Contadores mantidos por gatilhos (migração 6): lê poucas linhas
+        # prontas em vez de varrer as tabelas.
         query = """
         SELECT 
-            (SELECT COUNT(*) FROM alunos WHERE status='Cursando') as alunos_ativos,
-            (SELECT COUNT(*) FROM turmas WHERE ativa=1) as turmas_ativas,
-            (SELECT COALESCE(SUM(valor), 0) FROM financeiro WHERE status='Pendente') as pendencias_total,
-            (SELECT COUNT(*) FROM professores WHERE status_rh='Ativo') as professores_ativos
+            (SELECT COALESCE(SUM(quantidade), 0)::bigint FROM resumo_contadores WHERE tabela='alunos' AND grupo='Cursando') as alunos_ativos,
+            (SELECT COALESCE(SUM(quantidade), 0)::bigint FROM resumo_contadores WHERE tabela='turmas' AND grupo='1') as turmas_ativas,
+            (SELECT COALESCE(SUM(valor_total), 0) FROM resumo_financeiro_mensal WHERE status='Pendente') as pendencias_total,
+            (SELECT COALESCE(SUM(quantidade), 0)::bigint FROM resumo_contadores WHERE tabela='professores' AND grupo='Ativo') as professores_ativos
         """
         
         with conn.cursor(cursor_factory=RealDictCursor) as c:
@@ -400,6 +782,8 @@ def get_dashboard_metrics():
         return_db_connection(conn)
 
 def dashboard_page():
+    import plotly.graph_objects as go
+    
     st.title("📊 Dashboard")
     
     metrics = get_dashboard_metrics()
@@ -425,17 +809,17 @@ def dashboard_page():
     
     query_inadim = """
     SELECT 
-        TO_CHAR(vencimento::date, 'YYYY-MM') as mes,
-        COUNT(*) as quantidade,
-        SUM(valor) as valor_total
-    FROM financeiro
+        TO_CHAR(mes, 'YYYY-MM') as mes,
+        quantidade,
+        valor_total
+    FROM resumo_financeiro_mensal
     WHERE status = 'Pendente'
-    AND vencimento >= CURRENT_DATE - INTERVAL '6 months'
-    GROUP BY TO_CHAR(vencimento::date, 'YYYY-MM')
+    AND mes >= DATE_TRUNC('month', CURRENT_DATE - INTERVAL '6 months')
+    AND quantidade > 0
     ORDER BY mes
     """
     
-    df_inadim = get_data(query_inadim)
+    df_inadim = get_data(query_inadim, tabelas=('financeiro',))
     
     if not df_inadim.empty:
         fig = go.Figure()
@@ -499,20 +883,16 @@ def professores_page():
                     st.error("⚠️ Nome e CPF são obrigatórios.")
     
     with aba2:
-        search = st.text_input("🔍 Buscar Professor")
+        search = st.text_input("🔍 Buscar Professor (nome ou CPF)")
         
-        q = "SELECT id, nome, cargo, telefone, cpf, status_rh FROM professores"
-        p = ()
+        q = "SELECT p.id, p.nome, p.cargo, p.telefone, p.cpf, p.status_rh FROM professores p"
         
         if search:
-            q += " WHERE nome ILIKE %s OR cpf LIKE %s"
-            p = (f'%{search}%', f'%{search}%')
-        
-        q += " ORDER BY nome LIMIT 50"
-        
-        df = get_data(q, p)
+            df = buscar_registros(q, 'p', search)
+        else:
+            df = consulta_paginada("professores", q, ('p.nome', 'p.id'), arrow=True)
         
-        if not df.empty:
+        if len(df):
             st.dataframe(df, use_container_width=True, hide_index=True)
         else:
             st.info("Nenhum professor encontrado.")
@@ -573,25 +953,21 @@ def alunos_page():
     with aba2:
         st.subheader("Lista de Alunos Ativos")
         
-        search = st.text_input("🔍 Buscar aluno")
+        search = st.text_input("🔍 Buscar aluno (nome ou CPF)")
         
         q = """
         SELECT a.id, a.nome, t.nome_turma, a.telefone_contato, a.status 
         FROM alunos a 
-        LEFT JOIN turmas t ON a.turma_id = t.id 
-        WHERE a.status='Cursando'
+        LEFT JOIN turmas t ON a.turma_id = t.id
         """
-        p = ()
+        where = ("a.status='Cursando'",)
         
         if search:
-            q += " AND a.nome ILIKE %s"
-            p = (f'%{search}%',)
-        
-        q += " ORDER BY a.nome LIMIT 50"
-        
-        df = get_data(q, p)
+            df = buscar_registros(q, 'a', search, where)
+        else:
+            df = consulta_paginada("alunos", q, ('a.nome', 'a.id'), where, arrow=True)
         
-        if not df.empty:
+        if len(df):
             st.dataframe(df, use_container_width=True, hide_index=True)
         else:
             st.info("Nenhum aluno encontrado.")
@@ -600,114 +976,373 @@ def alunos_page():
 # FINANCEIRO
 # ==============================================================================
 
-def financeiro_page():
-    st.title("💰 Gestão Financeira")
+@fragmento
+def nova_cobranca():
+    search_aluno = st.text_input("🔍 Buscar aluno")
     
-    aba1, aba2 = st.tabs(["➕ Nova Cobrança", "📋 Gerenciar Pagamentos"])
+    if search_aluno:
+        alunos = buscar_registros("SELECT a.id, a.nome FROM alunos a", 'a', search_aluno, ("a.status='Cursando'",), limite=20)
+    else:
+        alunos = get_data("SELECT id, nome FROM alunos WHERE status='Cursando' ORDER BY nome LIMIT 20")
     
-    with aba1:
-        search_aluno = st.text_input("🔍 Buscar aluno")
-        
-        q = "SELECT id, nome FROM alunos WHERE status='Cursando'"
-        p = ()
-        
-        if search_aluno:
-            q += " AND nome ILIKE %s"
-            p = (f'%{search_aluno}%',)
-        
-        q += " ORDER BY nome LIMIT 20"
-        
-        alunos = get_data(q, p)
-        
-        if not alunos.empty:
-            with st.form("nova_cobranca"):
-                aluno_sel = st.selectbox("Aluno", alunos['nome'].tolist())
-                
-                c1, c2 = st.columns(2)
-                descricao = c1.text_input("Descrição")
-                valor = c2.number_input("Valor (R$)", min_value=0.0, step=10.0)
-                
-                vencimento = st.date_input("Vencimento")
+    if not alunos.empty:
+        with st.form("nova_cobranca"):
+            aluno_sel = st.selectbox("Aluno", alunos['nome'].tolist())
+            
+            c1, c2 = st.columns(2)
+            descricao = c1.text_input("Descrição")
+            valor = c2.number_input("Valor (R$)", min_value=0.0, step=10.0)
+            
+            vencimento = st.date_input("Vencimento")
+            
+            enviar_email = st.checkbox("📧 Notificar por e-mail")
+            gerar_zap = st.checkbox("📱 Gerar link WhatsApp")
+            
+            if st.form_submit_button("💾 Lançar", use_container_width=True):
+                aluno_id = alunos[alunos['nome'] == aluno_sel].iloc[0]['id']
                 
-                enviar_email = st.checkbox("📧 Notificar por e-mail")
-                gerar_zap = st.checkbox("📱 Gerar link WhatsApp")
+                q = "INSERT INTO financeiro (aluno_id, descricao, valor, vencimento) VALUES (%s, %s, %s, %s)"
                 
-                if st.form_submit_button("💾 Lançar", use_container_width=True):
-                    aluno_id = alunos[alunos['nome'] == aluno_sel].iloc[0]['id']
+                if run_query(q, (int(aluno_id), descricao, valor, str(vencimento))):
+                    st.success(f"✅ Cobrança lançada!")
                     
-                    q = "INSERT INTO financeiro (aluno_id, descricao, valor, vencimento) VALUES (%s, %s, %s, %s)"
+                    aluno_data = get_data("SELECT email_responsavel, telefone_contato, mae_nome FROM alunos WHERE id=%s", (int(aluno_id),))
                     
-                    if run_query(q, (int(aluno_id), descricao, valor, str(vencimento))):
-                        st.success(f"✅ Cobrança lançada!")
+                    if not aluno_data.empty:
+                        dados = aluno_data.iloc[0]
+                        cobranca = pd.DataFrame([{'nome': aluno_sel, 'mae_nome': dados['mae_nome'], 'descricao': descricao,
+                                                  'valor': valor, 'vencimento': vencimento, 'telefone_contato': dados['telefone_contato']}])
+                        modelos_email_, modelos_whatsapp_ = get_modelos()
                         
-                        aluno_data = get_data("SELECT email_responsavel, telefone_contato, mae_nome FROM alunos WHERE id=%s", (int(aluno_id),))
+                        if enviar_email and dados['email_responsavel']:
+                            assuntos, corpos = renderizar_emails(cobranca, 'cobranca', modelos_email_)
+                            ok, msg = enviar_email_real(dados['email_responsavel'], assuntos.iloc[0], corpos.iloc[0])
+                            
+                            if ok:
+                                st.success("📧 E-mail enviado!")
+                            else:
+                                st.warning(f"⚠️ Erro: {msg}")
                         
-                        if not aluno_data.empty:
-                            if enviar_email and aluno_data.iloc[0]['email_responsavel']:
-                                email_resp = aluno_data.iloc[0]['email_responsavel']
-                                
-                                corpo = f"""
-Olá!
-
-Nova cobrança para {aluno_sel}.
+                        if gerar_zap:
+                            link = renderizar_whatsapp(cobranca, 'cobranca', modelos_whatsapp_)[1].iloc[0]
+                            
+                            if link:
+                                st.markdown(f'<a href="{link}" target="_blank"><button style="background:#25D366; color:white; border:none; padding:10px 20px; border-radius:8px; cursor:pointer; font-weight:600;">📱 Enviar WhatsApp</button></a>', unsafe_allow_html=True)
 
-Descrição: {descricao}
-Valor: R$ {valor:.2f}
-Vencimento: {vencimento.strftime('%d/%m/%Y')}
+@fragmento
+def contas_em_aberto():
+    st.subheader("Contas em Aberto")
+    
+    q = """
+    SELECT f.id, a.nome, f.descricao, f.valor, f.vencimento, f.status 
+    FROM financeiro f 
+    JOIN alunos a ON f.aluno_id = a.id
+    """
+    
+    df = consulta_paginada("contas_abertas", q, ('f.vencimento', 'f.id'), ("f.status = 'Pendente'",))
+    
+    if not df.empty:
+        # A chave muda quando as linhas exibidas mudam (outra página ou
+        # depois de uma baixa), para a seleção não apontar para linhas erradas.
+        selecao = st.dataframe(df, use_container_width=True, hide_index=True, on_select="rerun",
+                               selection_mode="multi-row", key=f"sel_contas_{hash(tuple(df['id']))}")
+        ids_sel = df.iloc[selecao.selection.rows]['id'].tolist()
+        
+        col1, col2 = st.columns([3, 1])
+        col1.caption(f"{len(ids_sel)} selecionadas · R$ {df.iloc[selecao.selection.rows]['valor'].sum():,.2f}"
+                     if ids_sel else "Selecione as linhas pagas na tabela.")
+        
+        if col2.button(f"✅ Confirmar ({len(ids_sel)})", disabled=not ids_sel, use_container_width=True):
+            conn = get_db_connection()
+            if conn:
+                try:
+                    baixadas = baixar_pagamentos(conn, ids_sel)
+                    invalidar_cache('financeiro')
+                    st.toast(f"✅ {baixadas} pagamentos confirmados!")
+                    refazer_fragmento()
+                except Exception as e:
+                    st.error(f"❌ Erro: {e}")
+                finally:
+                    return_db_connection(conn)
+    else:
+        st.info("✅ Nenhuma pendência no momento!")
 
-Atenciosamente,
-Secretaria
-                                """
-                                
-                                ok, msg = enviar_email_real(email_resp, "Aviso de Cobrança", corpo)
-                                
-                                if ok:
-                                    st.success("📧 E-mail enviado!")
-                                else:
-                                    st.warning(f"⚠️ Erro: {msg}")
-                            
-                            if gerar_zap and aluno_data.iloc[0]['telefone_contato']:
-                                tel = limpar_telefone(aluno_data.iloc[0]['telefone_contato'])
-                                
-                                if tel:
-                                    if not tel.startswith("55"):
-                                        tel = "55" + tel
-                                    
-                                    msg_zap = f"Olá! Nova cobrança para {aluno_sel}.\n\nDescrição: {descricao}\nValor: R$ {valor:.2f}\nVencimento: {vencimento.strftime('%d/%m/%Y')}"
-                                    
-                                    link = f"https://wa.me/{tel}?text={urllib.parse.quote(msg_zap)}"
-                                    
-                                    st.markdown(f'<a href="{link}" target="_blank"><button style="background:#25D366; color:white; border:none; padding:10px 20px; border-radius:8px; cursor:pointer; font-weight:600;">📱 Enviar WhatsApp</button></a>', unsafe_allow_html=True)
+@fragmento
+def mensalidades_do_mes():
+    st.subheader("Gerar Mensalidades em Lote")
     
-    with aba2:
-        st.subheader("Contas em Aberto")
+    hoje = date.today()
+    turmas = get_data("SELECT id, nome_turma FROM turmas ORDER BY nome_turma")
+    
+    c1, c2, c3 = st.columns(3)
+    mes = c1.selectbox("Mês", list(range(1, 13)), index=hoje.month - 1, format_func=lambda m: f"{m:02d}")
+    ano = c2.number_input("Ano", min_value=2000, max_value=2100, value=hoje.year, step=1)
+    dia_venc = c3.number_input("Dia do vencimento", min_value=1, max_value=28, value=10, step=1)
+    
+    c4, c5, c6 = st.columns(3)
+    turma_sel = c4.selectbox("Turma", ["Todas"] + turmas['nome_turma'].tolist())
+    valor = c5.number_input("Valor (R$)", min_value=0.0, step=10.0, key="valor_mensalidade")
+    descricao = c6.text_input("Descrição", value=f"Mensalidade {mes:02d}/{int(ano)}")
+    
+    notificar = st.checkbox("📧 Enfileirar aviso por e-mail para os responsáveis")
+    
+    turma_id = None if turma_sel == "Todas" else int(turmas[turmas['nome_turma'] == turma_sel].iloc[0]['id'])
+    params = parametros_geracao(int(ano), mes, int(dia_venc), valor, descricao, turma_id, notificar)
+    
+    previa = get_data(QUERY_PREVIA, params, tabelas=('alunos', 'turmas', 'financeiro'))
+    
+    if previa.empty:
+        st.info("Nenhum aluno cursando para o filtro escolhido.")
+    else:
+        a_gerar = previa[~previa['ja_gerada'].astype(bool)]
         
-        q = """
-        SELECT f.id, a.nome, f.descricao, f.valor, f.vencimento, f.status 
-        FROM financeiro f 
-        JOIN alunos a ON f.aluno_id = a.id 
-        WHERE f.status = 'Pendente'
-        ORDER BY f.vencimento
-        LIMIT 50
-        """
+        m1, m2, m3 = st.columns(3)
+        m1.metric("Cobranças a gerar", len(a_gerar))
+        m2.metric("Já geradas neste mês", int(previa['ja_gerada'].sum()))
+        m3.metric("Total previsto", f"R$ {len(a_gerar) * valor:,.2f}")
         
-        df = get_data(q)
+        with st.expander("👀 Pré-visualização (nada é gravado)"):
+            st.dataframe(previa, use_container_width=True, hide_index=True)
         
-        if not df.empty:
-            st.dataframe(df, use_container_width=True, hide_index=True)
+        if st.button(f"💾 Gerar {len(a_gerar)} mensalidades", disabled=a_gerar.empty or valor <= 0, use_container_width=True):
+            conn = get_db_connection()
+            if conn:
+                try:
+                    criadas, enfileiradas = gerar_mensalidades(conn, params)
+                    invalidar_cache('financeiro', 'fila_envios')
+                    st.success(f"✅ {criadas} mensalidades geradas!" + (f" {enfileiradas} avisos enfileirados." if notificar else ""))
+                except Exception as e:
+                    st.error(f"❌ Erro ao gerar mensalidades: {e}")
+                finally:
+                    return_db_connection(conn)
+
+@fragmento
+def conciliacao_bancaria():
+    st.subheader("Conciliar Extrato / Arquivo de Retorno")
+    st.caption("CSV do extrato (colunas de data, valor e, se houver, documento com o ID da cobrança) ou retorno CNAB 240.")
+    
+    c1, c2 = st.columns([3, 1])
+    arquivo = c1.file_uploader("Arquivo do banco", type=["csv", "txt", "ret"], key="extrato_banco")
+    tolerancia = c2.number_input("Tolerância (dias)", min_value=0, max_value=60, value=TOLERANCIA_DIAS_PADRAO)
+    
+    if arquivo:
+        try:
+            extrato = ler_extrato(arquivo)
+        except Exception as e:
+            st.error(f"❌ Não foi possível ler o arquivo: {e}")
+            extrato = None
+        
+        if extrato is not None:
+            pendentes = get_data("""
+                SELECT f.id, a.nome, f.descricao, f.valor, f.vencimento
+                FROM financeiro f JOIN alunos a ON f.aluno_id = a.id
+                WHERE f.status = 'Pendente'
+            """)
+            conciliados, nao_conciliados = conciliar(extrato, pendentes, tolerancia)
+            
+            m1, m2, m3 = st.columns(3)
+            m1.metric("Créditos no arquivo", len(extrato))
+            m2.metric("✅ Conciliados", len(conciliados), f"R$ {conciliados['valor'].sum():,.2f}", delta_color="off")
+            m3.metric("⚠️ Sem correspondência", len(nao_conciliados))
             
-            col1, col2 = st.columns([3, 1])
+            if not conciliados.empty:
+                st.dataframe(conciliados, use_container_width=True, hide_index=True)
             
-            id_baixa = col1.number_input("ID para Confirmar", min_value=0, step=1)
+            if not nao_conciliados.empty:
+                with st.expander("Relatório de linhas não conciliadas", expanded=conciliados.empty):
+                    st.dataframe(nao_conciliados, use_container_width=True, hide_index=True)
+                    st.download_button("⬇️ Baixar relatório", nao_conciliados.to_csv(index=False, sep=';').encode('utf-8-sig'),
+                                       file_name="nao_conciliados.csv", mime="text/csv")
             
-            if col2.button("✅ Confirmar", use_container_width=True):
-                if id_baixa > 0 and id_baixa in df['id'].values:
-                    if run_query("UPDATE financeiro SET status='Pago' WHERE id=%s", (id_baixa,)):
-                        st.success(f"✅ Pagamento ID {id_baixa} confirmado!")
-                        get_data.clear()
-                        st.rerun()
+            if st.button(f"✅ Baixar {len(conciliados)} pagamentos", disabled=conciliados.empty, use_container_width=True):
+                conn = get_db_connection()
+                if conn:
+                    try:
+                        baixadas = baixar_pagamentos(conn, conciliados['financeiro_id'])
+                        invalidar_cache('financeiro')
+                        st.success(f"✅ {baixadas} pagamentos confirmados!")
+                    except Exception as e:
+                        st.error(f"❌ Erro na baixa (nada foi gravado): {e}")
+                    finally:
+                        return_db_connection(conn)
+
+@fragmento
+def carnes_pdf():
+    st.subheader("Carnês de Pagamento em PDF")
+    st.caption("Um PDF por aluno com as cobranças pendentes do período, todos reunidos num arquivo ZIP.")
+    
+    turmas_carne = get_data("SELECT id, nome_turma FROM turmas ORDER BY nome_turma")
+    
+    c1, c2, c3 = st.columns(3)
+    turma_carne = c1.selectbox("Turma", ["Todas"] + turmas_carne['nome_turma'].tolist(), key="turma_carne")
+    inicio = c2.date_input("Vencimentos a partir de", value=date(date.today().year, 1, 1), key="carne_inicio")
+    fim = c3.date_input("Até", value=date(date.today().year, 12, 31), key="carne_fim")
+    
+    if st.button("🖨️ Gerar Carnês", use_container_width=True):
+        turma_id = None if turma_carne == "Todas" else int(turmas_carne[turmas_carne['nome_turma'] == turma_carne].iloc[0]['id'])
+        conn = get_db_connection()
+        if conn:
+            arquivo = tempfile.TemporaryFile(suffix=".zip")
+            try:
+                with st.spinner("Gerando carnês..."):
+                    from carnes import gerar_carnes
+                    total = gerar_carnes(conn, arquivo, turma_id, inicio, fim)
+            except Exception as e:
+                conn.rollback()
+                st.error(f"❌ Erro ao gerar carnês: {e}")
+                total = None
+            finally:
+                return_db_connection(conn)
+            
+            def entregar():
+                # O ZIP fica no arquivo temporário (em disco) até o download.
+                arquivo.seek(0)
+                return arquivo
+            
+            if total:
+                st.success(f"✅ {total} carnês gerados!")
+                st.download_button("⬇️ Baixar ZIP", entregar, file_name=f"carnes_{inicio:%Y%m}_{fim:%Y%m}.zip",
+                                   mime="application/zip", on_click="ignore", use_container_width=True)
+            else:
+                arquivo.close()
+                if total == 0:
+                    st.info("Nenhuma cobrança pendente no período.")
+
+def financeiro_page():
+    st.title("💰 Gestão Financeira")
+    
+    aba1, aba2, aba3, aba4, aba5 = st.tabs(["➕ Nova Cobrança", "📋 Gerenciar Pagamentos", "📆 Mensalidades do Mês",
+                                            "🏦 Conciliação Bancária", "🖨️ Carnês"])
+    
+    with aba1:
+        nova_cobranca()
+    
+    with aba2:
+        contas_em_aberto()
+    
+    with aba3:
+        mensalidades_do_mes()
+    
+    with aba4:
+        conciliacao_bancaria()
+    
+    with aba5:
+        carnes_pdf()
+
+# ==============================================================================
+# ANÁLISES
+# ==============================================================================
+
+def get_analise(consulta, meses=MESES_PADRAO):
+    # Uma consulta agregada por visão; a chave do cache leva a data de hoje
+    # e a entrada expira na virada do dia (ou antes, se houver escrita).
+    return get_data(consulta(dialeto(init_connection_pool())), parametros_analises(meses=meses),
+                    tabelas=TABELAS_ANALISES, ttl=segundos_ate_amanha())
+
+def layout_grafico(fig, **kwargs):
+    fig.update_layout(
+        height=400,
+        plot_bgcolor='rgba(0,0,0,0)',
+        paper_bgcolor='rgba(0,0,0,0)',
+        **kwargs
+    )
+    return fig
+
+def analises_page():
+    import plotly.graph_objects as go
+    
+    st.title("📉 Análises Financeiras")
+    
+    meses = st.select_slider("Período", options=[3, 6, 12, 24], value=MESES_PADRAO,
+                             format_func=lambda m: f"Últimos {m} meses")
+    
+    aba1, aba2, aba3 = st.tabs(["⏳ Atraso por Faixa", "🏫 Receita por Turma", "💵 Recebido x Faturado"])
+    
+    with aba1:
+        df = get_analise(consulta_aging)
+        if df.empty or not df['cobrancas'].sum():
+            st.info("Nenhuma cobrança em atraso! 🎉")
+        else:
+            total = df[df['nivel'] == 3].iloc[0]
+            faixas = df[df['nivel'] == 1].set_index('faixa')[['valor', 'percentual']].reindex(FAIXAS_ROTULOS, fill_value=0)
+            
+            c1, c2, c3, c4 = st.columns(4)
+            c1.metric("Total em atraso", f"R$ {total['valor']:,.2f}")
+            c2.metric("Cobranças", int(total['cobrancas']))
+            c3.metric("Alunos", int(total['alunos']))
+            c4.metric("Acima de 90 dias", f"{faixas.loc['90+', 'percentual']:.1f}%")
+            
+            fig = go.Figure(go.Bar(
+                x=[f"{faixa} dias" for faixa in faixas.index],
+                y=faixas['valor'],
+                marker_color=['#ffd166', '#f8961e', '#f3722c', '#ef476f'],
+                text=faixas['valor'].apply(lambda x: f'R$ {x:,.0f}'),
+                textposition='outside'
+            ))
+            st.plotly_chart(layout_grafico(fig, xaxis_title="Dias em atraso", yaxis_title="Valor (R$)", showlegend=False),
+                            use_container_width=True)
+            
+            detalhe = df[df['nivel'] == 0]
+            fig = go.Figure([
+                go.Bar(name=f"{faixa} dias", x=grupo['turma'], y=grupo['valor'])
+                for faixa, grupo in detalhe.groupby('faixa')
+            ])
+            st.plotly_chart(layout_grafico(fig, barmode='stack', xaxis_title="Turma", yaxis_title="Valor (R$)"),
+                            use_container_width=True)
+            
+            st.dataframe(detalhe[['turma', 'faixa', 'cobrancas', 'alunos', 'valor', 'percentual']]
+                         .sort_values(['faixa', 'valor'], ascending=[True, False]),
+                         hide_index=True, use_container_width=True,
+                         column_config={'valor': st.column_config.NumberColumn("Valor", format="R$ %.2f"),
+                                        'percentual': st.column_config.NumberColumn("% do total", format="%.1f%%")})
+    
+    with aba2:
+        df = get_analise(consulta_receita_turmas, meses)
+        if df.empty:
+            st.info("Nenhuma cobrança no período.")
         else:
-            st.info("✅ Nenhuma pendência no momento!")
+            detalhe = df[df['nivel'] == 0]
+            fig = go.Figure([
+                go.Bar(name=turma, x=grupo['mes'], y=grupo['recebido'])
+                for turma, grupo in detalhe.groupby('turma')
+            ])
+            st.plotly_chart(layout_grafico(fig, barmode='stack', xaxis_title="Mês", yaxis_title="Recebido (R$)"),
+                            use_container_width=True)
+            
+            turmas = df[df['nivel'] == 2]
+            st.dataframe(turmas[['turma', 'faturado', 'recebido', 'taxa', 'participacao']].sort_values('recebido', ascending=False),
+                         hide_index=True, use_container_width=True,
+                         column_config={'faturado': st.column_config.NumberColumn("Faturado", format="R$ %.2f"),
+                                        'recebido': st.column_config.NumberColumn("Recebido", format="R$ %.2f"),
+                                        'taxa': st.column_config.NumberColumn("% recebido", format="%.1f%%"),
+                                        'participacao': st.column_config.NumberColumn("% da receita", format="%.1f%%")})
+    
+    with aba3:
+        df = get_analise(consulta_recebido_faturado, meses)
+        if df.empty or not df['cobrancas'].sum():
+            st.info("Nenhuma cobrança no período.")
+        else:
+            total = df[df['nivel'] == 1].iloc[0]
+            c1, c2, c3 = st.columns(3)
+            c1.metric("Faturado", f"R$ {total['faturado']:,.2f}")
+            c2.metric("Recebido", f"R$ {total['recebido']:,.2f}")
+            c3.metric("Taxa de recebimento", f"{total['taxa']:.1f}%")
+            
+            mensal = df[df['nivel'] == 0]
+            fig = go.Figure([
+                go.Bar(name="Faturado", x=mensal['mes'], y=mensal['faturado'], marker_color='#118ab2'),
+                go.Bar(name="Recebido", x=mensal['mes'], y=mensal['recebido'], marker_color='#06d6a0'),
+                go.Scatter(name="Taxa (%)", x=mensal['mes'], y=mensal['taxa'], yaxis='y2', mode='lines+markers',
+                           line=dict(color='#ef476f')),
+            ])
+            st.plotly_chart(layout_grafico(fig, barmode='group', xaxis_title="Mês", yaxis_title="Valor (R$)",
+                                           yaxis2=dict(title="Taxa (%)", overlaying='y', side='right', range=[0, 105])),
+                            use_container_width=True)
+            
+            st.dataframe(mensal[['mes', 'cobrancas', 'faturado', 'recebido', 'taxa', 'faturado_acumulado', 'recebido_acumulado']],
+                         hide_index=True, use_container_width=True,
+                         column_config={col: st.column_config.NumberColumn(format="R$ %.2f")
+                                        for col in ('faturado', 'recebido', 'faturado_acumulado', 'recebido_acumulado')})
 
 # ==============================================================================
 # TURMAS
@@ -744,11 +1379,10 @@ def turmas_page():
         SELECT t.id, t.nome_turma, p.nome as professor, t.ativa 
         FROM turmas t 
         LEFT JOIN professores p ON t.professor_id = p.id
-        ORDER BY t.nome_turma
         """
-        df = get_data(q)
+        df = consulta_paginada("turmas", q, ('t.nome_turma', 't.id'), arrow=True)
         
-        if not df.empty:
+        if len(df):
             st.dataframe(df, use_container_width=True, hide_index=True)
         else:
             st.info("Nenhuma turma cadastrada.")
@@ -757,137 +1391,460 @@ def turmas_page():
 # COMUNICAÇÃO
 # ==============================================================================
 
+def registrar_envios_email(resultados):
+    entregues = [(int(r['financeiro_id']), r['tipo_aviso'], 'email', r['destinatario']) for r in resultados if r['ok']]
+    
+    if not entregues:
+        return
+    
+    conn = get_db_connection()
+    if not conn:
+        return
+    
+    try:
+        registrar_envios(conn, entregues)
+        invalidar_cache('fila_envios', 'log_envios')
+    except Exception as e:
+        conn.rollback()
+        st.warning(f"⚠️ Envio não registrado no histórico: {e}")
+    finally:
+        return_db_connection(conn)
+
+ROTULOS_AVISO = {'cobranca': "Nova cobrança", 'lembrete': f"Vence em {DIAS_ANTECEDENCIA} dias",
+                 'hoje': "Vence hoje", 'atrasado': "Em atraso"}
+
+# Cobrança fictícia para a pré-visualização dos modelos.
+EXEMPLO_MODELO = {'nome': "Maria Silva", 'mae_nome': "Ana Silva", 'descricao': "Mensalidade 03/2025",
+                  'valor': 450.0, 'telefone_contato': "(11) 99999-0000"}
+
+def emails_pendentes(df):
+    return df[df['email_responsavel'].fillna('').str.contains('@') & ~df['email_enviado'].astype(bool)]
+
+def enviar_avisos(df, tipo_aviso):
+    assuntos, corpos = renderizar_emails(df, tipo_aviso, get_modelos()[0])
+    mensagens = [
+        {
+            'financeiro_id': financeiro_id,
+            'tipo_aviso': tipo_aviso,
+            'nome': nome,
+            'destinatario': destinatario,
+            'assunto': assunto,
+            'corpo': corpo,
+        }
+        for financeiro_id, nome, destinatario, assunto, corpo
+        in zip(df['id'].tolist(), df['nome'], df['email_responsavel'], assuntos, corpos)
+    ]
+    
+    with st.spinner(f"Enviando {len(mensagens)} e-mails..."):
+        resultados = enviar_emails(mensagens)
+        registrar_envios_email(resultados)
+    return resultados
+
+@fragmento
+def lista_avisos(tipo_aviso, vencimento, chave, vazio):
+    # Grade com seleção: enviar e-mails refaz só esta lista.
+    df = get_data(QUERY_AVISOS_DIA, (tipo_aviso, str(vencimento)))
+    
+    resultados = st.session_state.pop(f"resultado_{chave}", None)
+    if resultados:
+        resultados = pd.DataFrame(resultados)
+        enviados = int(resultados['ok'].sum())
+        if enviados == len(resultados):
+            st.success(f"✅ {enviados} e-mails enviados!")
+        else:
+            st.warning(f"⚠️ {enviados} de {len(resultados)} e-mails enviados.")
+            st.dataframe(resultados[['nome', 'destinatario', 'ok', 'detalhe']], use_container_width=True, hide_index=True)
+    
+    if df.empty:
+        st.info(vazio)
+        return
+    
+    st.caption(f"{len(df)} cobranças encontradas")
+    
+    grade = pd.DataFrame({
+        'nome': df['nome'],
+        'valor': df['valor'].astype(float),
+        'email': df['email_responsavel'].where(~df['email_enviado'].astype(bool), "✅ enviado"),
+        'whatsapp': renderizar_whatsapp(df, tipo_aviso, get_modelos()[1])[1],
+    })
+    
+    # A chave muda quando as linhas ou os envios mudam: a seleção antiga não
+    # aponta para outra cobrança.
+    selecao = st.dataframe(grade, use_container_width=True, hide_index=True, on_select="rerun", selection_mode="multi-row",
+                           key=f"sel_{chave}_{hash((tuple(df['id']), tuple(df['email_enviado'])))}",
+                           column_config={
+                               "valor": st.column_config.NumberColumn("Valor", format="R$ %.2f"),
+                               "whatsapp": st.column_config.LinkColumn("WhatsApp", display_text="📱 Abrir"),
+                           })
+    
+    selecionados = emails_pendentes(df.iloc[selecao.selection.rows])
+    todos = emails_pendentes(df)
+    
+    c1, c2 = st.columns(2)
+    enviar = None
+    if c1.button(f"📧 Enviar selecionados ({len(selecionados)})", key=f"{chave}_sel", disabled=selecionados.empty, use_container_width=True):
+        enviar = selecionados
+    if c2.button(f"📨 Enviar todos os e-mails ({len(todos)})", key=f"{chave}_todos", disabled=todos.empty, use_container_width=True):
+        enviar = todos
+    
+    if enviar is not None:
+        st.session_state[f"resultado_{chave}"] = enviar_avisos(enviar, tipo_aviso)
+        refazer_fragmento()
+
+@fragmento
+def planilha_whatsapp_dia():
+    hoje = date.today()
+    df = get_data(QUERY_WHATSAPP_DIA, janelas_avisos(hoje))
+    
+    if df.empty:
+        st.caption("Nenhum aviso de WhatsApp para hoje.")
+        return
+    
+    contagem = df['tipo_aviso'].value_counts()
+    st.caption(" · ".join(f"{ROTULOS_AVISO[tipo]}: {int(contagem.get(tipo, 0))}" for tipo in ('lembrete', 'hoje', 'atrasado')))
+    
+    # Os textos e links só são gerados no clique.
+    def gerar_planilha():
+        planilha = planilha_whatsapp(df, get_modelos()[1], hoje)
+        planilha['tipo_aviso'] = planilha['tipo_aviso'].map(ROTULOS_AVISO)
+        return planilha.to_csv(index=False, sep=';').encode('utf-8-sig')
+    
+    st.download_button(f"📱 Baixar planilha de links WhatsApp ({len(df)})", gerar_planilha,
+                       file_name=f"whatsapp_{hoje:%Y%m%d}.csv", mime="text/csv", on_click="ignore", use_container_width=True)
+
+@fragmento
+def editor_modelos():
+    canal = st.radio("Canal", ["📧 E-mail", "📱 WhatsApp"], horizontal=True, key="modelo_canal")
+    email = canal == "📧 E-mail"
+    tabela = 'templates_email' if email else 'templates_whatsapp'
+    padroes = MODELOS_EMAIL_PADRAO if email else MODELOS_WHATSAPP_PADRAO
+    modelos = get_modelos()[0 if email else 1]
+    
+    tipos = {nome + ('' if email else SUFIXO_WHATSAPP): tipo for tipo, nome in MODELOS_AVISO.items()}
+    nome = st.selectbox("Modelo", list(modelos), key=f"modelo_{tabela}",
+                        format_func=lambda n: f"{n} ({ROTULOS_AVISO[tipos[n]]})" if n in tipos else n)
+    
+    chave = f"modelo_{tabela}_{nome}"
+    if email:
+        assunto = st.text_input("Assunto", value=modelos[nome][0], key=f"{chave}_assunto")
+        texto = st.text_area("Mensagem", value=modelos[nome][1], height=260, key=f"{chave}_texto")
+        atual = (assunto, texto)
+    else:
+        texto = st.text_area("Mensagem", value=modelos[nome], height=200, key=f"{chave}_texto")
+        atual = texto
+    st.caption("Campos: " + " · ".join(f"`{{{campo}}}` {descricao}" for campo, descricao in CAMPOS_MODELO.items()))
+    
+    try:
+        compilados = [compilar(t) for t in (atual if email else (atual,))]
+        erro = None
+    except ValueError as e:
+        erro = str(e)
+    
+    if erro:
+        st.error(f"❌ {erro}")
+    else:
+        tipo = tipos.get(nome, 'cobranca')
+        dias = {'lembrete': DIAS_ANTECEDENCIA, 'hoje': 0, 'atrasado': -10}.get(tipo, 10)
+        exemplo = pd.DataFrame([dict(EXEMPLO_MODELO, vencimento=date.today() + timedelta(days=dias))])
+        with st.container(border=True):
+            st.caption("Pré-visualização com uma cobrança fictícia")
+            renderizados = [renderizar_lote(modelo, exemplo).iloc[0] for modelo in compilados]
+            if email:
+                st.markdown(f"**{renderizados[0]}**")
+            st.text(renderizados[-1])
+    
+    c1, c2 = st.columns(2)
+    if c1.button("💾 Salvar modelo", disabled=erro is not None or atual == modelos[nome], use_container_width=True):
+        if email:
+            q = """INSERT INTO templates_email (nome_interno, assunto, corpo) VALUES (%s, %s, %s)
+                   ON CONFLICT (nome_interno) DO UPDATE SET assunto = EXCLUDED.assunto, corpo = EXCLUDED.corpo"""
+            params = (nome, assunto, texto)
+        else:
+            q = """INSERT INTO templates_whatsapp (nome_interno, mensagem) VALUES (%s, %s)
+                   ON CONFLICT (nome_interno) DO UPDATE SET mensagem = EXCLUDED.mensagem"""
+            params = (nome, texto)
+        if run_query(q, params):
+            st.toast("✅ Modelo salvo!")
+            refazer_fragmento()
+    
+    personalizado = nome in padroes and modelos[nome] != padroes[nome]
+    if c2.button("↩️ Restaurar padrão", disabled=not personalizado, use_container_width=True):
+        if run_query(f"DELETE FROM {tabela} WHERE nome_interno = %s", (nome,)):
+            for sufixo in ('_assunto', '_texto'):
+                st.session_state.pop(chave + sufixo, None)
+            st.toast("✅ Modelo padrão restaurado!")
+            refazer_fragmento()
+
+@fragmento
+def fila_de_envios():
+    resumo = get_data("SELECT status, COUNT(*) AS quantidade FROM fila_envios GROUP BY status ORDER BY status")
+    
+    if not resumo.empty:
+        cols = st.columns(len(resumo))
+        for col, (_, linha) in zip(cols, resumo.iterrows()):
+            col.metric(linha['status'].capitalize(), int(linha['quantidade']))
+    else:
+        st.info("A fila está vazia.")
+    
+    if st.button("➕ Enfileirar avisos de hoje", use_container_width=True):
+        conn = get_db_connection()
+        if conn:
+            try:
+                novos = enfileirar_avisos(conn)
+                st.toast(f"✅ {novos} avisos enfileirados!")
+                invalidar_cache('fila_envios')
+            except Exception as e:
+                conn.rollback()
+                st.error(f"❌ Erro: {e}")
+            finally:
+                return_db_connection(conn)
+            refazer_fragmento()
+    
+    falhas = get_data("""
+    SELECT q.financeiro_id, a.nome, q.tipo_aviso, q.destinatario, q.tentativas, q.ultimo_erro, q.proxima_tentativa
+    FROM fila_envios q
+    JOIN financeiro f ON q.financeiro_id = f.id
+    JOIN alunos a ON f.aluno_id = a.id
+    WHERE q.status IN ('erro', 'falhou')
+    ORDER BY q.atualizado_em DESC
+    LIMIT 50
+    """)
+    
+    if not falhas.empty:
+        st.markdown("**Últimas falhas**")
+        st.dataframe(falhas, use_container_width=True, hide_index=True)
+
 def comunicacao_page():
     st.title("📧 Comunicação Automática")
     
-    tab1, tab2 = st.tabs(["🤖 Robô de Disparos", "📝 Templates"])
+    tab1, tab2, tab3 = st.tabs(["🤖 Robô de Disparos", "📬 Fila de Envios", "📝 Templates"])
     
     with tab1:
         st.subheader("Avisos Automáticos de Cobrança")
         
         hoje = date.today()
-        hoje_str = str(hoje)
-        daqui_5 = str(hoje + timedelta(days=5))
-        
         col_a, col_b = st.columns(2)
         
         with col_a:
-            st.warning(f"📅 Vencendo em 5 dias")
-            
-            q = """
-            SELECT f.id, a.nome, a.email_responsavel, a.telefone_contato, a.mae_nome, 
-            f.descricao, f.valor, f.vencimento 
-            FROM financeiro f 
-            JOIN alunos a ON f.aluno_id = a.id 
-            WHERE f.vencimento = %s AND f.status = 'Pendente'
-            ORDER BY a.nome
-            """
-            df_5 = get_data(q, (daqui_5,))
-            
-            if not df_5.empty:
-                st.caption(f"{len(df_5)} cobranças encontradas")
-                
-                for _, row in df_5.iterrows():
-                    with st.container():
-                        st.markdown(f"**{row['nome']}** - R$ {row['valor']:.2f}")
-                        
-                        if row['email_responsavel']:
-                            if st.button(f"📧 Enviar E-mail", key=f"email5_{row['id']}"):
-                                corpo = f"""
-Olá!
-
-A cobrança de {row['nome']} vence em 5 dias ({datetime.strptime(row['vencimento'], '%Y-%m-%d').strftime('%d/%m/%Y')}).
-
-Descrição: {row['descricao']}
-Valor: R$ {row['valor']:.2f}
-
-Atenciosamente,
-Secretaria
-                                """
-                                ok, msg = enviar_email_real(row['email_responsavel'], "Lembrete de Vencimento", corpo)
-                                if ok:
-                                    st.success("✅ Enviado!")
-                                else:
-                                    st.error(f"❌ {msg}")
-                        
-                        tel = limpar_telefone(row['telefone_contato'])
-                        if tel:
-                            if not tel.startswith("55"):
-                                tel = "55" + tel
-                            
-                            msg = f"Olá! A mensalidade de {row['nome']} vence em 5 dias. Valor: R$ {row['valor']:.2f}"
-                            link = f"https://wa.me/{tel}?text={urllib.parse.quote(msg)}"
-                            
-                            st.markdown(f'<a href="{link}" target="_blank"><button style="background:#25D366; color:white; border:none; padding:8px 16px; border-radius:6px; cursor:pointer;">📱 WhatsApp</button></a>', unsafe_allow_html=True)
-                        
-                        st.divider()
-            else:
-                st.info("Nenhuma cobrança vencendo em 5 dias.")
+            st.warning(f"📅 Vencendo em {DIAS_ANTECEDENCIA} dias")
+            lista_avisos('lembrete', hoje + timedelta(days=DIAS_ANTECEDENCIA), "email5",
+                         f"Nenhuma cobrança vencendo em {DIAS_ANTECEDENCIA} dias.")
         
         with col_b:
             st.error(f"🚨 Vencendo HOJE")
+            lista_avisos('hoje', hoje, "emailhj", "Nenhuma cobrança vencendo hoje.")
+        
+        st.markdown("---")
+        planilha_whatsapp_dia()
+    
+    with tab2:
+        st.subheader("📬 Fila de Envios Automáticos")
+        st.caption("Os avisos enfileirados são enviados pelo robô `python avisos.py` (via cron ou com `--loop`), fora desta página.")
+        
+        fila_de_envios()
+    
+    with tab3:
+        st.subheader("📝 Gerenciar Templates de Mensagem")
+        st.caption("Os modelos valem para os envios desta tela, do robô de avisos e da nova cobrança.")
+        
+        editor_modelos()
+
+# ==============================================================================
+# HISTÓRICO ESCOLAR
+# ==============================================================================
+
+def historico_page():
+    from historico import DISCIPLINAS, MEDIA_APROVACAO, FREQUENCIA_MINIMA, DIAS_LETIVOS_PADRAO, QUERY_FECHAMENTO, QUERY_HISTORICOS, fechar_ano, gravar_fechamento, renderizar_historicos
+    
+    st.title("🎓 Histórico Escolar")
+    
+    aba1, aba2 = st.tabs(["📝 Fechamento do Ano", "🖨️ Emitir Históricos"])
+    
+    turmas = get_data("SELECT id, nome_turma FROM turmas ORDER BY nome_turma")
+    if turmas.empty:
+        st.info("Nenhuma turma cadastrada.")
+        return
+    
+    with aba1:
+        c1, c2, c3 = st.columns(3)
+        turma_sel = c1.selectbox("Turma", turmas['nome_turma'].tolist(), key="hist_turma")
+        ano = c2.number_input("Ano letivo", min_value=2000, max_value=2100, value=date.today().year, step=1)
+        dias_letivos = c3.number_input("Dias letivos", min_value=1, max_value=366, value=DIAS_LETIVOS_PADRAO, step=1)
+        
+        turma_id = int(turmas[turmas['nome_turma'] == turma_sel].iloc[0]['id'])
+        notas = get_data(QUERY_FECHAMENTO, (int(ano), turma_id), tabelas=('alunos', 'historico_escolar'))
+        
+        if notas.empty:
+            st.info("Nenhum aluno cursando nesta turma.")
+        else:
+            notas = notas.assign(frequencia_aluno=notas['frequencia_aluno'].fillna(dias_letivos))
             
-            q = """
-            SELECT f.id, a.nome, a.email_responsavel, a.telefone_contato, a.mae_nome, 
-            f.descricao, f.valor, f.vencimento 
-            FROM financeiro f 
-            JOIN alunos a ON f.aluno_id = a.id 
-            WHERE f.vencimento = %s AND f.status = 'Pendente'
-            ORDER BY a.nome
-            """
-            df_hj = get_data(q, (hoje_str,))
+            colunas = {col: st.column_config.NumberColumn(rotulo, min_value=0.0, max_value=10.0, step=0.1, format="%.1f")
+                       for col, rotulo in DISCIPLINAS.items()}
+            colunas['aluno_id'] = None
+            colunas['nome'] = st.column_config.TextColumn("Aluno", disabled=True)
+            colunas['frequencia_aluno'] = st.column_config.NumberColumn("Dias presentes", min_value=0, max_value=int(dias_letivos), step=1)
+            colunas['obs'] = st.column_config.TextColumn("Observações")
             
-            if not df_hj.empty:
-                st.caption(f"{len(df_hj)} cobranças encontradas")
-                
-                for _, row in df_hj.iterrows():
-                    with st.container():
-                        st.markdown(f"**{row['nome']}** - R$ {row['valor']:.2f}")
-                        
-                        if row['email_responsavel']:
-                            if st.button(f"📧 Enviar E-mail", key=f"emailhj_{row['id']}"):
-                                corpo = f"""
-Olá!
+            st.caption(f"Aprovação com nota mínima {MEDIA_APROVACAO:.1f} em cada disciplina e frequência de {FREQUENCIA_MINIMA:.0f}%.")
+            editadas = st.data_editor(notas, column_config=colunas, hide_index=True, use_container_width=True,
+                                      num_rows="fixed", key=f"notas_{turma_id}_{int(ano)}")
+            
+            resultado = fechar_ano(editadas, int(dias_letivos))
+            
+            m1, m2, m3 = st.columns(3)
+            m1.metric("✅ Aprovados", int(resultado['resultado_final'].eq('Aprovado').sum()))
+            m2.metric("❌ Reprovados", int(resultado['resultado_final'].eq('Reprovado').sum()))
+            m3.metric("⏳ Sem notas", int(resultado['resultado_final'].eq('').sum()))
+            
+            if st.button(f"🔒 Fechar {int(ano)} da turma {turma_sel}", use_container_width=True):
+                conn = get_db_connection()
+                if conn:
+                    try:
+                        gravados = gravar_fechamento(conn, resultado, int(ano), turma_sel, int(dias_letivos))
+                        invalidar_cache('historico_escolar')
+                        st.success(f"✅ Ano fechado para {gravados} alunos!")
+                    except Exception as e:
+                        st.error(f"❌ Erro no fechamento (nada foi gravado): {e}")
+                    finally:
+                        return_db_connection(conn)
+            
+            with st.expander("📊 Resultado calculado"):
+                st.dataframe(resultado[['nome', 'media_geral', 'percentual_frequencia', 'resultado_final', 'obs']],
+                             use_container_width=True, hide_index=True)
+    
+    with aba2:
+        turma_emissao = st.selectbox("Turma", turmas['nome_turma'].tolist(), key="hist_turma_emissao")
+        turma_id = int(turmas[turmas['nome_turma'] == turma_emissao].iloc[0]['id'])
+        
+        historicos = get_data(QUERY_HISTORICOS, (turma_id,), tabelas=('alunos', 'historico_escolar'))
+        
+        if historicos.empty:
+            st.info("Nenhum histórico registrado para os alunos desta turma.")
+        else:
+            st.caption(f"{historicos['aluno_id'].nunique()} alunos com histórico")
+            
+            if st.button("🖨️ Gerar PDF da Turma", use_container_width=True):
+                with st.spinner("Gerando históricos..."):
+                    pdf = renderizar_historicos(historicos)
+                st.download_button("⬇️ Baixar PDF", pdf, file_name=f"historicos_{turma_emissao}.pdf",
+                                   mime="application/pdf", on_click="ignore", use_container_width=True)
 
-A cobrança de {row['nome']} VENCE HOJE!
+# ==============================================================================
+# IMPORTAÇÃO
+# ==============================================================================
 
-Descrição: {row['descricao']}
-Valor: R$ {row['valor']:.2f}
+def importacao_page():
+    st.title("📥 Importação em Lote")
+    
+    entidade = st.selectbox("O que deseja importar?", list(ENTIDADES_IMPORTACAO))
+    arquivo = st.file_uploader("Arquivo CSV ou Excel", type=["csv", "xlsx"])
+    
+    if not arquivo:
+        st.info("💡 A primeira linha do arquivo deve ter os nomes das colunas. Datas em AAAA-MM-DD ou DD/MM/AAAA.")
+        return
+    
+    try:
+        df_origem = ler_arquivo(arquivo, arquivo.name)
+    except Exception as e:
+        st.error(f"❌ Não foi possível ler o arquivo: {e}")
+        return
+    
+    st.caption(f"{len(df_origem)} linhas encontradas")
+    st.dataframe(df_origem.head(10), use_container_width=True, hide_index=True)
+    
+    config = ENTIDADES_IMPORTACAO[entidade]
+    sugestao = sugerir_mapeamento(df_origem.columns, config['campos'])
+    opcoes = [""] + list(df_origem.columns)
+    
+    st.subheader("🔗 Mapeamento de Colunas")
+    
+    mapeamento = {}
+    cols = st.columns(3)
+    for i, (campo, (_, obrigatorio)) in enumerate(config['campos'].items()):
+        padrao = sugestao.get(campo)
+        escolha = cols[i % 3].selectbox(
+            f"{campo}{' *' if obrigatorio else ''}", opcoes,
+            index=opcoes.index(padrao) if padrao in opcoes else 0,
+            key=f"imp_{entidade}_{campo}")
+        mapeamento[campo] = escolha or None
+    
+    turmas = get_data("SELECT id, nome_turma FROM turmas")
+    alunos_cpf = get_data("SELECT id, cpf FROM alunos WHERE cpf IS NOT NULL AND cpf <> ''") if entidade == 'Cobranças' else pd.DataFrame(columns=['id', 'cpf'])
+    
+    cpfs_existentes = set()
+    if config['tabela'] in ('alunos', 'professores'):
+        existentes = get_data(f"SELECT cpf FROM {config['tabela']} WHERE cpf IS NOT NULL AND cpf <> ''")
+        cpfs_existentes = set(so_digitos(existentes['cpf'])) if not existentes.empty else set()
+    
+    validos, erros = validar(df_origem, entidade, mapeamento, turmas, alunos_cpf, cpfs_existentes)
+    
+    c1, c2 = st.columns(2)
+    c1.metric("✅ Linhas válidas", len(validos))
+    c2.metric("⚠️ Linhas com erro", len(erros))
+    
+    if not erros.empty:
+        with st.expander("Relatório de erros", expanded=True):
+            st.dataframe(erros, use_container_width=True, hide_index=True)
+            st.download_button("⬇️ Baixar relatório de erros", erros.to_csv(index=False).encode('utf-8-sig'),
+                               file_name="erros_importacao.csv", mime="text/csv")
+    
+    if st.button(f"📥 Importar {len(validos)} linhas válidas", disabled=validos.empty, use_container_width=True):
+        conn = get_db_connection()
+        if not conn:
+            return
+        
+        try:
+            with st.spinner("Importando..."):
+                inseridas = carregar_copy(conn, config['tabela'], validos)
+            invalidar_cache(config['tabela'])
+            st.success(f"✅ {inseridas} registros importados!")
+        except Exception as e:
+            st.error(f"❌ Erro na importação (nada foi gravado): {e}")
+        finally:
+            return_db_connection(conn)
 
-Atenciosamente,
-Secretaria
-                                """
-                                ok, msg = enviar_email_real(row['email_responsavel'], "Fatura Vence Hoje!", corpo)
-                                if ok:
-                                    st.success("✅ Enviado!")
-                                else:
-                                    st.error(f"❌ {msg}")
-                        
-                        tel = limpar_telefone(row['telefone_contato'])
-                        if tel:
-                            if not tel.startswith("55"):
-                                tel = "55" + tel
-                            
-                            msg = f"🚨 Atenção! A mensalidade de {row['nome']} vence HOJE. Valor: R$ {row['valor']:.2f}"
-                            link = f"https://wa.me/{tel}?text={urllib.parse.quote(msg)}"
-                            
-                            st.markdown(f'<a href="{link}" target="_blank"><button style="background:#ef476f; color:white; border:none; padding:8px 16px; border-radius:6px; cursor:pointer;">🚨 WhatsApp</button></a>', unsafe_allow_html=True)
-                        
-                        st.divider()
-            else:
-                st.info("Nenhuma cobrança vencendo hoje.")
+# ==============================================================================
+# EXPORTAÇÃO
+# ==============================================================================
+
+def exportacao_page():
+    st.title("📤 Exportação de Dados")
     
-    with tab2:
-        st.subheader("📝 Gerenciar Templates de Mensagem")
-        st.info("Em desenvolvimento. Em breve você poderá criar templates personalizados!")
+    nome = st.selectbox("O que deseja exportar?", list(EXPORTACOES))
+    formato = st.radio("Formato", list(FORMATOS_EXPORTACAO), horizontal=True)
+    
+    status, inicio, fim = None, None, None
+    if EXPORTACOES[nome].get('filtros'):
+        c1, c2, c3 = st.columns(3)
+        status = c1.selectbox("Status", ["Todos", "Pendente", "Pago"], key="exp_status")
+        inicio = c2.date_input("Vencimentos a partir de", value=None, key="exp_inicio")
+        fim = c3.date_input("Até", value=None, key="exp_fim")
+    params = parametros_exportacao(nome, None if status == "Todos" else status, inicio, fim)
+    
+    pool_obj = init_connection_pool()
+    if not pool_obj:
+        return
+    
+    def gerar_arquivo():
+        # Roda numa thread à parte quando o botão é clicado: o arquivo é
+        # escrito em disco, lote a lote, e só então entregue ao navegador.
+        arquivo = tempfile.TemporaryFile()
+        with pool_obj.conexao() as conn:
+            exportar(conn, nome, formato, arquivo, params)
+        arquivo.seek(0)
+        return arquivo
+    
+    st.download_button("⬇️ Exportar", gerar_arquivo, file_name=nome_arquivo_exportacao(nome, formato),
+                       mime=FORMATOS_EXPORTACAO[formato][1], on_click="ignore", use_container_width=True)
+    st.caption("💡 CSV abre no Excel; Parquet é o formato mais compacto para planilhas grandes e ferramentas de análise.")
 
 # ==============================================================================
 # CONFIGURAÇÕES
 # ==============================================================================
 
-def configuracoes_page():
-    st.title("⚙️ Configurações do Sistema")
-    
+@fragmento
+def configuracoes_email():
     st.subheader("📧 Configurações de E-mail")
     
     email_atual = get_config_sistema('email_envio')
@@ -900,17 +1857,22 @@ def configuracoes_page():
         email = c1.text_input("📧 E-mail (Gmail)", value=email_atual)
         senha = c2.text_input("🔑 Senha de App", value=senha_atual, type="password")
         
+        config_email = get_config_email()
+        c3, c4, c5 = st.columns(3)
+        smtp_host = c3.text_input("🖥️ Servidor SMTP", value=config_email['host'])
+        smtp_porta = c4.number_input("Porta", min_value=1, max_value=65535, value=config_email['porta'])
+        smtp_limite = c5.number_input("Limite de envios por minuto", min_value=1, value=config_email['envios_por_minuto'])
+        
         if st.form_submit_button("💾 Salvar", use_container_width=True):
-            run_query("INSERT INTO config_sistema (chave, valor) VALUES ('email_envio', %s) ON CONFLICT (chave) DO UPDATE SET valor = EXCLUDED.valor", (email,))
-            run_query("INSERT INTO config_sistema (chave, valor) VALUES ('senha_app', %s) ON CONFLICT (chave) DO UPDATE SET valor = EXCLUDED.valor", (senha,))
-            
-            get_config_sistema.clear()
+            for chave, valor in [('email_envio', email), ('senha_app', senha), ('smtp_host', smtp_host),
+                                 ('smtp_porta', str(smtp_porta)), ('smtp_limite_minuto', str(smtp_limite))]:
+                run_query("INSERT INTO config_sistema (chave, valor) VALUES (%s, %s) ON CONFLICT (chave) DO UPDATE SET valor = EXCLUDED.valor", (chave, valor))
             
             st.success("✅ Configurações salvas!")
             st.balloons()
-    
-    st.markdown("---")
-    
+
+@fragmento
+def gerenciar_usuarios():
     st.subheader("👥 Gerenciamento de Usuários")
     
     usuarios = get_data("SELECT id, username, setor, email FROM usuarios ORDER BY username")
@@ -930,30 +1892,28 @@ def configuracoes_page():
             
             if st.form_submit_button("✅ Criar", use_container_width=True):
                 if novo_user and nova_senha:
-                    hash_pw = make_hashes(nova_senha)
+                    hash_pw = gerar_hash(nova_senha, custo_hash())
                     q = "INSERT INTO usuarios (username, password, setor, email) VALUES (%s, %s, %s, %s)"
                     
                     if run_query(q, (novo_user, hash_pw, setor, novo_email)):
                         st.success(f"✅ Usuário {novo_user} criado!")
-                        get_data.clear()
-                        st.rerun()
+                        refazer_fragmento()
                     else:
                         st.error("❌ Erro ao criar usuário.")
                 else:
                     st.error("⚠️ Preencha usuário e senha.")
-    
-    st.markdown("---")
-    
+
+@fragmento
+def manutencao_sistema():
     st.subheader("🗄️ Manutenção do Sistema")
     
     col1, col2 = st.columns(2)
     
     if col1.button("🔄 Limpar Cache", use_container_width=True):
-        get_data.clear()
-        get_config_sistema.clear()
-        get_dashboard_metrics.clear()
+        get_cache().limpar()
+        contar_aproximado.clear()
         st.success("✅ Cache limpo!")
-        st.rerun()
+        refazer_fragmento()
     
     if col2.button("📊 Ver Estatísticas", use_container_width=True):
         st.info("Total de registros no sistema:")
@@ -963,6 +1923,86 @@ def configuracoes_page():
         st.write(f"- **Alunos:** {stats.get('alunos_ativos', 0)}")
         st.write(f"- **Professores:** {stats.get('professores_ativos', 0)}")
         st.write(f"- **Turmas:** {stats.get('turmas_ativas', 0)}")
+    
+    st.markdown("##### 🧠 Cache de Consultas")
+    
+    ouvinte = get_ouvinte()
+    if ouvinte is not None and ouvinte.ativo:
+        st.caption(f"🟢 Invalidação por aviso do banco ativa ({ouvinte.avisos} avisos recebidos): os resultados ficam em cache até a tabela mudar.")
+    elif ouvinte is not None:
+        st.caption(f"🟡 Sem avisos do banco ({ouvinte.ultimo_erro or 'conectando'}): o cache usa os TTLs curtos.")
+
+    cache_stats = get_cache().estatisticas()
+    consultas = cache_stats['hits'] + cache_stats['misses']
+    taxa = f"{cache_stats['hits'] / consultas:.0%}" if consultas else "-"
+    
+    c1, c2, c3, c4, c5 = st.columns(5)
+    c1.metric("Entradas", cache_stats['entradas'])
+    c2.metric("Hits", cache_stats['hits'], taxa, delta_color="off")
+    c3.metric("Misses", cache_stats['misses'])
+    c4.metric("Evictions", cache_stats['evictions'])
+    c5.metric("Invalidações", cache_stats['invalidacoes'])
+
+@fragmento
+def painel_desempenho():
+    st.markdown("##### ⏱️ Desempenho")
+    st.caption(f"Tempos medidos neste processo. Consultas acima de {get_rastreador().limite_lenta_ms} ms guardam o plano de execução.")
+    
+    rastreador = get_rastreador()
+    por_pagina, por_consulta, lentas = st.tabs(["Páginas", "Consultas", "Consultas lentas"])
+    
+    with por_pagina:
+        st.dataframe(rastreador.resumo_paginas(), use_container_width=True, hide_index=True)
+    
+    with por_consulta:
+        st.dataframe(rastreador.resumo_consultas(), use_container_width=True, hide_index=True,
+                     column_config={"consulta": st.column_config.TextColumn(width="large")})
+    
+    with lentas:
+        registros = rastreador.consultas_lentas()
+        if not registros:
+            st.info("Nenhuma consulta lenta registrada.")
+        for registro in registros:
+            with st.expander(f"{registro['ms']:.0f} ms · {registro['pagina'] or '-'} · {registro['quando']:%d/%m %H:%M:%S}"):
+                st.code(registro['consulta'], language="sql")
+                st.code(registro['plano'] or "Plano não capturado (consulta repetida há pouco ou ainda em captura).")
+    
+    if st.button("🔄 Zerar medições"):
+        rastreador.limpar()
+        refazer_fragmento()
+    
+    painel_conexoes()
+
+def painel_conexoes():
+    pool_obj = init_connection_pool()
+    if pool_obj:
+        st.markdown("##### 🔌 Conexões com o Banco")
+        
+        pool_stats = pool_obj.estatisticas()
+        c1, c2, c3, c4, c5 = st.columns(5)
+        c1.metric("Em uso", f"{pool_stats['em_uso']}/{pool_stats['maximo']}")
+        c2.metric("Livres", pool_stats['livres'])
+        c3.metric("Aguardando", pool_stats['aguardando'])
+        c4.metric("Esperas esgotadas", pool_stats['esperas_esgotadas'])
+        c5.metric("Reconexões", pool_stats['descartadas'])
+        
+        if pool_stats['suspeitas_vazamento'] or pool_stats['vazamentos']:
+            st.warning(f"⚠️ {pool_stats['suspeitas_vazamento']} conexões emprestadas há muito tempo; "
+                       f"{pool_stats['vazamentos']} devolvidas com atraso.")
+
+def configuracoes_page():
+    st.title("⚙️ Configurações do Sistema")
+    
+    configuracoes_email()
+    
+    st.markdown("---")
+    
+    gerenciar_usuarios()
+    
+    st.markdown("---")
+    
+    manutencao_sistema()
+    painel_desempenho()
 
 # ==============================================================================
 # APLICAÇÃO PRINCIPAL
@@ -989,7 +2029,7 @@ def main_app():
         
         menu = st.radio(
             "📋 Menu Principal",
-            ["Dashboard", "Professores", "Turmas", "Alunos", "Financeiro", "Comunicação", "Configurações"],
+            ["Dashboard", "Professores", "Turmas", "Alunos", "Financeiro", "Análises", "Comunicação", "Histórico Escolar", "Importação", "Exportação", "Configurações"],
             key="main_menu"
         )
         
@@ -998,36 +2038,45 @@ def main_app():
         st.markdown("---")
         
         if st.button("🚪 Sair", use_container_width=True):
-            st.session_state['logged_in'] = False
-            st.session_state['user_data'] = None
+            encerrar_sessao()
             st.rerun()
     
     # CONTEÚDO
     menu = st.session_state['menu']
     
-    if menu == "Dashboard":
-        dashboard_page()
-    elif menu == "Professores":
-        professores_page()
-    elif menu == "Turmas":
-        turmas_page()
-    elif menu == "Alunos":
-        alunos_page()
-    elif menu == "Financeiro":
-        financeiro_page()
-    elif menu == "Comunicação":
-        comunicacao_page()
-    elif menu == "Configurações":
-        configuracoes_page()
+    with get_rastreador().pagina(menu):
+        if menu == "Dashboard":
+            dashboard_page()
+        elif menu == "Professores":
+            professores_page()
+        elif menu == "Turmas":
+            turmas_page()
+        elif menu == "Alunos":
+            alunos_page()
+        elif menu == "Financeiro":
+            financeiro_page()
+        elif menu == "Análises":
+            analises_page()
+        elif menu == "Comunicação":
+            comunicacao_page()
+        elif menu == "Histórico Escolar":
+            historico_page()
+        elif menu == "Importação":
+            importacao_page()
+        elif menu == "Exportação":
+            exportacao_page()
+        elif menu == "Configurações":
+            configuracoes_page()
 
 # ==============================================================================
 # FLUXO PRINCIPAL
 # ==============================================================================
 
-if 'logged_in' not in st.session_state:
-    st.session_state['logged_in'] = False
+restaurar_sessao()
 
 if st.session_state['logged_in']:
+    verificar_e_atualizar_tabelas()
     main_app()
 else:
     login_page()
+    verificar_e_atualizar_tabelas()
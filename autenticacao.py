@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+import base64
+import functools
+import hashlib
+import hmac
+import re
+import secrets
+import threading
+import time
+from datetime import datetime, timedelta
+
+# ==============================================================================
+# SENHAS
+# ==============================================================================
+# scrypt com sal aleatório. O custo fica gravado junto do hash, então pode ser
+# aumentado a qualquer momento: cada senha é refeita no próximo login. Os
+# hashes SHA-256 antigos (64 dígitos hexadecimais, sem sal) continuam
+# aceitos e são trocados no primeiro login.
+
+CUSTO_PADRAO = 14            # N = 2**14 (16 MB por verificação, ~30 ms)
+BLOCOS_SCRYPT = 8
+PARALELISMO_SCRYPT = 1
+TAMANHO_SAL = 16
+TAMANHO_HASH = 32
+RE_SHA256_LEGADO = re.compile(r'^[0-9a-f]{64}$')
+
+def _b64(dados):
+    return base64.urlsafe_b64encode(dados).decode().rstrip('=')
+
+def _de_b64(texto):
+    return base64.urlsafe_b64decode(texto + '=' * (-len(texto) % 4))
+
+def _scrypt(senha, sal, custo, blocos, paralelismo):
+    return hashlib.scrypt(senha.encode('utf-8'), salt=sal, n=2 ** custo, r=blocos, p=paralelismo,
+                          maxmem=2 ** custo * blocos * 256, dklen=TAMANHO_HASH)
+
+def gerar_hash(senha, custo=CUSTO_PADRAO):
+    sal = secrets.token_bytes(TAMANHO_SAL)
+    chave = _scrypt(senha, sal, custo, BLOCOS_SCRYPT, PARALELISMO_SCRYPT)
+    return f"scrypt${custo}${BLOCOS_SCRYPT}${PARALELISMO_SCRYPT}${_b64(sal)}${_b64(chave)}"
+
+def verificar_senha(senha, hash_gravado):
+    if not hash_gravado:
+        return False
+    if RE_SHA256_LEGADO.match(hash_gravado):
+        return hmac.compare_digest(hashlib.sha256(senha.encode('utf-8')).hexdigest(), hash_gravado)
+    try:
+        algoritmo, custo, blocos, paralelismo, sal, chave = hash_gravado.split('$')
+        if algoritmo != 'scrypt':
+            return False
+        calculada = _scrypt(senha, _de_b64(sal), int(custo), int(blocos), int(paralelismo))
+    except (ValueError, TypeError):
+        return False
+    return hmac.compare_digest(calculada, _de_b64(chave))
+
+def precisa_atualizar(hash_gravado, custo=CUSTO_PADRAO):
+    # Hash antigo ou com custo diferente do configurado.
+    partes = (hash_gravado or '').split('$')
+    return len(partes) != 6 or partes[0] != 'scrypt' or partes[1:4] != [str(custo), str(BLOCOS_SCRYPT), str(PARALELISMO_SCRYPT)]
+
+@functools.lru_cache(maxsize=None)
+def _hash_ficticio(custo):
+    # Usuário inexistente custa o mesmo tempo que senha errada.
+    return gerar_hash(secrets.token_urlsafe(16), custo)
+
+def autenticar(conn, username, senha, custo=CUSTO_PADRAO):
+    """Confere usuário e senha direto no banco (nunca pelo cache de
+    consultas) e refaz o hash se estiver no formato antigo. Devolve os dados
+    do usuário, sem a senha, ou None."""
+    with conn.cursor() as c:
+        c.execute("SELECT id, username, password, setor, email FROM usuarios WHERE username = %s", (username,))
+        linha = c.fetchone()
+    conn.rollback()
+
+    if linha is None:
+        verificar_senha(senha, _hash_ficticio(custo))
+        return None
+    id_usuario, username, hash_gravado, setor, email = linha
+    if not verificar_senha(senha, hash_gravado):
+        return None
+
+    if precisa_atualizar(hash_gravado, custo):
+        with conn.cursor() as c:
+            c.execute("UPDATE usuarios SET password = %s WHERE id = %s AND password = %s",
+                      (gerar_hash(senha, custo), id_usuario, hash_gravado))
+        conn.commit()
+    return {'id': id_usuario, 'username': username, 'setor': setor, 'email': email}
+
+# ==============================================================================
+# SESSÕES
+# ==============================================================================
+# O token (id aleatório + assinatura HMAC) vai na URL, então recarregar a
+# página ou abrir o link em outra aba mantém o login. A validação é toda em
+# memória: a assinatura descarta tokens forjados e o dicionário guarda o
+# usuário, então navegar não consulta a tabela usuarios. As sessões expiram
+# por inatividade e por idade, e somem quando o servidor reinicia.
+
+VALIDADE_INATIVA = 8 * 3600
+VALIDADE_MAXIMA = 7 * 24 * 3600
+MAX_SESSOES = 1000
+
+
+class SessoesAtivas:
+    def __init__(self, validade_inativa=VALIDADE_INATIVA, validade_maxima=VALIDADE_MAXIMA, max_sessoes=MAX_SESSOES):
+        self.validade_inativa = validade_inativa
+        self.validade_maxima = validade_maxima
+        self.max_sessoes = max_sessoes
+        self.chave = secrets.token_bytes(32)
+        self.lock = threading.Lock()
+        self.sessoes = {}        # id -> {'usuario', 'criada_em', 'usada_em'}
+
+    def _assinar(self, id_sessao):
+        return _b64(hmac.new(self.chave, id_sessao.encode(), hashlib.sha256).digest())
+
+    def _limpar(self, agora):
+        vencidas = [id_sessao for id_sessao, s in self.sessoes.items()
+                    if agora - s['usada_em'] > self.validade_inativa or agora - s['criada_em'] > self.validade_maxima]
+        for id_sessao in vencidas:
+            del self.sessoes[id_sessao]
+
+    def criar(self, usuario):
+        id_sessao = secrets.token_urlsafe(24)
+        agora = time.monotonic()
+        with self.lock:
+            self._limpar(agora)
+            if len(self.sessoes) >= self.max_sessoes:
+                del self.sessoes[min(self.sessoes, key=lambda i: self.sessoes[i]['usada_em'])]
+            self.sessoes[id_sessao] = {'usuario': dict(usuario), 'criada_em': agora, 'usada_em': agora}
+        return f"{id_sessao}.{self._assinar(id_sessao)}"
+
+    def validar(self, token):
+        # Devolve o usuário da sessão (renovando a inatividade) ou None.
+        id_sessao, _, assinatura = (token or '').partition('.')
+        if not id_sessao or not hmac.compare_digest(assinatura, self._assinar(id_sessao)):
+            return None
+        agora = time.monotonic()
+        with self.lock:
+            sessao = self.sessoes.get(id_sessao)
+            if sessao is None:
+                return None
+            if agora - sessao['usada_em'] > self.validade_inativa or agora - sessao['criada_em'] > self.validade_maxima:
+                del self.sessoes[id_sessao]
+                return None
+            sessao['usada_em'] = agora
+            return dict(sessao['usuario'])
+
+    def revogar(self, token):
+        with self.lock:
+            self.sessoes.pop((token or '').partition('.')[0], None)
+
+    def revogar_usuario(self, username):
+        # Depois de trocar a senha: derruba o login em todos os navegadores.
+        with self.lock:
+            for id_sessao in [i for i, s in self.sessoes.items() if s['usuario']['username'] == username]:
+                del self.sessoes[id_sessao]
+
+    def __len__(self):
+        with self.lock:
+            return len(self.sessoes)
+
+# ==============================================================================
+# RECUPERAÇÃO DE SENHA
+# ==============================================================================
+# Um código de 6 dígitos por e-mail (tabela codigos_recuperacao do escola.db),
+# gravado como hash, válido por 15 minutos e com poucas tentativas. Pedir um
+# código novo não zera as tentativas enquanto o anterior ainda vale: esgotadas,
+# nenhum código é emitido até passarem 15 minutos sem pedidos.
+
+VALIDADE_CODIGO = timedelta(minutes=15)
+MAX_TENTATIVAS_CODIGO = 5
+
+def _hash_codigo(email, codigo):
+    return hashlib.sha256(f"{email.lower()}:{codigo}".encode()).hexdigest()
+
+def criar_codigo_recuperacao(conn, email):
+    """Gera e grava o código se houver usuário com esse e-mail e tentativas
+    disponíveis. Devolve o código (para enviar por e-mail) ou None."""
+    email = email.strip().lower()
+    agora = datetime.now()
+    with conn.cursor() as c:
+        c.execute("SELECT 1 FROM usuarios WHERE lower(email) = %s", (email,))
+        if c.fetchone() is None:
+            conn.rollback()
+            return None
+        codigo = f"{secrets.randbelow(10 ** 6):06d}"
+        c.execute("""
+            INSERT INTO codigos_recuperacao (email, codigo, criado_em, tentativas) VALUES (%s, %s, %s, 0)
+            ON CONFLICT (email) DO UPDATE SET codigo = EXCLUDED.codigo, criado_em = EXCLUDED.criado_em,
+                tentativas = CASE WHEN codigos_recuperacao.criado_em >= %s THEN codigos_recuperacao.tentativas ELSE 0 END
+            RETURNING tentativas
+        """, (email, _hash_codigo(email, codigo), agora, agora - VALIDADE_CODIGO))
+        tentativas = c.fetchone()[0]
+    conn.commit()
+    return codigo if tentativas < MAX_TENTATIVAS_CODIGO else None
+
+def redefinir_senha(conn, email, codigo, nova_senha, custo=CUSTO_PADRAO):
+    """Troca a senha dos usuários do e-mail se o código conferir. Devolve
+    a lista de usernames alterados (vazia se o código for inválido)."""
+    email = email.strip().lower()
+    try:
+        with conn.cursor() as c:
+            c.execute("SELECT codigo, tentativas FROM codigos_recuperacao WHERE email = %s AND criado_em >= %s",
+                      (email, datetime.now() - VALIDADE_CODIGO))
+            linha = c.fetchone()
+            if linha is None or linha[1] >= MAX_TENTATIVAS_CODIGO:
+                conn.rollback()
+                return []
+            if not hmac.compare_digest(linha[0] or '', _hash_codigo(email, codigo.strip())):
+                c.execute("UPDATE codigos_recuperacao SET tentativas = tentativas + 1 WHERE email = %s", (email,))
+                conn.commit()
+                return []
+
+            c.execute("UPDATE usuarios SET password = %s WHERE lower(email) = %s RETURNING username",
+                      (gerar_hash(nova_senha, custo), email))
+            usernames = [linha[0] for linha in c.fetchall()]
+            c.execute("DELETE FROM codigos_recuperacao WHERE email = %s", (email,))
+        conn.commit()
+        return usernames
+    except Exception:
+        conn.rollback()
+        raise
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""Fila persistente de avisos de cobrança e o robô que a processa.
+
+Pode ser executado pelo cron (uma passada e sai):
+
+    python avisos.py
+
+ou como processo contínuo:
+
+    python avisos.py --loop --intervalo 300
+"""
+import argparse
+import os
+import sqlite3
+import time
+import tomllib
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+import psycopg2
+from psycopg2.extras import RealDictCursor, execute_values
+
+from banco import dialeto
+from banco_sqlite import conectar_sqlite
+from email_lote import enviar_emails_lote, config_smtp, CHAVES_CONFIG_EMAIL
+from mensagens import ler_modelos, renderizar_emails
+from migracoes import aplicar_migracoes
+
+# ==============================================================================
+# FILA DE ENVIOS (OUTBOX)
+# ==============================================================================
+
+DIAS_ANTECEDENCIA = 5
+DIAS_ATRASO = 30
+MAX_TENTATIVAS = 5
+BACKOFF_SEGUNDOS = 60
+TAMANHO_LOTE = 200
+
+# Uma única consulta cobre as três janelas (N dias antes, hoje e em atraso).
+# A chave única (financeiro_id, tipo_aviso, canal) torna a operação idempotente.
+QUERY_ENFILEIRAR = """
+INSERT INTO fila_envios (financeiro_id, tipo_aviso, canal, destinatario)
+SELECT f.id,
+       CASE WHEN f.vencimento = %(hoje)s THEN 'hoje'
+            WHEN f.vencimento > %(hoje)s THEN 'lembrete'
+            ELSE 'atrasado' END,
+       'email',
+       a.email_responsavel
+FROM financeiro f
+JOIN alunos a ON f.aluno_id = a.id
+WHERE f.status = 'Pendente'
+AND a.email_responsavel LIKE '%%@%%'
+AND (f.vencimento = %(lembrete)s
+     OR f.vencimento BETWEEN %(desde)s AND %(hoje)s)
+ON CONFLICT (financeiro_id, tipo_aviso, canal) DO NOTHING
+"""
+
+# Reserva um lote marcando-o como 'enviando'; reservas esquecidas por um
+# processo que morreu voltam a ficar disponíveis depois de 15 minutos.
+QUERY_RESERVAR = """
+UPDATE fila_envios q
+SET status = 'enviando', tentativas = q.tentativas + 1, atualizado_em = NOW()
+FROM financeiro f, alunos a
+WHERE f.id = q.financeiro_id AND a.id = f.aluno_id
+AND q.id IN (
+    SELECT id FROM fila_envios
+    WHERE canal = 'email'
+    AND ((status IN ('pendente', 'erro') AND proxima_tentativa <= NOW())
+         OR (status = 'enviando' AND atualizado_em < NOW() - INTERVAL '15 minutes'))
+    ORDER BY id
+    LIMIT %s
+    FOR UPDATE SKIP LOCKED
+)
+RETURNING q.id, q.financeiro_id, q.tipo_aviso, q.canal, q.destinatario, q.tentativas,
+          f.status AS status_financeiro, a.nome, a.mae_nome, f.descricao, f.valor, f.vencimento
+"""
+
+# Consultas da tela Comunicação (app.py), aqui para o benchmark de páginas
+# usar o mesmo SQL. A planilha de WhatsApp segue as janelas do robô.
+QUERY_AVISOS_DIA = """
+SELECT f.id, a.nome, a.email_responsavel, a.telefone_contato, a.mae_nome, 
+f.descricao, f.valor, f.vencimento,
+EXISTS (SELECT 1 FROM fila_envios e WHERE e.financeiro_id = f.id AND e.tipo_aviso = %s
+        AND e.canal = 'email' AND e.status = 'enviado') AS email_enviado
+FROM financeiro f 
+JOIN alunos a ON f.aluno_id = a.id 
+WHERE f.vencimento = %s AND f.status = 'Pendente'
+ORDER BY a.nome
+"""
+
+QUERY_WHATSAPP_DIA = """
+SELECT CASE WHEN f.vencimento = %(hoje)s THEN 'hoje'
+            WHEN f.vencimento > %(hoje)s THEN 'lembrete'
+            ELSE 'atrasado' END AS tipo_aviso,
+       f.id, a.nome, a.mae_nome, a.telefone_contato, f.descricao, f.valor, f.vencimento
+FROM financeiro f
+JOIN alunos a ON f.aluno_id = a.id
+WHERE f.status = 'Pendente'
+AND COALESCE(a.telefone_contato, '') <> ''
+AND (f.vencimento = %(lembrete)s OR f.vencimento BETWEEN %(desde)s AND %(hoje)s)
+ORDER BY f.vencimento, a.nome
+"""
+
+def janelas_avisos(hoje=None, antecedencia=DIAS_ANTECEDENCIA, atraso=DIAS_ATRASO):
+    # Parâmetros de QUERY_ENFILEIRAR e QUERY_WHATSAPP_DIA.
+    hoje = hoje or date.today()
+    return {'hoje': hoje, 'lembrete': hoje + timedelta(days=antecedencia), 'desde': hoje - timedelta(days=atraso)}
+
+def enfileirar_avisos(conn, hoje=None, antecedencia=DIAS_ANTECEDENCIA, atraso=DIAS_ATRASO):
+    with conn.cursor() as c:
+        c.execute(QUERY_ENFILEIRAR, janelas_avisos(hoje, antecedencia, atraso))
+        novos = c.rowcount
+    conn.commit()
+    return novos
+
+def registrar_envios(conn, envios):
+    # envios: lista de (financeiro_id, tipo_aviso, canal, destinatario) já entregues.
+    if not envios:
+        return
+
+    agora = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    with conn.cursor() as c:
+        execute_values(c, """
+            INSERT INTO fila_envios (financeiro_id, tipo_aviso, canal, destinatario, status, enviado_em)
+            VALUES %s
+            ON CONFLICT (financeiro_id, tipo_aviso, canal) DO UPDATE
+            SET status = 'enviado', enviado_em = NOW(), atualizado_em = NOW(), ultimo_erro = NULL
+        """, envios, template="(%s, %s, %s, %s, 'enviado', NOW())")
+        execute_values(c, "INSERT INTO log_envios (financeiro_id, tipo_aviso, data_envio, canal) VALUES %s",
+                       [(fid, tipo, agora, canal) for fid, tipo, canal, _ in envios])
+    conn.commit()
+
+def registrar_falhas(conn, falhas, max_tentativas=MAX_TENTATIVAS, backoff=BACKOFF_SEGUNDOS):
+    # falhas: lista de (id da fila, mensagem de erro). Espera exponencial.
+    if not falhas:
+        return
+
+    with conn.cursor() as c:
+        execute_values(c, """
+            UPDATE fila_envios q
+            SET status = CASE WHEN q.tentativas >= %s THEN 'falhou' ELSE 'erro' END,
+                ultimo_erro = v.erro,
+                atualizado_em = NOW(),
+                proxima_tentativa = NOW() + make_interval(secs => %s * POWER(2, q.tentativas - 1))
+            FROM (VALUES %%s) AS v(id, erro)
+            WHERE q.id = v.id
+        """ % (int(max_tentativas), int(backoff)), falhas)
+    conn.commit()
+
+def processar_fila(conn, config, tamanho_lote=TAMANHO_LOTE):
+    with conn.cursor(cursor_factory=RealDictCursor) as c:
+        c.execute(QUERY_RESERVAR, (tamanho_lote,))
+        reservados = c.fetchall()
+    conn.commit()
+
+    if not reservados:
+        return {'enviados': 0, 'falhas': 0, 'cancelados': 0}
+
+    # Cobranças quitadas depois de enfileiradas não recebem mais aviso.
+    cancelados = [r['id'] for r in reservados if r['status_financeiro'] != 'Pendente']
+    if cancelados:
+        with conn.cursor() as c:
+            c.execute("UPDATE fila_envios SET status = 'cancelado', atualizado_em = NOW() WHERE id = ANY(%s)", (cancelados,))
+        conn.commit()
+
+    # Um lote por tipo de aviso: cada modelo é renderizado de uma vez.
+    modelos, _ = ler_modelos(conn)
+    pendentes = pd.DataFrame([r for r in reservados if r['status_financeiro'] == 'Pendente'])
+    mensagens = []
+    for tipo_aviso, grupo in (pendentes.groupby('tipo_aviso') if not pendentes.empty else ()):
+        assuntos, corpos = renderizar_emails(grupo, tipo_aviso, modelos)
+        mensagens += [
+            {
+                'fila_id': r['id'],
+                'financeiro_id': r['financeiro_id'],
+                'tipo_aviso': tipo_aviso,
+                'canal': r['canal'],
+                'destinatario': r['destinatario'],
+                'assunto': assunto,
+                'corpo': corpo,
+            }
+            for r, assunto, corpo in zip(grupo.to_dict('records'), assuntos, corpos)
+        ]
+
+    resultados = enviar_emails_lote(config, mensagens)
+
+    registrar_envios(conn, [(r['financeiro_id'], r['tipo_aviso'], r['canal'], r['destinatario']) for r in resultados if r['ok']])
+    registrar_falhas(conn, [(r['fila_id'], r['detalhe']) for r in resultados if not r['ok']])
+
+    return {
+        'enviados': sum(1 for r in resultados if r['ok']),
+        'falhas': sum(1 for r in resultados if not r['ok']),
+        'cancelados': len(cancelados),
+    }
+
+def ler_config_email(conn):
+    with conn.cursor() as c:
+        c.execute("SELECT chave, valor FROM config_sistema WHERE chave IN %s", (CHAVES_CONFIG_EMAIL,))
+        return config_smtp(dict(c.fetchall()))
+
+# ==============================================================================
+# EXECUÇÃO AVULSA (CRON / PROCESSO CONTÍNUO)
+# ==============================================================================
+
+def conectar_banco():
+    # Usa o mesmo secrets.toml do Streamlit; sem ele, as variáveis PG* do libpq.
+    caminho = os.environ.get('ESD_SECRETS', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.streamlit', 'secrets.toml'))
+
+    if os.path.exists(caminho):
+        with open(caminho, 'rb') as f:
+            db_config = tomllib.load(f)["database"]
+        if db_config.get("engine", "postgres") == "sqlite":
+            return conectar_sqlite(os.path.join(os.path.dirname(os.path.abspath(__file__)), db_config.get("path", "escola.db")))
+        return psycopg2.connect(host=db_config["host"], database=db_config["dbname"], user=db_config["user"],
+                                password=db_config["password"], port=db_config["port"])
+    return psycopg2.connect("")
+
+def executar_ciclo(conn):
+    novos = enfileirar_avisos(conn)
+    if dialeto(conn) == 'sqlite':
+        # A reserva do lote usa UPDATE ... FOR UPDATE SKIP LOCKED, que o SQLite não tem.
+        print(f"[{datetime.now():%Y-%m-%d %H:%M:%S}] {novos} avisos enfileirados; no SQLite os envios saem pela tela Comunicação.")
+        return
+    config = ler_config_email(conn)
+
+    if not config['email'] or not config['senha']:
+        print(f"[{datetime.now():%Y-%m-%d %H:%M:%S}] {novos} avisos enfileirados; e-mail de envio não configurado.")
+        return
+
+    total = {'enviados': 0, 'falhas': 0, 'cancelados': 0}
+    while True:
+        parcial = processar_fila(conn, config)
+        for chave in total:
+            total[chave] += parcial[chave]
+        if not any(parcial.values()):
+            break
+
+    print(f"[{datetime.now():%Y-%m-%d %H:%M:%S}] {novos} enfileirados, {total['enviados']} enviados, "
+          f"{total['falhas']} falhas, {total['cancelados']} cancelados.")
+
+def main():
+    parser = argparse.ArgumentParser(description="Robô de avisos de cobrança por e-mail.")
+    parser.add_argument('--loop', action='store_true', help="Continua executando em vez de sair após uma passada.")
+    parser.add_argument('--intervalo', type=int, default=300, help="Segundos entre passadas no modo --loop.")
+    args = parser.parse_args()
+
+    conn = conectar_banco()
+    try:
+        aplicar_migracoes(conn)
+
+        while True:
+            try:
+                executar_ciclo(conn)
+            except (psycopg2.Error, sqlite3.Error) as e:
+                conn.rollback()
+                print(f"Log: {e}")
+            if not args.loop:
+                break
+            time.sleep(args.intervalo)
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
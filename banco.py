@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.pool import PoolError
+
+from banco_sqlite import BancoSQLite
+
+# ==============================================================================
+# POOL DE CONEXÕES
+# ==============================================================================
+# Substitui o SimpleConnectionPool, que não é seguro entre threads (o
+# Streamlit atende cada sessão numa thread). Quem pede conexão com o pool
+# cheio espera até `espera` segundos; conexões caídas são trocadas na saída
+# do pool e cada conexão nasce com statement_timeout.
+
+POOL_MIN_PADRAO = 1
+POOL_MAX_PADRAO = 10
+ESPERA_PADRAO = 10.0
+STATEMENT_TIMEOUT_PADRAO = 30000   # ms
+VERIFICAR_APOS = 5.0               # s ociosa antes de testar com SELECT 1
+LIMITE_VAZAMENTO = 120.0           # s emprestada antes de ser considerada vazada
+
+
+class PoolEsgotado(PoolError):
+    pass
+
+
+class PoolConexoes:
+    dialeto = 'postgres'
+
+    def __init__(self, minconn=POOL_MIN_PADRAO, maxconn=POOL_MAX_PADRAO, espera=ESPERA_PADRAO,
+                 statement_timeout=STATEMENT_TIMEOUT_PADRAO, limite_vazamento=LIMITE_VAZAMENTO, **dsn):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.espera = espera
+        self.limite_vazamento = limite_vazamento
+        self.dsn = dict(dsn)
+        if statement_timeout:
+            self.dsn['options'] = f"{dsn.get('options', '')} -c statement_timeout={int(statement_timeout)}".strip()
+
+        self.cond = threading.Condition()
+        self.livres = deque()          # (conexão, devolvida_em)
+        self.em_uso = {}               # id(conexão) -> (conexão, emprestada_em, thread)
+        self.total = 0                 # livres + em uso + sendo abertas
+        self.aguardando = 0
+        self.criadas = 0
+        self.descartadas = 0
+        self.esperas_esgotadas = 0
+        self.vazamentos = 0
+
+        for _ in range(minconn):
+            self.livres.append((self._abrir(), time.monotonic()))
+            self.total += 1
+
+    def _abrir(self):
+        conn = psycopg2.connect(**self.dsn)
+        with self.cond:
+            self.criadas += 1
+        return conn
+
+    def _descartar(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self.cond:
+            self.descartadas += 1
+
+    def _viva(self, conn, ociosa_desde):
+        if conn.closed:
+            return False
+        if time.monotonic() - ociosa_desde < VERIFICAR_APOS:
+            return True
+        try:
+            with conn.cursor() as c:
+                c.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def obter(self, espera=None):
+        espera = self.espera if espera is None else espera
+        limite = time.monotonic() + espera
+
+        while True:
+            with self.cond:
+                while not self.livres and self.total >= self.maxconn:
+                    restante = limite - time.monotonic()
+                    if restante <= 0:
+                        self.esperas_esgotadas += 1
+                        raise PoolEsgotado(f"Nenhuma conexão livre em {espera:.0f}s ({self.maxconn} em uso).")
+                    self.aguardando += 1
+                    try:
+                        self.cond.wait(restante)
+                    finally:
+                        self.aguardando -= 1
+
+                if self.livres:
+                    conn, ociosa_desde = self.livres.pop()
+                else:
+                    conn, ociosa_desde = None, None
+                    self.total += 1     # reserva a vaga; a conexão é aberta fora do lock
+
+            if conn is None:
+                try:
+                    conn = self._abrir()
+                except Exception:
+                    with self.cond:
+                        self.total -= 1
+                        self.cond.notify()
+                    raise
+            elif not self._viva(conn, ociosa_desde):
+                # Conexão caída (reinício do banco, rede): descarta e tenta outra.
+                self._descartar(conn)
+                with self.cond:
+                    self.total -= 1
+                    self.cond.notify()
+                continue
+
+            with self.cond:
+                self.em_uso[id(conn)] = (conn, time.monotonic(), threading.current_thread().name)
+            return conn
+
+    def devolver(self, conn):
+        with self.cond:
+            emprestimo = self.em_uso.pop(id(conn), None)
+        if emprestimo is None:
+            return
+
+        tempo = time.monotonic() - emprestimo[1]
+        if tempo > self.limite_vazamento:
+            with self.cond:
+                self.vazamentos += 1
+            print(f"Log: conexão devolvida após {tempo:.0f}s pela thread {emprestimo[2]}")
+
+        # Transação esquecida aberta ou com erro não volta suja para o pool.
+        if not conn.closed and conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                self._descartar(conn)
+
+        with self.cond:
+            if conn.closed:
+                self.total -= 1
+            else:
+                self.livres.append((conn, time.monotonic()))
+            self.cond.notify()
+
+    @contextmanager
+    def conexao(self, espera=None):
+        conn = self.obter(espera)
+        try:
+            yield conn
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            self.devolver(conn)
+
+    def estatisticas(self):
+        agora = time.monotonic()
+        with self.cond:
+            return {
+                'total': self.total,
+                'livres': len(self.livres),
+                'em_uso': len(self.em_uso),
+                'aguardando': self.aguardando,
+                'maximo': self.maxconn,
+                'criadas': self.criadas,
+                'descartadas': self.descartadas,
+                'esperas_esgotadas': self.esperas_esgotadas,
+                'vazamentos': self.vazamentos,
+                'suspeitas_vazamento': sum(1 for _, desde, _ in self.em_uso.values() if agora - desde > self.limite_vazamento),
+            }
+
+    def fechar(self):
+        with self.cond:
+            livres, self.livres = list(self.livres), deque()
+            self.total -= len(livres)
+        for conn, _ in livres:
+            self._descartar(conn)
+
+
+def dialeto(conn):
+    # 'postgres' ou 'sqlite': para os poucos comandos que não têm forma comum aos dois.
+    return getattr(conn, 'dialeto', 'postgres')
+
+def pool_de_config(db_config):
+    # db_config: seção [database] do secrets.toml. Tamanho e tempos são opcionais.
+    # Com engine = "sqlite", usa o arquivo em `path` (instalação num só computador).
+    if db_config.get("engine", "postgres") == "sqlite":
+        caminho = os.path.join(os.path.dirname(os.path.abspath(__file__)), db_config.get("path", "escola.db"))
+        return BancoSQLite(caminho, espera=float(db_config.get("pool_espera", ESPERA_PADRAO)))
+    return PoolConexoes(
+        minconn=int(db_config.get("pool_min", POOL_MIN_PADRAO)),
+        maxconn=int(db_config.get("pool_max", POOL_MAX_PADRAO)),
+        espera=float(db_config.get("pool_espera", ESPERA_PADRAO)),
+        statement_timeout=int(db_config.get("statement_timeout", STATEMENT_TIMEOUT_PADRAO)),
+        host=db_config["host"],
+        database=db_config["dbname"],
+        user=db_config["user"],
+        password=db_config["password"],
+        port=db_config["port"],
+    )
@@ -0,0 +1,402 @@
+# -*- coding: utf-8 -*-
+import csv
+import functools
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import date, datetime
+from decimal import Decimal
+
+import numpy as np
+
+# ==============================================================================
+# BANCO LOCAL (SQLITE)
+# ==============================================================================
+# Para escolas que rodam tudo num único computador: o mesmo app, sem servidor
+# PostgreSQL. O arquivo fica em modo WAL (leituras não bloqueiam a escrita),
+# cada thread tem a sua conexão e os cursores aceitam o SQL escrito para o
+# psycopg2: placeholders %s / %(nome)s, casts ::tipo, NOW(), ILIKE, TO_CHAR,
+# lastval(), INTERVAL simples, execute_values e COPY ... FROM STDIN (csv).
+
+VERSAO_MINIMA = (3, 35, 0)       # RETURNING, UPDATE ... FROM, upsert
+ESPERA_PADRAO = 10.0             # s esperando o lock de escrita (busy_timeout)
+
+# Ajustados para muita leitura e poucas escritas, num só computador.
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',     # seguro em WAL; só a última transação pode se perder numa queda de energia
+    'foreign_keys': 'ON',
+    'temp_store': 'MEMORY',
+    'cache_size': -32000,        # KiB por conexão
+    'mmap_size': 268435456,      # leituras direto do mapa de memória
+}
+
+Coluna = namedtuple('Coluna', 'name type_code display_size internal_size precision scale null_ok')
+
+# ==============================================================================
+# TIPOS E FUNÇÕES
+# ==============================================================================
+
+sqlite3.register_adapter(date, date.isoformat)
+sqlite3.register_adapter(datetime, lambda valor: valor.isoformat(' '))
+sqlite3.register_adapter(Decimal, float)
+sqlite3.register_adapter(np.int64, int)
+sqlite3.register_adapter(np.int32, int)
+sqlite3.register_adapter(np.float64, float)
+sqlite3.register_adapter(np.bool_, bool)
+sqlite3.register_converter('DATE', lambda valor: date.fromisoformat(valor.decode()[:10]))
+sqlite3.register_converter('TIMESTAMP', lambda valor: datetime.fromisoformat(valor.decode()))
+
+def f_unaccent(texto):
+    if texto is None:
+        return None
+    return ''.join(ch for ch in unicodedata.normalize('NFKD', texto) if not unicodedata.combining(ch))
+
+def _trigramas(texto):
+    # Como o pg_trgm: cada palavra com dois espaços antes e um depois.
+    trigramas = set()
+    for palavra in re.findall(r'\w+', texto or ''):
+        palavra = f"  {palavra} "
+        trigramas.update(palavra[i:i + 3] for i in range(len(palavra) - 2))
+    return trigramas
+
+def word_similarity(termo, texto):
+    # Aproximação do word_similarity do pg_trgm: fração dos trigramas do
+    # termo que aparecem no texto.
+    procurados = _trigramas(termo)
+    if not procurados:
+        return 0.0
+    return len(procurados & _trigramas(texto)) / len(procurados)
+
+FUNCOES = [
+    ('f_unaccent', 1, f_unaccent),
+    ('word_similarity', 2, word_similarity),
+]
+
+# ==============================================================================
+# TRADUÇÃO DO SQL
+# ==============================================================================
+
+RE_LITERAL = re.compile(r"('(?:[^']|'')*')")
+RE_PLACEHOLDER = re.compile(r"%\((\w+)\)s|%s|%%")
+RE_CAST = re.compile(r"::\s*[a-z_]+(?:\s*\(\s*\d+(?:\s*,\s*\d+)?\s*\))?(?:\[\])?", re.IGNORECASE)
+RE_INTERVALO = re.compile(r"(NOW\(\)|CURRENT_TIMESTAMP|CURRENT_DATE)\s*([+-])\s*INTERVAL\s*'(\d+)\s*(\w+?)s?'", re.IGNORECASE)
+RE_TO_CHAR = re.compile(r"TO_CHAR\(\s*([\w.]+)\s*,\s*'([^']*)'\s*\)", re.IGNORECASE)
+RE_DATE_TRUNC = re.compile(r"DATE_TRUNC\(\s*'(month|year|day)'\s*,\s*((?:[^()]|\([^()]*\))+?)\s*\)", re.IGNORECASE)
+RE_EXPLAIN = re.compile(r"^\s*EXPLAIN\s*(?:\([^)]*\))?", re.IGNORECASE)
+RE_PALAVRAS = [
+    (re.compile(r"\bNOW\(\)", re.IGNORECASE), "datetime('now', 'localtime')"),
+    (re.compile(r"\bCURRENT_DATE\b", re.IGNORECASE), "date('now', 'localtime')"),
+    (re.compile(r"\bILIKE\b", re.IGNORECASE), "LIKE"),
+    (re.compile(r"\blastval\(\)", re.IGNORECASE), "last_insert_rowid()"),
+]
+FORMATOS_DATA = [('YYYY', '%Y'), ('HH24', '%H'), ('MM', '%m'), ('DD', '%d'), ('MI', '%M'), ('SS', '%S')]
+INICIO_DE = {'month': 'start of month', 'year': 'start of year', 'day': 'start of day'}
+
+def _intervalo(m):
+    base, sinal, n, unidade = m.groups()
+    funcao = 'date' if base.upper() == 'CURRENT_DATE' else 'datetime'
+    return f"{funcao}('now', 'localtime', '{sinal}{n} {unidade.lower()}s')"
+
+def _to_char(m):
+    formato = m.group(2)
+    for pg, sqlite in FORMATOS_DATA:
+        formato = formato.replace(pg, sqlite)
+    return f"strftime('{formato}', {m.group(1)})"
+
+@functools.lru_cache(maxsize=1024)
+def traduzir(sql, com_parametros=True):
+    """SQL do psycopg2 -> SQL do SQLite. Com parâmetros, %s vira ? e
+    %(nome)s vira :nome (e %% vira %), como faz o psycopg2; o resto só é
+    traduzido fora das strings."""
+    if com_parametros:
+        sql = RE_PLACEHOLDER.sub(lambda m: f":{m.group(1)}" if m.group(1) else ('?' if m.group(0) == '%s' else '%'), sql)
+    sql = RE_EXPLAIN.sub("EXPLAIN QUERY PLAN", sql, count=1)
+    # Estas levam strings ('6 months', 'month'): traduzidas antes de separar os literais.
+    sql = RE_TO_CHAR.sub(_to_char, sql)
+    sql = RE_INTERVALO.sub(_intervalo, sql)
+    sql = RE_DATE_TRUNC.sub(lambda m: f"date({m.group(2)}, '{INICIO_DE[m.group(1).lower()]}')", sql)
+
+    partes = RE_LITERAL.split(sql)
+    for i in range(0, len(partes), 2):
+        trecho = RE_CAST.sub('', partes[i])
+        for regex, troca in RE_PALAVRAS:
+            trecho = regex.sub(troca, trecho)
+        partes[i] = trecho
+    return ''.join(partes)
+
+RE_PLACEHOLDER_SQLITE = re.compile(r"('(?:[^']|'')*')|\?")
+
+def _expandir_tuplas(sql, params):
+    # Tupla como parâmetro vira lista: `IN %s` com (1, 2) -> `IN (?, ?)`.
+    valores = iter(params)
+    achatados = []
+
+    def troca(m):
+        if m.group(1):
+            return m.group(1)
+        valor = next(valores)
+        if isinstance(valor, tuple):
+            achatados.extend(valor)
+            return '(' + ', '.join('?' * len(valor)) + ')' if valor else '(NULL)'
+        achatados.append(valor)
+        return '?'
+
+    return RE_PLACEHOLDER_SQLITE.sub(troca, sql), achatados
+
+def literal(valor):
+    # Para o mogrify (execute_values): valor Python -> literal SQL.
+    if hasattr(valor, 'item') and not isinstance(valor, (str, bytes)):
+        valor = valor.item()
+    if valor is None or (isinstance(valor, float) and valor != valor):
+        return 'NULL'
+    if isinstance(valor, bool):
+        return '1' if valor else '0'
+    if isinstance(valor, (int, float)):
+        return repr(valor)
+    if isinstance(valor, Decimal):
+        return str(valor)
+    if isinstance(valor, datetime):
+        valor = valor.isoformat(' ')
+    elif isinstance(valor, date):
+        valor = valor.isoformat()
+    elif isinstance(valor, bytes):
+        return f"X'{valor.hex()}'"
+    return "'" + str(valor).replace("'", "''") + "'"
+
+# ==============================================================================
+# CONEXÃO E CURSOR
+# ==============================================================================
+
+RE_COPY = re.compile(r"^\s*COPY\s+(\w+)\s*\(([^)]*)\)\s+FROM\s+STDIN\s+WITH\s*\(\s*FORMAT\s+csv\s*\)\s*$", re.IGNORECASE)
+
+class CursorSQLite(sqlite3.Cursor):
+    itersize = 2000   # aceito por compatibilidade com cursores nomeados
+    nomes = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def description(self):
+        # psycopg2 devolve colunas com .name; o get_data_arrow usa esse atributo.
+        return [Coluna(nome, None, None, None, None, None, None) for nome in self.nomes] if self.nomes else None
+
+    def execute(self, sql, params=None):
+        if isinstance(sql, bytes):
+            sql = sql.decode('utf-8')
+        self.connection._iniciar()
+        if params is None:
+            super().execute(traduzir(sql, False))
+        else:
+            sql = traduzir(sql, True)
+            if not isinstance(params, dict):
+                params = tuple(params)
+                if any(isinstance(p, tuple) for p in params):
+                    sql, params = _expandir_tuplas(sql, params)
+            super().execute(sql, params)
+        descricao = super().description
+        self.nomes = tuple(d[0] for d in descricao) if descricao else ()
+        return self
+
+    def executemany(self, sql, seq_params):
+        self.connection._iniciar()
+        return super().executemany(traduzir(sql, True), seq_params)
+
+    def mogrify(self, sql, params=None):
+        if isinstance(sql, bytes):
+            sql = sql.decode('utf-8')
+        if params is None:
+            return sql.encode('utf-8')
+        if isinstance(params, dict):
+            texto = RE_PLACEHOLDER.sub(lambda m: literal(params[m.group(1)]) if m.group(1) else '%', sql)
+        else:
+            valores = iter(params)
+            texto = RE_PLACEHOLDER.sub(lambda m: literal(next(valores)) if m.group(0) == '%s' else '%', sql)
+        return texto.encode('utf-8')
+
+    def copy_expert(self, sql, arquivo):
+        # Só o formato usado no sistema: COPY tabela (colunas) FROM STDIN WITH (FORMAT csv).
+        m = RE_COPY.match(sql)
+        if not m:
+            raise sqlite3.NotSupportedError(f"COPY não suportado no SQLite: {sql}")
+        colunas = [c.strip() for c in m.group(2).split(',')]
+        linhas = ([v if v != '' else None for v in linha] for linha in csv.reader(arquivo))
+        self.executemany(f"INSERT INTO {m.group(1)} ({', '.join(colunas)}) VALUES ({', '.join('?' * len(colunas))})", linhas)
+
+
+def _linha_dict(cursor, linha):
+    # Equivalente ao RealDictCursor.
+    return dict(zip(cursor.nomes, linha))
+
+class InfoSQLite:
+    def __init__(self, conn, caminho):
+        self.conn = conn
+        self.dbname = caminho
+        self.server_version = sqlite3.sqlite_version
+
+    @property
+    def transaction_status(self):
+        return 2 if self.conn.in_transaction else 0
+
+
+class ConexaoSQLite(sqlite3.Connection):
+    """Conexão com a mesma interface que o app usa do psycopg2: transação
+    aberta implicitamente no primeiro comando (inclusive DDL), commit e
+    rollback explícitos, cursor como gerenciador de contexto."""
+    dialeto = 'sqlite'
+    encoding = 'UTF8'       # lido pelo execute_values
+    _autocommit = False
+
+    def _iniciar(self):
+        if not self._autocommit and not self.in_transaction:
+            sqlite3.Connection.execute(self, "BEGIN")
+
+    def iniciar_escrita(self):
+        # Abre a transação já com o lock de escrita do arquivo (BEGIN IMMEDIATE).
+        self.rollback()
+        sqlite3.Connection.execute(self, "BEGIN IMMEDIATE")
+
+    @property
+    def closed(self):
+        try:
+            self.total_changes
+            return False
+        except sqlite3.ProgrammingError:
+            return True
+
+    def cursor(self, name=None, cursor_factory=None, **kwargs):
+        c = super().cursor(CursorSQLite)
+        if cursor_factory is not None:
+            c.row_factory = _linha_dict
+        return c
+
+    def commit(self):
+        if self.in_transaction:
+            super().commit()
+
+    def rollback(self):
+        if self.in_transaction:
+            super().rollback()
+
+    def set_session(self, readonly=None, autocommit=None, **kwargs):
+        if autocommit is not None:
+            self.rollback()
+            self._autocommit = autocommit
+        if readonly is not None:
+            sqlite3.Connection.execute(self, f"PRAGMA query_only = {'ON' if readonly else 'OFF'}")
+
+
+def conectar_sqlite(caminho, espera=ESPERA_PADRAO):
+    if sqlite3.sqlite_version_info < VERSAO_MINIMA:
+        raise sqlite3.NotSupportedError(
+            f"SQLite {sqlite3.sqlite_version} é antigo demais; o sistema precisa do {'.'.join(map(str, VERSAO_MINIMA))} ou mais novo.")
+    # isolation_level=None: as transações são controladas por ConexaoSQLite.
+    conn = sqlite3.connect(caminho, timeout=espera, factory=ConexaoSQLite, isolation_level=None,
+                           detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+    conn.info = InfoSQLite(conn, caminho)
+    for nome, valor in PRAGMAS.items():
+        sqlite3.Connection.execute(conn, f"PRAGMA {nome} = {valor}")
+    for nome, n_args, funcao in FUNCOES:
+        conn.create_function(nome, n_args, funcao, deterministic=True)
+    return conn
+
+# ==============================================================================
+# "POOL": UMA CONEXÃO POR THREAD
+# ==============================================================================
+
+class BancoSQLite:
+    """Mesma interface do banco.PoolConexoes. Cada thread reaproveita a sua
+    conexão; pedidos aninhados na mesma thread recebem a mesma conexão e só
+    a devolução mais externa desfaz uma transação esquecida aberta."""
+    dialeto = 'sqlite'
+
+    def __init__(self, caminho, espera=ESPERA_PADRAO):
+        self.caminho = caminho
+        self.espera = espera
+        self.lock = threading.Lock()
+        self.conexoes = {}         # thread -> [conexão, empréstimos em aberto]
+        self.criadas = 0
+        self.descartadas = 0
+
+    def _limpar_threads_encerradas(self):
+        # O Streamlit cria uma thread por execução do script: as conexões
+        # de threads que já terminaram são fechadas aqui.
+        with self.lock:
+            mortas = [t for t in self.conexoes if not t.is_alive()]
+            fechar = [self.conexoes.pop(t)[0] for t in mortas]
+            self.descartadas += len(fechar)
+        for conn in fechar:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+    def obter(self, espera=None):
+        thread = threading.current_thread()
+        with self.lock:
+            registro = self.conexoes.get(thread)
+        if registro is None or registro[0].closed:
+            self._limpar_threads_encerradas()
+            conn = conectar_sqlite(self.caminho, self.espera if espera is None else espera)
+            registro = [conn, 0]
+            with self.lock:
+                self.conexoes[thread] = registro
+                self.criadas += 1
+        registro[1] += 1
+        return registro[0]
+
+    def devolver(self, conn):
+        with self.lock:
+            registro = self.conexoes.get(threading.current_thread())
+        if registro is None or registro[0] is not conn:
+            return
+        registro[1] = max(registro[1] - 1, 0)
+        if registro[1] == 0 and not conn.closed:
+            # Leitura sem commit deixaria um snapshot aberto, segurando o checkpoint do WAL.
+            conn.rollback()
+
+    @contextmanager
+    def conexao(self, espera=None):
+        conn = self.obter(espera)
+        try:
+            yield conn
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            self.devolver(conn)
+
+    def estatisticas(self):
+        with self.lock:
+            abertas = len(self.conexoes)
+            em_uso = sum(1 for _, emprestimos in self.conexoes.values() if emprestimos)
+            return {
+                'total': abertas,
+                'livres': abertas - em_uso,
+                'em_uso': em_uso,
+                'aguardando': 0,
+                'maximo': abertas,
+                'criadas': self.criadas,
+                'descartadas': self.descartadas,
+                'esperas_esgotadas': 0,
+                'vazamentos': 0,
+                'suspeitas_vazamento': 0,
+            }
+
+    def fechar(self):
+        with self.lock:
+            conexoes, self.conexoes = [r[0] for r in self.conexoes.values()], {}
+        for conn in conexoes:
+            try:
+                sqlite3.Connection.execute(conn, "PRAGMA optimize")
+                conn.close()
+            except sqlite3.Error:
+                pass
@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks do sistema. Execute cada um com `python -m benchmarks.<nome>`."""
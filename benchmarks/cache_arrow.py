@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""Compara o custo, por rerun, de entregar um resultado em cache ao st.dataframe.
+
+- cache_data: caminho antigo (st.cache_data). O resultado fica serializado com
+  pickle e cada acerto desserializa uma cópia, que depois é convertida para
+  Arrow pelo st.dataframe.
+- pandas_compartilhado: o cache por tabela (get_data). Sem cópia no acerto,
+  mas a conversão pandas -> Arrow acontece em todo rerun.
+- arrow: get_data_arrow. A pyarrow.Table imutável vai direto para a
+  serialização IPC, sem cópia nem conversão.
+
+Uso: python -m benchmarks.cache_arrow --linhas 50000 --repeticoes 30
+"""
+import argparse
+import pickle
+import statistics
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from streamlit.dataframe_util import convert_arrow_table_to_arrow_bytes, convert_pandas_df_to_arrow_bytes
+
+
+def gerar_linhas(n, seed=42):
+    # Mesmo formato da lista "Contas em Aberto" (financeiro JOIN alunos).
+    rng = np.random.default_rng(seed)
+    inicio = date(2024, 1, 1)
+    return {
+        'id': list(range(1, n + 1)),
+        'nome': [f"Aluno {i:06d}" for i in rng.integers(0, n // 3 + 1, n)],
+        'descricao': ["Mensalidade"] * n,
+        'valor': [float(v) for v in rng.choice([350.0, 420.0, 90.0, 120.5], n)],
+        'vencimento': [inicio + timedelta(days=int(d)) for d in rng.integers(0, 730, n)],
+        'status': ["Pendente"] * n,
+    }
+
+
+def medir(func, repeticoes):
+    tempos, picos = [], []
+    for _ in range(repeticoes):
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        func()
+        tempos.append((time.perf_counter() - t0) * 1000)
+        picos.append(tracemalloc.get_traced_memory()[1] / 1024 / 1024)
+        tracemalloc.stop()
+    tempos.sort()
+    return {
+        'ms_p50': statistics.median(tempos),
+        'ms_p95': tempos[int(len(tempos) * 0.95) - 1] if len(tempos) > 1 else tempos[0],
+        'pico_mb': max(picos),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--linhas', type=int, default=50000)
+    parser.add_argument('--repeticoes', type=int, default=30)
+    args = parser.parse_args()
+
+    dados = gerar_linhas(args.linhas)
+    df = pd.DataFrame(dados)
+    tabela = pa.table({nome: pa.array(col) for nome, col in dados.items()})
+    guardado = pickle.dumps(df)
+
+    caminhos = {
+        'cache_data': lambda: convert_pandas_df_to_arrow_bytes(pickle.loads(guardado)),
+        'pandas_compartilhado': lambda: convert_pandas_df_to_arrow_bytes(df),
+        'arrow': lambda: convert_arrow_table_to_arrow_bytes(tabela),
+    }
+
+    print(f"{args.linhas} linhas, {args.repeticoes} repetições por caminho")
+    print(f"{'caminho':<22}{'p50 (ms)':>10}{'p95 (ms)':>10}{'pico (MB)':>11}")
+    for nome, func in caminhos.items():
+        r = medir(func, args.repeticoes)
+        print(f"{nome:<22}{r['ms_p50']:>10.2f}{r['ms_p95']:>10.2f}{r['pico_mb']:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""Gera uma base sintética, reproduzível (semente fixa), no esquema real.
+
+Preenche professores, turmas, alunos, financeiro, log_envios e fila_envios
+na escala pedida, com distribuições parecidas com as da escola: nomes com
+acentos, CPFs válidos, uma mensalidade por aluno e mês (competência) em
+torno de hoje, quase tudo pago no passado e pendente no futuro. Os dados
+entram com COPY e os resumos do dashboard são mantidos pelos próprios
+gatilhos da migração 6.
+
+APAGA os dados das tabelas acima: use um banco descartável.
+
+Uso: python -m benchmarks.dados_sinteticos --alunos 5000 --cobrancas 500000 --sobrescrever
+"""
+import argparse
+import io
+import time
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import psycopg2
+
+from avisos import conectar_banco
+from migracoes import aplicar_migracoes
+
+PRIMEIROS_NOMES = ["Ana", "João", "Maria", "José", "Antônio", "Francisca", "Luís", "Márcia", "Cecília", "Vitória",
+                   "Gabriel", "Lúcia", "Heitor", "Helena", "Enzo", "Valentina", "Caio", "Inês", "Otávio", "Sônia"]
+SOBRENOMES = ["Silva", "Santos", "Oliveira", "Souza", "Lima", "Pereira", "Araújo", "Gonçalves", "Conceição", "Brandão",
+              "Magalhães", "Fernandes", "Simões", "Assunção", "Ribeiro", "Melo", "Guimarães", "Galvão", "Feitosa", "Sá"]
+CIDADES = ["Fortaleza", "Caucaia", "Maracanaú", "Eusébio", "Aquiraz", "Pacatuba"]
+SERIES = ["Infantil I", "Infantil II", "Infantil III", "1º Ano", "2º Ano", "3º Ano", "4º Ano", "5º Ano",
+          "6º Ano", "7º Ano", "8º Ano", "9º Ano"]
+VALORES_MENSALIDADE = [350.0, 420.0, 480.0, 520.0]
+
+# Ordem de carga (respeita as chaves estrangeiras) e de limpeza.
+TABELAS = ['professores', 'turmas', 'alunos', 'financeiro', 'log_envios', 'fila_envios']
+
+def nomes(rng, n, partes=3):
+    primeiro = rng.choice(PRIMEIROS_NOMES, n)
+    resto = [rng.choice(SOBRENOMES, n) for _ in range(partes - 1)]
+    return pd.Series(primeiro).str.cat(resto, sep=' ')
+
+def cpfs(rng, n):
+    # Nove dígitos sorteados + os dois verificadores, calculados de uma vez.
+    base = rng.integers(0, 10, (n, 9))
+    d1 = (base * np.arange(10, 1, -1)).sum(axis=1) * 10 % 11 % 10
+    com_d1 = np.column_stack([base, d1])
+    d2 = (com_d1 * np.arange(11, 1, -1)).sum(axis=1) * 10 % 11 % 10
+    digitos = pd.DataFrame(np.column_stack([com_d1, d2]).astype(str)).agg(''.join, axis=1)
+    return digitos.str[:3] + '.' + digitos.str[3:6] + '.' + digitos.str[6:9] + '-' + digitos.str[9:]
+
+def telefones(rng, n):
+    return pd.Series(rng.integers(900000000, 999999999, n).astype(str)).radd('(85) ')
+
+def datas(rng, n, inicio, fim):
+    dias = rng.integers(0, (fim - inicio).days, n)
+    return pd.Timestamp(inicio) + pd.to_timedelta(dias, unit='D')
+
+def gerar_professores(rng, n):
+    return pd.DataFrame({
+        'nome': nomes(rng, n),
+        'telefone': telefones(rng, n),
+        'cargo': rng.choice(["Professor", "Professor", "Professor", "Coordenador"], n),
+        'cpf': cpfs(rng, n),
+        'data_admissao': datas(rng, n, date(2005, 1, 1), date(2025, 1, 1)).date,
+        'salario_base': rng.choice([2500.0, 3200.0, 4100.0], n),
+        'status_rh': np.where(rng.random(n) < 0.9, "Ativo", "Desligado"),
+    })
+
+def gerar_turmas(rng, n, professores):
+    turnos = np.repeat(np.arange(n // len(SERIES) + 1), len(SERIES))[:n]
+    serie = np.tile(SERIES, n // len(SERIES) + 1)[:n]
+    return pd.DataFrame({
+        'nome_turma': pd.Series(serie) + ' ' + pd.Series(turnos).map(lambda t: chr(ord('A') + t % 26) + ('' if t < 26 else str(t // 26))),
+        'professor_id': rng.integers(1, professores + 1, n),
+        'ativa': np.where(rng.random(n) < 0.95, 1, 0),
+    })
+
+def gerar_alunos(rng, n, turmas):
+    mae = nomes(rng, n)
+    return pd.DataFrame({
+        'nome': nomes(rng, n),
+        'data_nascimento': datas(rng, n, date(2008, 1, 1), date(2021, 12, 31)).date,
+        'naturalidade': rng.choice(CIDADES, n),
+        'cpf': cpfs(rng, n),
+        'pai_nome': nomes(rng, n),
+        'mae_nome': mae,
+        'turma_id': rng.integers(1, turmas + 1, n),
+        'status': rng.choice(["Cursando", "Cursando", "Cursando", "Cursando", "Transferido", "Concluído"], n),
+        'cidade': rng.choice(CIDADES, n),
+        'telefone_contato': telefones(rng, n),
+        'email_responsavel': (mae.str.split(' ').str[0].str.lower().str.normalize('NFKD').str.encode('ascii', 'ignore').str.decode('ascii')
+                              + pd.Series(np.arange(1, n + 1)).astype(str) + "@exemplo.com"),
+    })
+
+def gerar_financeiro(rng, n, alunos, hoje):
+    """Cada aluno recebe n // alunos mensalidades em meses consecutivos que
+    terminam dois meses depois de hoje; o resto vira cobranças avulsas."""
+    por_aluno = max(n // alunos, 1)
+    mensais = min(por_aluno * alunos, n)
+    aluno_id = np.repeat(np.arange(1, alunos + 1), por_aluno)[:mensais]
+    ordem = np.tile(np.arange(por_aluno), alunos)[:mensais]
+
+    fim = pd.Period(hoje, 'M') + 2
+    competencia = pd.period_range(end=fim, periods=por_aluno).to_timestamp()[ordem]
+    # Dia de vencimento escolhido por família, espalhado pelo mês.
+    vencimento = competencia + pd.to_timedelta(rng.integers(0, 28, alunos)[aluno_id - 1], unit='D')
+
+    avulsas = n - mensais
+    aluno_id = np.concatenate([aluno_id, rng.integers(1, alunos + 1, avulsas)])
+    vencimento = vencimento.append(datas(rng, avulsas, (fim - por_aluno).to_timestamp().date(), hoje))
+    descricao = np.concatenate([
+        "Mensalidade " + pd.Series(competencia.strftime('%m/%Y')),
+        rng.choice(["Material didático", "Uniforme", "Passeio", "Taxa de matrícula"], avulsas),
+    ])
+    valor = np.concatenate([rng.choice(VALORES_MENSALIDADE, mensais), rng.choice([90.0, 120.5, 180.0], avulsas)])
+
+    # Passado: ~92% pago. Futuro: pendente.
+    vencido = vencimento.date < hoje
+    status = np.where(vencido & (rng.random(n) < 0.92), "Pago", "Pendente")
+    return pd.DataFrame({
+        'aluno_id': aluno_id,
+        'descricao': descricao,
+        'valor': valor,
+        'vencimento': vencimento.date,
+        'status': status,
+        'competencia': list(competencia.date) + [None] * avulsas,
+    })
+
+def gerar_envios(rng, n, financeiro, hoje):
+    """Avisos já enviados (log_envios) e a fila correspondente, sem repetir
+    (cobrança, tipo, canal)."""
+    vencidas = np.flatnonzero(financeiro['vencimento'].to_numpy() <= hoje)
+    n = min(n, len(vencidas) * 2)
+    escolhidas = rng.choice(len(vencidas) * 2, n, replace=False)
+    linha = vencidas[escolhidas // 2]
+    tipo = np.where(escolhidas % 2 == 0, 'lembrete', 'hoje')
+    vencimento = pd.to_datetime(financeiro['vencimento'].to_numpy()[linha])
+    enviado = vencimento - pd.to_timedelta(np.where(tipo == 'lembrete', 5, 0), unit='D') + pd.to_timedelta(
+        rng.integers(8 * 3600, 18 * 3600, n), unit='s')
+
+    log = pd.DataFrame({
+        'financeiro_id': linha + 1,
+        'tipo_aviso': tipo,
+        'data_envio': enviado.strftime('%Y-%m-%d %H:%M:%S'),
+        'canal': 'email',
+    })
+    erro = rng.random(n) < 0.02
+    fila = pd.DataFrame({
+        'financeiro_id': log['financeiro_id'],
+        'tipo_aviso': tipo,
+        'canal': 'email',
+        'status': np.where(erro, 'erro', 'enviado'),
+        'tentativas': np.where(erro, 3, 1),
+        'ultimo_erro': np.where(erro, "SMTPServerDisconnected: Connection unexpectedly closed", None),
+        'criado_em': enviado,
+        'atualizado_em': enviado,
+        'enviado_em': pd.Series(enviado).where(~erro),
+    })
+    return log, fila
+
+def copiar(conn, tabela, df):
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    with conn.cursor() as c:
+        c.copy_expert(f"COPY {tabela} ({', '.join(df.columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+def gerar_base(conn, alunos=5000, cobrancas=500000, turmas=None, professores=None, envios=None, seed=42, hoje=None):
+    """Apaga e recria os dados. Devolve {tabela: linhas}."""
+    rng = np.random.default_rng(seed)
+    hoje = hoje or date.today()
+    turmas = turmas or max(alunos // 25, 1)
+    professores = professores or max(turmas // 2, 1)
+    envios = cobrancas // 5 if envios is None else envios
+
+    dados = {'professores': gerar_professores(rng, professores)}
+    dados['turmas'] = gerar_turmas(rng, turmas, professores)
+    dados['alunos'] = gerar_alunos(rng, alunos, turmas)
+    dados['financeiro'] = gerar_financeiro(rng, cobrancas, alunos, hoje)
+    dados['log_envios'], dados['fila_envios'] = gerar_envios(rng, envios, dados['financeiro'], hoje)
+
+    try:
+        with conn.cursor() as c:
+            c.execute("SET LOCAL statement_timeout = 0")
+            # TRUNCATE não passa pelos gatilhos de resumo: zera os resumos junto.
+            c.execute(f"TRUNCATE {', '.join(TABELAS)}, historico_escolar, resumo_financeiro_mensal, resumo_contadores RESTART IDENTITY CASCADE")
+        for tabela in TABELAS:
+            copiar(conn, tabela, dados[tabela])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    conn.autocommit = True
+    try:
+        with conn.cursor() as c:
+            c.execute("SET statement_timeout = 0")
+            for tabela in TABELAS:
+                c.execute(f"VACUUM ANALYZE {tabela}")
+    finally:
+        conn.autocommit = False
+    return {tabela: len(df) for tabela, df in dados.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--alunos', type=int, default=5000)
+    parser.add_argument('--cobrancas', type=int, default=500000)
+    parser.add_argument('--turmas', type=int, help="padrão: 1 para cada 25 alunos")
+    parser.add_argument('--professores', type=int, help="padrão: 1 para cada 2 turmas")
+    parser.add_argument('--envios', type=int, help="padrão: 1 para cada 5 cobranças")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--dsn', help="string de conexão libpq (padrão: .streamlit/secrets.toml ou variáveis PG*)")
+    parser.add_argument('--sobrescrever', action='store_true', help="confirma que os dados atuais podem ser apagados")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(args.dsn) if args.dsn else conectar_banco()
+    try:
+        aplicar_migracoes(conn)
+        with conn.cursor() as c:
+            c.execute("SELECT EXISTS (SELECT 1 FROM alunos) OR EXISTS (SELECT 1 FROM financeiro)")
+            tem_dados = c.fetchone()[0]
+        conn.commit()
+        if tem_dados and not args.sobrescrever:
+            parser.error(f"o banco {conn.info.dbname} já tem dados; use --sobrescrever para apagá-los")
+
+        t0 = time.perf_counter()
+        linhas = gerar_base(conn, args.alunos, args.cobrancas, args.turmas, args.professores, args.envios, args.seed)
+        print(f"Base gerada em {time.perf_counter() - t0:.1f}s (seed {args.seed})")
+        for tabela, n in linhas.items():
+            print(f"{tabela:<14}{n:>10,}".replace(',', '.'))
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
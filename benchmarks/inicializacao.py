@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""Mede a partida a frio do app.py e falha se passar do orçamento.
+
+Cada repetição é um processo Python novo, que mede:
+
+- import: o tempo das importações do topo de app.py (lidas do próprio
+  arquivo, então a lista acompanha o código);
+- render: a primeira execução do script pelo streamlit.testing (AppTest),
+  que sem sessão desenha a tela de login e verifica as tabelas.
+
+O processo também confere que os módulos pesados adiados (PDF, Excel,
+Parquet, SMTP) não foram carregados na partida. Sai com código 1 se a
+mediana de import ou de render passar do orçamento, ou se algum módulo
+adiado aparecer.
+
+Precisa do banco configurado em .streamlit/secrets.toml, como o app.
+
+Uso: python -m benchmarks.inicializacao --repeticoes 5 --saida partida.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from datetime import datetime
+
+from benchmarks.paginas import versao_codigo
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FORMATO_RELATORIO = 1
+ORCAMENTO_IMPORT_MS = 500
+ORCAMENTO_RENDER_MS = 1500
+TIMEOUT_RENDER = 30
+
+# Importados só pelas páginas ou funções que os usam.
+MODULOS_ADIADOS = ['fpdf', 'carnes', 'historico', 'openpyxl', 'pyarrow.parquet', 'smtplib',
+                   'email.mime.multipart', 'email.mime.text', 'plotly.graph_objects']
+
+SONDA = """
+import ast, json, sys, time
+MODULOS_ADIADOS, TIMEOUT_RENDER = {adiados!r}, {timeout!r}
+
+inicio = time.perf_counter()
+import streamlit
+from streamlit.testing.v1 import AppTest
+ms_streamlit = (time.perf_counter() - inicio) * 1000
+# O que o próprio streamlit já carrega não conta contra o app.
+ja_carregados = set(sys.modules)
+
+with open('app.py', encoding='utf-8') as f:
+    arvore = ast.parse(f.read())
+importacoes = ast.Module([n for n in arvore.body if isinstance(n, (ast.Import, ast.ImportFrom))], [])
+inicio = time.perf_counter()
+exec(compile(importacoes, 'app.py', 'exec'), {{}})
+ms_import = (time.perf_counter() - inicio) * 1000
+
+inicio = time.perf_counter()
+at = AppTest.from_file('app.py', default_timeout=TIMEOUT_RENDER).run()
+ms_render = (time.perf_counter() - inicio) * 1000
+
+print(json.dumps({{
+    'ms_streamlit': ms_streamlit,
+    'ms_import': ms_import,
+    'ms_render': ms_render,
+    'erros': [e.value for e in at.exception],
+    'login': any(b.label.endswith('Entrar') for b in at.button),
+    'adiados_carregados': [m for m in MODULOS_ADIADOS if m in sys.modules and m not in ja_carregados],
+}}))
+"""
+
+def medir_uma_vez(timeout=TIMEOUT_RENDER):
+    sonda = SONDA.format(adiados=MODULOS_ADIADOS, timeout=timeout)
+    saida = subprocess.run([sys.executable, '-c', sonda], cwd=RAIZ,
+                           capture_output=True, text=True, timeout=timeout * 2)
+    if saida.returncode != 0:
+        raise RuntimeError(f"a sonda falhou:\n{saida.stderr.strip()}")
+    return json.loads(saida.stdout.strip().splitlines()[-1])
+
+def executar(repeticoes=5, timeout=TIMEOUT_RENDER):
+    medidas = [medir_uma_vez(timeout) for _ in range(repeticoes)]
+    resumo = {}
+    for chave in ('ms_streamlit', 'ms_import', 'ms_render'):
+        valores = [m[chave] for m in medidas]
+        resumo[chave] = {'mediana': statistics.median(valores), 'min': min(valores), 'max': max(valores)}
+    return {
+        'formato': FORMATO_RELATORIO,
+        'gerado_em': datetime.now().isoformat(timespec='seconds'),
+        'versao': versao_codigo(),
+        'python': sys.version.split()[0],
+        'repeticoes': repeticoes,
+        'medidas': resumo,
+        'erros': sorted({e for m in medidas for e in m['erros']}),
+        'login': all(m['login'] for m in medidas),
+        'adiados_carregados': sorted({mod for m in medidas for mod in m['adiados_carregados']}),
+    }
+
+def estouros(relatorio, orcamento_import_ms=ORCAMENTO_IMPORT_MS, orcamento_render_ms=ORCAMENTO_RENDER_MS):
+    # Lista de problemas; vazia = dentro do orçamento.
+    problemas = []
+    medidas = relatorio['medidas']
+    if medidas['ms_import']['mediana'] > orcamento_import_ms:
+        problemas.append(f"import {medidas['ms_import']['mediana']:.0f} ms > {orcamento_import_ms:.0f} ms")
+    if medidas['ms_render']['mediana'] > orcamento_render_ms:
+        problemas.append(f"render {medidas['ms_render']['mediana']:.0f} ms > {orcamento_render_ms:.0f} ms")
+    if relatorio['adiados_carregados']:
+        problemas.append(f"módulos carregados na partida: {', '.join(relatorio['adiados_carregados'])}")
+    if relatorio['erros'] or not relatorio['login']:
+        problemas.append("a tela de login não foi desenhada sem erros")
+    return problemas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeticoes', type=int, default=5)
+    parser.add_argument('--orcamento-import-ms', type=float, default=ORCAMENTO_IMPORT_MS,
+                        help="mediana máxima das importações de app.py")
+    parser.add_argument('--orcamento-render-ms', type=float, default=ORCAMENTO_RENDER_MS,
+                        help="mediana máxima da primeira execução (tela de login)")
+    parser.add_argument('--timeout', type=int, default=TIMEOUT_RENDER, help="segundos por execução do AppTest")
+    parser.add_argument('--saida', help="grava o relatório JSON neste arquivo")
+    args = parser.parse_args()
+
+    relatorio = executar(args.repeticoes, args.timeout)
+
+    print(f"{relatorio['versao'] or 'sem versão'} · Python {relatorio['python']} · {args.repeticoes} processos")
+    print(f"{'etapa':<28}{'mediana (ms)':>14}{'mín':>10}{'máx':>10}")
+    rotulos = {'ms_streamlit': "streamlit (referência)", 'ms_import': "importações de app.py",
+               'ms_render': "primeira execução"}
+    for chave, rotulo in rotulos.items():
+        m = relatorio['medidas'][chave]
+        print(f"{rotulo:<28}{m['mediana']:>14.0f}{m['min']:>10.0f}{m['max']:>10.0f}")
+    for erro in relatorio['erros']:
+        print(f"Erro na tela de login: {erro}")
+
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            json.dump(relatorio, f, ensure_ascii=False, indent=2)
+        print(f"Relatório gravado em {args.saida}")
+
+    problemas = estouros(relatorio, args.orcamento_import_ms, args.orcamento_render_ms)
+    if problemas:
+        print("\nFora do orçamento de partida:")
+        for problema in problemas:
+            print(f"  {problema}")
+        sys.exit(1)
+    print(f"\nDentro do orçamento (import {args.orcamento_import_ms:.0f} ms, render {args.orcamento_render_ms:.0f} ms).")
+
+
+if __name__ == "__main__":
+    main()
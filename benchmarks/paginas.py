@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+"""Reexecuta as consultas de cada página do sistema e mede a latência.
+
+Cada repetição executa, em sequência, todas as consultas que a página faz
+num render sem cache (mesmo SQL de app.py e dos módulos de domínio), com
+execute + fetchall como no get_data. O relatório JSON traz p50/p95/p99 por
+página e por consulta, a escala da base e a versão do código; com
+--comparar, aponta o que ficou mais lento que a base e sai com código 1.
+
+Gere a base antes com benchmarks.dados_sinteticos.
+
+Uso: python -m benchmarks.paginas --repeticoes 20 --saida atual.json --comparar base.json
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import psycopg2
+
+from analises import consulta_aging, consulta_receita_turmas, consulta_recebido_faturado, parametros_analises
+from avisos import QUERY_AVISOS_DIA, QUERY_WHATSAPP_DIA, DIAS_ANTECEDENCIA, conectar_banco, janelas_avisos
+from carnes import QUERY_CARNES
+from historico import QUERY_FECHAMENTO, QUERY_HISTORICOS
+from mensagens import QUERY_MODELOS_EMAIL, QUERY_MODELOS_WHATSAPP
+from mensalidades import QUERY_PREVIA, parametros_geracao
+
+FORMATO_RELATORIO = 1
+TAMANHO_PAGINA = 50          # o mesmo de app.py
+TOLERANCIA_PADRAO = 0.25     # +25% no p95
+FOLGA_MS_PADRAO = 2.0        # diferenças abaixo disso são ruído
+TABELAS_ESCALA = ['alunos', 'turmas', 'professores', 'financeiro', 'log_envios', 'fila_envios']
+
+# ==============================================================================
+# CONSULTAS POR PÁGINA
+# ==============================================================================
+# O SQL que está nos módulos de domínio (avisos, mensagens, carnes...) é
+# importado; o que só existe em app.py está copiado abaixo: mantenha em
+# sincronia. Os parâmetros vêm de `contexto()`: datas
+# de hoje, a maior turma e cursores de uma página "do meio" das listas, para
+# medir a paginação por chave longe do início.
+
+SQL_ALUNOS = """SELECT a.id, a.nome, t.nome_turma, a.telefone_contato, a.status
+FROM alunos a LEFT JOIN turmas t ON a.turma_id = t.id"""
+SQL_CONTAS = """SELECT f.id, a.nome, f.descricao, f.valor, f.vencimento, f.status
+FROM financeiro f JOIN alunos a ON f.aluno_id = a.id"""
+SQL_PROFESSORES = "SELECT p.id, p.nome, p.cargo, p.telefone, p.cpf, p.status_rh FROM professores p"
+SQL_TURMAS = """SELECT t.id, t.nome_turma, p.nome as professor, t.ativa
+FROM turmas t LEFT JOIN professores p ON t.professor_id = p.id"""
+
+def pagina_por_chave(select_sql, colunas_ordem, where=(), apos=False):
+    # Mesmo SQL de consulta_paginada; com `apos`, a página seguinte a um
+    # cursor sem NULL (parâmetros de parametros_cursor).
+    condicoes = list(where)
+    if apos:
+        alternativas = [" AND ".join([f"{col} = %s" for col in colunas_ordem[:i]] + [f"({c} > %s OR {c} IS NULL)"])
+                        for i, c in enumerate(colunas_ordem)]
+        condicoes.append("(" + " OR ".join(f"({a})" for a in alternativas) + ")")
+    q = select_sql
+    if condicoes:
+        q += " WHERE " + " AND ".join(condicoes)
+    return q + f" ORDER BY {', '.join(f'{col} NULLS LAST' for col in colunas_ordem)} LIMIT {TAMANHO_PAGINA + 1}"
+
+def parametros_cursor(cursor):
+    return tuple(v for i in range(len(cursor)) for v in cursor[:i + 1])
+
+def contagem_estimada(select_sql, where=()):
+    return "EXPLAIN (FORMAT JSON) " + select_sql + (" WHERE " + " AND ".join(where) if where else "")
+
+def busca(select_sql, alias, where=(), cpf=False):
+    # Mesmo SQL de buscar_registros.
+    condicao = (f"({alias}.nome_busca LIKE '%%' || lower(f_unaccent(%(termo)s)) || '%%' "
+                f"OR lower(f_unaccent(%(termo)s)) <%% {alias}.nome_busca")
+    if cpf:
+        condicao += f" OR {alias}.cpf_digitos LIKE %(digitos)s"
+    condicao += ")"
+    return (select_sql + " WHERE " + " AND ".join(list(where) + [condicao])
+            + f" ORDER BY word_similarity(lower(f_unaccent(%(termo)s)), {alias}.nome_busca) DESC, {alias}.nome, {alias}.id LIMIT 50")
+
+# pagina -> [(nome, sql, função contexto -> parâmetros)]
+PAGINAS = {
+    'Dashboard': [
+        ('metricas', """
+         SELECT
+             (SELECT COALESCE(SUM(quantidade), 0)::bigint FROM resumo_contadores WHERE tabela='alunos' AND grupo='Cursando') as alunos_ativos,
+             (SELECT COALESCE(SUM(quantidade), 0)::bigint FROM resumo_contadores WHERE tabela='turmas' AND grupo='1') as turmas_ativas,
+             (SELECT COALESCE(SUM(valor_total), 0) FROM resumo_financeiro_mensal WHERE status='Pendente') as pendencias_total,
+             (SELECT COALESCE(SUM(quantidade), 0)::bigint FROM resumo_contadores WHERE tabela='professores' AND grupo='Ativo') as professores_ativos
+         """, lambda ctx: ()),
+        ('inadimplencia_6_meses', """
+         SELECT TO_CHAR(mes, 'YYYY-MM') as mes, quantidade, valor_total
+         FROM resumo_financeiro_mensal
+         WHERE status = 'Pendente'
+         AND mes >= DATE_TRUNC('month', CURRENT_DATE - INTERVAL '6 months')
+         AND quantidade > 0
+         ORDER BY mes
+         """, lambda ctx: ()),
+    ],
+    'Professores': [
+        ('lista', pagina_por_chave(SQL_PROFESSORES, ('p.nome', 'p.id')), lambda ctx: ()),
+        ('lista_contagem', contagem_estimada(SQL_PROFESSORES), lambda ctx: ()),
+        ('busca_nome', busca(SQL_PROFESSORES, 'p'), lambda ctx: {'termo': ctx['termo_nome']}),
+    ],
+    'Turmas': [
+        ('lista', pagina_por_chave(SQL_TURMAS, ('t.nome_turma', 't.id')), lambda ctx: ()),
+        ('lista_contagem', contagem_estimada(SQL_TURMAS), lambda ctx: ()),
+    ],
+    'Alunos': [
+        ('turmas_ativas', "SELECT id, nome_turma FROM turmas WHERE ativa=1 ORDER BY nome_turma", lambda ctx: ()),
+        ('lista', pagina_por_chave(SQL_ALUNOS, ('a.nome', 'a.id'), ("a.status='Cursando'",)), lambda ctx: ()),
+        ('lista_meio', pagina_por_chave(SQL_ALUNOS, ('a.nome', 'a.id'), ("a.status='Cursando'",), apos=True),
+         lambda ctx: parametros_cursor(ctx['cursor_alunos'])),
+        ('lista_contagem', contagem_estimada(SQL_ALUNOS, ("a.status='Cursando'",)), lambda ctx: ()),
+        ('busca_nome', busca(SQL_ALUNOS, 'a', ("a.status='Cursando'",), cpf=False), lambda ctx: {'termo': ctx['termo_nome']}),
+        ('busca_cpf', busca(SQL_ALUNOS, 'a', ("a.status='Cursando'",), cpf=True),
+         lambda ctx: {'termo': ctx['termo_cpf'], 'digitos': f"%{ctx['termo_cpf']}%"}),
+    ],
+    'Financeiro': [
+        ('alunos_nova_cobranca', "SELECT id, nome FROM alunos WHERE status='Cursando' ORDER BY nome LIMIT 20", lambda ctx: ()),
+        ('contas_em_aberto', pagina_por_chave(SQL_CONTAS, ('f.vencimento', 'f.id'), ("f.status = 'Pendente'",)), lambda ctx: ()),
+        ('contas_em_aberto_meio', pagina_por_chave(SQL_CONTAS, ('f.vencimento', 'f.id'), ("f.status = 'Pendente'",), apos=True),
+         lambda ctx: parametros_cursor(ctx['cursor_contas'])),
+        ('contas_contagem', contagem_estimada(SQL_CONTAS, ("f.status = 'Pendente'",)), lambda ctx: ()),
+        ('turmas', "SELECT id, nome_turma FROM turmas ORDER BY nome_turma", lambda ctx: ()),
+        ('previa_mensalidades', QUERY_PREVIA, lambda ctx: ctx['mensalidade']),
+        ('pendentes_conciliacao', """
+         SELECT f.id, a.nome, f.descricao, f.valor, f.vencimento
+         FROM financeiro f JOIN alunos a ON f.aluno_id = a.id
+         WHERE f.status = 'Pendente'
+         """, lambda ctx: ()),
+        ('carnes_turma', QUERY_CARNES, lambda ctx: {'turma_id': ctx['turma_id'], 'inicio': ctx['hoje'],
+                                                      'fim': ctx['hoje'] + timedelta(days=365)}),
+    ],
+    'Análises': [
+        ('aging', consulta_aging(), lambda ctx: parametros_analises(ctx['hoje'])),
+        ('receita_turmas', consulta_receita_turmas(), lambda ctx: parametros_analises(ctx['hoje'])),
+        ('recebido_faturado', consulta_recebido_faturado(), lambda ctx: parametros_analises(ctx['hoje'])),
+    ],
+    'Comunicação': [
+        ('modelos_email', QUERY_MODELOS_EMAIL, lambda ctx: ()),
+        ('modelos_whatsapp', QUERY_MODELOS_WHATSAPP, lambda ctx: ()),
+        ('vencendo_em_n_dias', QUERY_AVISOS_DIA, lambda ctx: ('lembrete', ctx['hoje'] + timedelta(days=DIAS_ANTECEDENCIA))),
+        ('vencendo_hoje', QUERY_AVISOS_DIA, lambda ctx: ('hoje', ctx['hoje'])),
+        ('whatsapp_do_dia', QUERY_WHATSAPP_DIA, lambda ctx: janelas_avisos(ctx['hoje'])),
+        ('resumo_fila', "SELECT status, COUNT(*) AS quantidade FROM fila_envios GROUP BY status ORDER BY status", lambda ctx: ()),
+        ('ultimas_falhas', """
+         SELECT q.financeiro_id, a.nome, q.tipo_aviso, q.destinatario, q.tentativas, q.ultimo_erro, q.proxima_tentativa
+         FROM fila_envios q
+         JOIN financeiro f ON q.financeiro_id = f.id
+         JOIN alunos a ON f.aluno_id = a.id
+         WHERE q.status IN ('erro', 'falhou')
+         ORDER BY q.atualizado_em DESC
+         LIMIT 50
+         """, lambda ctx: ()),
+    ],
+    'Histórico Escolar': [
+        ('fechamento', QUERY_FECHAMENTO, lambda ctx: (ctx['hoje'].year, ctx['turma_id'])),
+        ('historicos_turma', QUERY_HISTORICOS, lambda ctx: (ctx['turma_id'],)),
+    ],
+}
+
+def contexto(conn, hoje=None):
+    """Parâmetros realistas tirados da própria base."""
+    hoje = hoje or date.today()
+    with conn.cursor() as c:
+        c.execute("SELECT turma_id FROM alunos WHERE status = 'Cursando' AND turma_id IS NOT NULL GROUP BY 1 ORDER BY COUNT(*) DESC LIMIT 1")
+        turma = c.fetchone()
+        c.execute("SELECT a.nome, a.id FROM alunos a WHERE a.status='Cursando' AND a.nome IS NOT NULL ORDER BY a.nome, a.id "
+                  "OFFSET (SELECT COUNT(*) / 2 FROM alunos WHERE status='Cursando') LIMIT 1")
+        cursor_alunos = c.fetchone()
+        c.execute("SELECT f.vencimento, f.id FROM financeiro f WHERE f.status = 'Pendente' AND f.vencimento IS NOT NULL ORDER BY f.vencimento, f.id "
+                  "OFFSET (SELECT COUNT(*) / 2 FROM financeiro WHERE status = 'Pendente') LIMIT 1")
+        cursor_contas = c.fetchone()
+        c.execute("SELECT nome, regexp_replace(cpf, '\\D', '', 'g') FROM alunos WHERE status='Cursando' ORDER BY id LIMIT 1")
+        nome, cpf = c.fetchone() or ("Maria", "123")
+    conn.rollback()
+
+    partes = nome.split()
+    return {
+        'hoje': hoje,
+        'turma_id': turma[0] if turma else None,
+        'cursor_alunos': tuple(cursor_alunos or ('', 0)),
+        'cursor_contas': tuple(cursor_contas or (hoje, 0)),
+        # Busca típica: nome e parte do sobrenome, digitados sem maiúsculas.
+        'termo_nome': f"{partes[0]} {partes[1][:-1]}".lower(),
+        'termo_cpf': (cpf or '')[3:9],
+        'mensalidade': parametros_geracao(hoje.year, hoje.month, 10, 0, turma_id=turma[0] if turma else None),
+    }
+
+# ==============================================================================
+# MEDIÇÃO
+# ==============================================================================
+
+def percentis(tempos):
+    tempos = np.asarray(tempos)
+    return {
+        'ms_p50': round(float(np.percentile(tempos, 50)), 3),
+        'ms_p95': round(float(np.percentile(tempos, 95)), 3),
+        'ms_p99': round(float(np.percentile(tempos, 99)), 3),
+        'ms_max': round(float(tempos.max()), 3),
+        'ms_media': round(float(tempos.mean()), 3),
+    }
+
+def medir_pagina(conn, consultas, ctx, repeticoes, aquecimento):
+    tempos = {nome: [] for nome, _, _ in consultas}
+    linhas = {}
+    totais = []
+    with conn.cursor() as c:
+        for rodada in range(aquecimento + repeticoes):
+            inicio_pagina = time.perf_counter()
+            for nome, sql, params in consultas:
+                t0 = time.perf_counter()
+                c.execute(sql, params(ctx))
+                resultado = c.fetchall()
+                ms = (time.perf_counter() - t0) * 1000
+                if rodada >= aquecimento:
+                    tempos[nome].append(ms)
+                    linhas[nome] = len(resultado)
+            if rodada >= aquecimento:
+                totais.append((time.perf_counter() - inicio_pagina) * 1000)
+    return {
+        **percentis(totais),
+        'consultas': {nome: {**percentis(t), 'linhas': linhas[nome]} for nome, t in tempos.items()},
+    }
+
+def escala(conn):
+    with conn.cursor() as c:
+        c.execute(" UNION ALL ".join(f"SELECT '{t}', COUNT(*) FROM {t}" for t in TABELAS_ESCALA))
+        contagem = dict(c.fetchall())
+    return {t: contagem[t] for t in TABELAS_ESCALA}
+
+def versao_codigo():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def executar(conn, paginas=None, repeticoes=20, aquecimento=3):
+    # Somente leitura: nada do que é medido altera a base.
+    conn.set_session(readonly=True, autocommit=True)
+    ctx = contexto(conn)
+    resultados = {}
+    for pagina, consultas in PAGINAS.items():
+        if paginas and pagina not in paginas:
+            continue
+        resultados[pagina] = medir_pagina(conn, consultas, ctx, repeticoes, aquecimento)
+    return {
+        'formato': FORMATO_RELATORIO,
+        'gerado_em': datetime.now().isoformat(timespec='seconds'),
+        'versao': versao_codigo(),
+        'servidor': conn.info.server_version,
+        'escala': escala(conn),
+        'repeticoes': repeticoes,
+        'paginas': resultados,
+    }
+
+def comparar(base, atual, tolerancia=TOLERANCIA_PADRAO, folga_ms=FOLGA_MS_PADRAO):
+    """Devolve [(pagina, consulta, p95 base, p95 atual, variação, regrediu)]
+    para o que existe nos dois relatórios. consulta None = página inteira."""
+    linhas = []
+    for pagina, res in atual['paginas'].items():
+        anterior = base['paginas'].get(pagina)
+        if not anterior:
+            continue
+        pares = [(None, anterior, res)] + [(nome, anterior['consultas'][nome], r) for nome, r in res['consultas'].items()
+                                           if nome in anterior['consultas']]
+        for nome, a, b in pares:
+            variacao = b['ms_p95'] / a['ms_p95'] - 1 if a['ms_p95'] else 0.0
+            regrediu = variacao > tolerancia and b['ms_p95'] - a['ms_p95'] > folga_ms
+            linhas.append((pagina, nome, a['ms_p95'], b['ms_p95'], variacao, regrediu))
+    return linhas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeticoes', type=int, default=20)
+    parser.add_argument('--aquecimento', type=int, default=3)
+    parser.add_argument('--paginas', nargs='*', choices=list(PAGINAS), help="padrão: todas")
+    parser.add_argument('--saida', help="grava o relatório JSON neste arquivo")
+    parser.add_argument('--comparar', metavar='BASE', help="relatório JSON de referência")
+    parser.add_argument('--tolerancia', type=float, default=TOLERANCIA_PADRAO, help="aumento relativo aceito no p95")
+    parser.add_argument('--folga-ms', type=float, default=FOLGA_MS_PADRAO, help="aumento absoluto ignorado no p95")
+    parser.add_argument('--dsn', help="string de conexão libpq (padrão: .streamlit/secrets.toml ou variáveis PG*)")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(args.dsn) if args.dsn else conectar_banco()
+    try:
+        relatorio = executar(conn, args.paginas, args.repeticoes, args.aquecimento)
+    finally:
+        conn.close()
+
+    escala_txt = ', '.join(f"{n:,} {t}".replace(',', '.') for t, n in relatorio['escala'].items())
+    print(f"{relatorio['versao'] or 'sem versão'} · {escala_txt} · {args.repeticoes} repetições")
+    print(f"{'página / consulta':<40}{'p50 (ms)':>10}{'p95 (ms)':>10}{'p99 (ms)':>10}{'linhas':>9}")
+    for pagina, res in relatorio['paginas'].items():
+        print(f"{pagina:<40}{res['ms_p50']:>10.2f}{res['ms_p95']:>10.2f}{res['ms_p99']:>10.2f}")
+        for nome, r in res['consultas'].items():
+            print(f"  {nome:<38}{r['ms_p50']:>10.2f}{r['ms_p95']:>10.2f}{r['ms_p99']:>10.2f}{r['linhas']:>9}")
+
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            json.dump(relatorio, f, ensure_ascii=False, indent=2)
+        print(f"Relatório gravado em {args.saida}")
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            base = json.load(f)
+        if base.get('escala') != relatorio['escala']:
+            print("Aviso: a base de referência foi medida em outra escala; compare com cautela.")
+        linhas = comparar(base, relatorio, args.tolerancia, args.folga_ms)
+        regressoes = [l for l in linhas if l[5]]
+        print(f"\nComparação com {base.get('versao') or args.comparar} (p95, tolerância +{args.tolerancia:.0%})")
+        print(f"{'página / consulta':<40}{'base':>10}{'atual':>10}{'variação':>10}")
+        for pagina, nome, antes, depois, variacao, regrediu in linhas:
+            rotulo = pagina if nome is None else f"  {nome}"
+            print(f"{rotulo:<40}{antes:>10.2f}{depois:>10.2f}{variacao:>+10.0%}{'  REGRESSÃO' if regrediu else ''}")
+        if regressoes:
+            print(f"\n{len(regressoes)} regressão(ões) acima da tolerância.")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import re
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+# ==============================================================================
+# CACHE DE CONSULTAS MARCADO POR TABELA
+# ==============================================================================
+# Cada leitura guardada declara as tabelas de que depende. Uma escrita invalida
+# só as entradas marcadas com as tabelas que tocou, em vez de esvaziar tudo.
+#
+# Uma invalidação pode chegar enquanto a leitura ainda está no banco (aviso
+# de outro processo): quem lê pega a `marca` das tabelas antes e a passa ao
+# `guardar`, que descarta o resultado se alguma delas mudou nesse meio-tempo.
+
+RE_TABELAS_LEITURA = re.compile(r'\b(?:FROM|JOIN)\s+([a-z_][a-z0-9_]*)', re.IGNORECASE)
+# Em qualquer ponto do comando, para pegar também as escritas dentro de WITH
+# (WITH novas AS (INSERT INTO financeiro ...)). O lookahead descarta os
+# UPDATE que não escrevem numa tabela: ON CONFLICT DO UPDATE SET e FOR UPDATE.
+RE_TABELAS_ESCRITA = re.compile(r'\b(?:INSERT\s+INTO|UPDATE|DELETE\s+FROM|TRUNCATE(?:\s+TABLE)?|MERGE\s+INTO)'
+                                r'\s+(?!(?:SET|OF|SKIP|NOWAIT)\b)([a-z_][a-z0-9_]*)', re.IGNORECASE)
+
+def tabelas_da_consulta(query):
+    return frozenset(t.lower() for t in RE_TABELAS_LEITURA.findall(query))
+
+def tabelas_da_escrita(query):
+    tabelas = frozenset(t.lower() for t in RE_TABELAS_ESCRITA.findall(query))
+    if not tabelas:
+        # Sem saber o que mudou, o cache serviria dados velhos sem aviso.
+        raise ValueError(f"Não encontrei a tabela alterada pelo comando; informe tabelas=: {query[:80]!r}")
+    return tabelas
+
+
+class CacheTabelas:
+    def __init__(self, max_entradas=500):
+        self.max_entradas = max_entradas
+        self.lock = threading.RLock()
+        self.entradas = OrderedDict()        # chave -> (expira_em, valor, tabelas)
+        self.por_tabela = defaultdict(set)   # tabela -> chaves
+        self.versoes = defaultdict(int)      # tabela -> invalidações
+        self.epoca = 0                       # limpezas completas
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidacoes = 0
+
+    def _remover(self, chave):
+        _, _, tabelas = self.entradas.pop(chave)
+        for tabela in tabelas:
+            chaves = self.por_tabela.get(tabela)
+            if chaves is not None:
+                chaves.discard(chave)
+                if not chaves:
+                    del self.por_tabela[tabela]
+
+    def obter(self, chave):
+        with self.lock:
+            entrada = self.entradas.get(chave)
+            if entrada is not None:
+                if entrada[0] > time.monotonic():
+                    self.entradas.move_to_end(chave)
+                    self.hits += 1
+                    return True, entrada[1]
+                self._remover(chave)
+                self.evictions += 1
+            self.misses += 1
+            return False, None
+
+    def _marca(self, tabelas):
+        return (self.epoca,) + tuple(self.versoes.get(tabela, 0) for tabela in sorted(tabelas))
+
+    def marca(self, tabelas):
+        with self.lock:
+            return self._marca(tabelas)
+
+    def guardar(self, chave, valor, tabelas, ttl, marca=None):
+        tabelas = frozenset(tabelas)
+        with self.lock:
+            if marca is not None and marca != self._marca(tabelas):
+                return False
+            if chave in self.entradas:
+                self._remover(chave)
+            self.entradas[chave] = (time.monotonic() + ttl, valor, tabelas)
+            for tabela in tabelas:
+                self.por_tabela[tabela].add(chave)
+            while len(self.entradas) > self.max_entradas:
+                self._remover(next(iter(self.entradas)))
+                self.evictions += 1
+            return True
+
+    def invalidar(self, tabelas):
+        with self.lock:
+            chaves = set()
+            for tabela in tabelas:
+                self.versoes[tabela] += 1
+                chaves |= self.por_tabela.get(tabela, set())
+            for chave in chaves:
+                self._remover(chave)
+            self.invalidacoes += len(chaves)
+            return len(chaves)
+
+    def limpar(self):
+        with self.lock:
+            self.invalidacoes += len(self.entradas)
+            self.epoca += 1
+            self.entradas.clear()
+            self.por_tabela.clear()
+
+    def estatisticas(self):
+        with self.lock:
+            return {
+                'entradas': len(self.entradas),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidacoes': self.invalidacoes,
+            }
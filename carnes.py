@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+import functools
+import itertools
+import multiprocessing
+import os
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from fpdf import FPDF
+
+# ==============================================================================
+# CARNÊS DE PAGAMENTO EM PDF
+# ==============================================================================
+# Um PDF por aluno, com três parcelas por folha A4. Para uma turma ou a
+# escola inteira os alunos são distribuídos num pool de processos e cada PDF
+# vai direto para o ZIP assim que fica pronto. Logo e layout são preparados
+# uma vez por processo e reaproveitados em todos os documentos.
+
+NOME_ESCOLA = "Educandário Sonho Dourado"
+LOGO_PADRAO = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logoesd.png')
+ALUNOS_POR_TAREFA = 25
+LARGURA_LOGO_PX = 240
+
+# Medidas em mm numa folha A4 (210 x 297).
+LAYOUT = {
+    'margem': 8,
+    'altura_parcela': 93,
+    'parcelas_por_folha': 3,
+    'largura_canhoto': 52,
+    'largura_total': 194,
+    'logo': 16,
+}
+
+QUERY_CARNES = """
+SELECT a.id AS aluno_id, a.nome, t.nome_turma, f.id, f.descricao, f.valor, f.vencimento
+FROM financeiro f
+JOIN alunos a ON f.aluno_id = a.id
+LEFT JOIN turmas t ON a.turma_id = t.id
+WHERE f.status = 'Pendente'
+AND (%(turma_id)s::int IS NULL OR a.turma_id = %(turma_id)s)
+AND (%(inicio)s::date IS NULL OR f.vencimento >= %(inicio)s)
+AND (%(fim)s::date IS NULL OR f.vencimento <= %(fim)s)
+ORDER BY a.nome, a.id, f.vencimento, f.id
+"""
+
+def latin1(texto):
+    # As fontes padrão do PDF só conhecem Latin-1.
+    return str(texto if texto is not None else '').encode('latin-1', 'replace').decode('latin-1')
+
+@functools.lru_cache(maxsize=None)
+def logo_preparado(caminho=LOGO_PADRAO):
+    """Reduz o logo para um JPEG pequeno uma única vez e devolve o caminho.
+    O PNG original (RGBA, 1793 px) levaria mais de um segundo para ser
+    processado em cada documento; o JPEG o FPDF só copia."""
+    if not os.path.exists(caminho):
+        return None
+
+    from PIL import Image
+
+    destino = os.path.join(tempfile.gettempdir(), f"esd_logo_{int(os.path.getmtime(caminho))}_{LARGURA_LOGO_PX}.jpg")
+    if not os.path.exists(destino):
+        with Image.open(caminho) as img:
+            img = img.convert('RGBA')
+            fundo = Image.new('RGB', img.size, (255, 255, 255))
+            fundo.paste(img, mask=img.split()[3])
+            fundo.thumbnail((LARGURA_LOGO_PX, LARGURA_LOGO_PX))
+            temporario = f"{destino}.{os.getpid()}"
+            fundo.save(temporario, 'JPEG', quality=85)
+        os.replace(temporario, destino)
+
+    return destino
+
+
+class CarnePDF(FPDF):
+    def __init__(self, nome_escola=NOME_ESCOLA):
+        super().__init__('P', 'mm', 'A4')
+        self.nome_escola = latin1(nome_escola)
+        self.set_auto_page_break(False)
+        self.set_margins(LAYOUT['margem'], LAYOUT['margem'])
+        self.logo = logo_preparado()
+
+    def _rotulo(self, x, y, largura, rotulo, valor, altura=9, negrito=False):
+        self.rect(x, y, largura, altura)
+        self.set_xy(x + 1, y + 0.5)
+        self.set_font('Arial', '', 6)
+        self.cell(largura - 2, 3, rotulo)
+        self.set_xy(x + 1, y + 3.8)
+        self.set_font('Arial', 'B' if negrito else '', 9)
+        self.cell(largura - 2, 4.5, latin1(valor))
+
+    def parcela(self, y, aluno, cobranca, numero, total):
+        m = LAYOUT['margem']
+        canhoto = LAYOUT['largura_canhoto']
+        x = m + canhoto + 4
+        largura = LAYOUT['largura_total'] - canhoto - 4
+        vencimento = cobranca['vencimento'].strftime('%d/%m/%Y')
+        valor = f"R$ {cobranca['valor']:,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.')
+
+        # Canhoto (fica com a escola)
+        self.set_xy(m, y)
+        self.set_font('Arial', 'B', 8)
+        self.cell(canhoto, 5, "RECIBO DO PAGADOR")
+        self._rotulo(m, y + 6, canhoto, "Aluno", aluno['nome'][:30])
+        self._rotulo(m, y + 15, canhoto / 2, "Parcela", f"{numero}/{total}")
+        self._rotulo(m + canhoto / 2, y + 15, canhoto / 2, "Documento", cobranca['id'])
+        self._rotulo(m, y + 24, canhoto, "Vencimento", vencimento, negrito=True)
+        self._rotulo(m, y + 33, canhoto, "Valor", valor, negrito=True)
+        self._rotulo(m, y + 42, canhoto, "Data do pagamento", "____/____/______")
+        self._rotulo(m, y + 51, canhoto, "Assinatura", "", altura=14)
+
+        self._tracejado(m + canhoto + 2, y, m + canhoto + 2, y + LAYOUT['altura_parcela'] - 8)
+
+        # Corpo da parcela
+        if self.logo:
+            self.image(self.logo, x, y, LAYOUT['logo'])
+        self.set_xy(x + LAYOUT['logo'] + 2, y + 1)
+        self.set_font('Arial', 'B', 11)
+        self.cell(largura - LAYOUT['logo'] - 2, 6, self.nome_escola)
+        self.set_xy(x + LAYOUT['logo'] + 2, y + 7)
+        self.set_font('Arial', '', 8)
+        self.cell(largura - LAYOUT['logo'] - 2, 5, "CARNÊ DE PAGAMENTO")
+
+        metade = largura / 2
+        self._rotulo(x, y + 18, largura * 0.7, "Aluno", aluno['nome'])
+        self._rotulo(x + largura * 0.7, y + 18, largura * 0.3, "Turma", aluno['nome_turma'] or '')
+        self._rotulo(x, y + 27, largura, "Descrição", cobranca['descricao'] or '')
+        self._rotulo(x, y + 36, metade / 2, "Parcela", f"{numero}/{total}")
+        self._rotulo(x + metade / 2, y + 36, metade / 2, "Documento", cobranca['id'])
+        self._rotulo(x + metade, y + 36, metade / 2, "Vencimento", vencimento, negrito=True)
+        self._rotulo(x + metade * 1.5, y + 36, metade / 2, "Valor", valor, negrito=True)
+        self._rotulo(x, y + 45, largura, "Instruções",
+                     "Pagável na secretaria da escola. Após o vencimento, procure a secretaria.", altura=11)
+        self._rotulo(x, y + 56, largura, "Autenticação", "", altura=14)
+
+    def _tracejado(self, x1, y1, x2, y2, traco=1.5):
+        # Linha de recorte (vertical ou horizontal).
+        comprimento = max(abs(x2 - x1), abs(y2 - y1))
+        dx, dy = (x2 - x1) / comprimento, (y2 - y1) / comprimento
+        pos = 0.0
+        while pos < comprimento:
+            fim = min(pos + traco, comprimento)
+            self.line(x1 + dx * pos, y1 + dy * pos, x1 + dx * fim, y1 + dy * fim)
+            pos += traco * 2
+
+    def carne(self, aluno, cobrancas):
+        por_folha = LAYOUT['parcelas_por_folha']
+        for i, cobranca in enumerate(cobrancas):
+            posicao = i % por_folha
+            if posicao == 0:
+                self.add_page()
+            y = LAYOUT['margem'] + posicao * (LAYOUT['altura_parcela'] + 4)
+            self.parcela(y, aluno, cobranca, i + 1, len(cobrancas))
+            if posicao < por_folha - 1 and i < len(cobrancas) - 1:
+                corte = y + LAYOUT['altura_parcela'] + 1
+                self._tracejado(LAYOUT['margem'], corte, LAYOUT['margem'] + LAYOUT['largura_total'], corte)
+
+def _seguro(texto):
+    return ''.join(ch if ch.isalnum() else '_' for ch in latin1(texto)).strip('_')
+
+def nome_arquivo(aluno):
+    return f"{_seguro(aluno['nome_turma'] or 'sem turma')}/{_seguro(aluno['nome'])[:60]}_{aluno['aluno_id']}.pdf"
+
+def renderizar_carne(aluno, cobrancas, nome_escola=NOME_ESCOLA):
+    pdf = CarnePDF(nome_escola)
+    pdf.carne(aluno, cobrancas)
+    return pdf.output('', 'S').encode('latin-1')
+
+def renderizar_lote(lote, nome_escola=NOME_ESCOLA):
+    # Executado nos processos do pool: devolve [(nome no zip, bytes do PDF)].
+    return [(nome_arquivo(aluno), renderizar_carne(aluno, cobrancas, nome_escola)) for aluno, cobrancas in lote]
+
+def agrupar_por_aluno(linhas):
+    # linhas ordenadas por aluno; gera (aluno, [cobranças]) sem materializar tudo.
+    for _, grupo in itertools.groupby(linhas, key=lambda r: r['aluno_id']):
+        grupo = list(grupo)
+        primeira = grupo[0]
+        aluno = {'aluno_id': primeira['aluno_id'], 'nome': primeira['nome'], 'nome_turma': primeira['nome_turma']}
+        cobrancas = [{'id': r['id'], 'descricao': r['descricao'], 'valor': float(r['valor']), 'vencimento': r['vencimento']} for r in grupo]
+        yield aluno, cobrancas
+
+def em_lotes(iteravel, tamanho):
+    iterador = iter(iteravel)
+    while lote := list(itertools.islice(iterador, tamanho)):
+        yield lote
+
+def _aquecer():
+    logo_preparado()
+
+def gerar_zip_carnes(grupos, destino, processos=None, nome_escola=NOME_ESCOLA, tamanho_tarefa=ALUNOS_POR_TAREFA):
+    """Renderiza os carnês de `grupos` ((aluno, cobranças), ...) no pool e
+    grava cada PDF em `destino` (caminho ou arquivo) assim que fica pronto.
+    Só alguns lotes ficam em voo ao mesmo tempo. Devolve quantos PDFs."""
+    processos = processos or min(os.cpu_count() or 1, 8)
+    total = 0
+
+    # spawn: não herda as threads do servidor do Streamlit, como o fork faria.
+    contexto = multiprocessing.get_context('spawn')
+    with zipfile.ZipFile(destino, 'w', zipfile.ZIP_DEFLATED) as zf, \
+         ProcessPoolExecutor(processos, mp_context=contexto, initializer=_aquecer) as pool:
+        pendentes = set()
+        for lote in em_lotes(grupos, tamanho_tarefa):
+            pendentes.add(pool.submit(renderizar_lote, lote, nome_escola))
+            if len(pendentes) >= processos * 2:
+                prontos, pendentes = wait(pendentes, return_when=FIRST_COMPLETED)
+                total += _gravar(zf, prontos)
+        total += _gravar(zf, pendentes)
+    return total
+
+def _gravar(zf, futuros):
+    gravados = 0
+    for futuro in futuros:
+        for nome, conteudo in futuro.result():
+            zf.writestr(nome, conteudo)
+            gravados += 1
+    return gravados
+
+def gerar_carnes(conn, destino, turma_id=None, inicio=None, fim=None, processos=None, nome_escola=NOME_ESCOLA):
+    """Lê as cobranças pendentes com um cursor no servidor (em blocos) e gera
+    o ZIP com um carnê por aluno. Devolve quantos PDFs foram gerados."""
+    from psycopg2.extras import RealDictCursor
+
+    with conn.cursor(name='carnes', cursor_factory=RealDictCursor) as c:
+        c.itersize = 2000
+        c.execute(QUERY_CARNES, {'turma_id': turma_id, 'inicio': inicio, 'fim': fim})
+        total = gerar_zip_carnes(agrupar_por_aluno(c), destino, processos, nome_escola)
+    conn.commit()
+    return total
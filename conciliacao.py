@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+import csv
+import itertools
+from datetime import datetime
+
+import pandas as pd
+from psycopg2.extras import execute_values
+
+from importacao import normalizar_nome
+
+# ==============================================================================
+# CONCILIAÇÃO DE EXTRATO BANCÁRIO / ARQUIVO DE RETORNO
+# ==============================================================================
+# O arquivo é lido linha a linha (sem carregar tudo na memória), os créditos
+# são cruzados com as cobranças pendentes e as baixas saem num único
+# UPDATE ... FROM (VALUES ...) dentro de uma transação.
+
+COLUNAS_EXTRATO = {
+    'data': ('data', 'data_pagamento', 'data_credito', 'data_lancamento', 'data_movimento', 'dt'),
+    'valor': ('valor', 'valor_pago', 'valor_credito', 'quantia', 'montante'),
+    'referencia': ('referencia', 'documento', 'num_documento', 'seu_numero', 'nosso_numero', 'identificador', 'txid', 'id'),
+    'descricao': ('descricao', 'historico', 'lancamento', 'complemento'),
+}
+
+# CNAB 240 (FEBRABAN), retorno de cobrança: posições 1-based, inclusivas.
+# O "seu número" (segmento T) deve trazer o ID da cobrança no sistema.
+CNAB240_SEGMENTO_T = {'referencia': (59, 73), 'valor_titulo': (82, 96)}
+CNAB240_SEGMENTO_U = {'valor': (78, 92), 'data': (138, 145)}
+CNAB240_LIQUIDACAO = ('06', '17')
+
+TOLERANCIA_DIAS_PADRAO = 5
+
+def _campo(linha, posicoes):
+    inicio, fim = posicoes
+    return linha[inicio - 1:fim].strip()
+
+def _valor_texto(texto):
+    texto = (texto or '').replace('R$', '').strip()
+    if ',' in texto:
+        texto = texto.replace('.', '').replace(',', '.')
+    return round(float(texto), 2)
+
+def _data_texto(texto):
+    texto = (texto or '').strip()[:10]
+    for formato in ('%d/%m/%Y', '%Y-%m-%d', '%d-%m-%Y', '%d%m%Y'):
+        try:
+            return datetime.strptime(texto, formato).date()
+        except ValueError:
+            pass
+    raise ValueError(f"data inválida: {texto!r}")
+
+def ler_cnab240(linhas):
+    # Segmentos T e U vêm em pares; só as liquidações viram pagamento.
+    titulo = None
+    for n, linha in enumerate(linhas, start=1):
+        linha = linha.rstrip('\r\n')
+        if len(linha) < 240 or linha[7] != '3':
+            continue
+        segmento, movimento = linha[13], linha[15:17]
+        if segmento == 'T':
+            titulo = {'linha': n, 'referencia': _campo(linha, CNAB240_SEGMENTO_T['referencia']).lstrip('0')}
+        elif segmento == 'U' and titulo is not None:
+            if movimento in CNAB240_LIQUIDACAO:
+                yield {
+                    'linha': titulo['linha'],
+                    'data': _data_texto(_campo(linha, CNAB240_SEGMENTO_U['data'])),
+                    'valor': int(_campo(linha, CNAB240_SEGMENTO_U['valor']) or 0) / 100,
+                    'referencia': titulo['referencia'],
+                    'descricao': f"CNAB movimento {movimento}",
+                    'erro': '',
+                }
+            titulo = None
+
+def ler_csv_extrato(linhas):
+    primeira = next(linhas, '')
+    try:
+        dialeto = csv.Sniffer().sniff(primeira, delimiters=';,\t|')
+    except csv.Error:
+        dialeto = 'excel'
+    leitor = csv.reader(itertools.chain([primeira], linhas), dialeto)
+
+    cabecalho = [normalizar_nome(c) for c in next(leitor)]
+    indices = {campo: next((cabecalho.index(n) for n in nomes if n in cabecalho), None)
+               for campo, nomes in COLUNAS_EXTRATO.items()}
+    if indices['valor'] is None or indices['data'] is None:
+        raise ValueError("O extrato precisa ter ao menos as colunas de data e valor.")
+
+    for n, registro in enumerate(leitor, start=1):
+        if not any(registro):
+            continue
+        item = {campo: (registro[i] if i is not None and i < len(registro) else '') for campo, i in indices.items()}
+        saida = {'linha': n, 'data': None, 'valor': None, 'referencia': item['referencia'].strip(),
+                 'descricao': item['descricao'].strip(), 'erro': ''}
+        try:
+            saida['valor'] = _valor_texto(item['valor'])
+            saida['data'] = _data_texto(item['data'])
+        except ValueError as e:
+            saida['erro'] = str(e)
+        if not saida['erro'] and saida['valor'] <= 0:
+            continue  # débitos e estornos não quitam cobranças
+        yield saida
+
+def _linhas_texto(arquivo):
+    # Bancos exportam em UTF-8 ou Latin-1; decide linha a linha.
+    for n, bruta in enumerate(arquivo):
+        try:
+            linha = bruta.decode('utf-8')
+        except UnicodeDecodeError:
+            linha = bruta.decode('latin-1')
+        yield linha.lstrip('\ufeff') if n == 0 else linha
+
+def ler_extrato(arquivo):
+    """Devolve um DataFrame com linha, data, valor, referencia, descricao e
+    erro. Detecta CNAB 240 pelo tamanho da primeira linha; o resto é CSV."""
+    linhas = _linhas_texto(arquivo)
+    primeira = next(linhas, '')
+    linhas = itertools.chain([primeira], linhas)
+
+    if len(primeira.rstrip('\r\n')) == 240:
+        registros = ler_cnab240(linhas)
+    else:
+        registros = ler_csv_extrato(linhas)
+
+    return pd.DataFrame(registros, columns=['linha', 'data', 'valor', 'referencia', 'descricao', 'erro'])
+
+def conciliar(extrato, pendentes, tolerancia_dias=TOLERANCIA_DIAS_PADRAO):
+    """Cruza o extrato com as cobranças pendentes (id, nome, descricao, valor,
+    vencimento). Primeiro pela referência (ID da cobrança) com o mesmo
+    valor; depois por valor e data, quando há um único candidato dentro da
+    tolerância. Devolve (conciliados, nao_conciliados)."""
+    extrato = extrato.copy()
+    extrato['motivo'] = extrato['erro']
+    extrato['financeiro_id'] = pd.array([pd.NA] * len(extrato), dtype='Int64')
+    extrato['criterio'] = ''
+
+    pend = pendentes.copy()
+    pend['centavos'] = (pend['valor'].astype(float) * 100).round().astype('int64')
+    pend['vencimento'] = pd.to_datetime(pend['vencimento'])
+    pend = pend.set_index('id', drop=False)
+
+    validas = extrato['motivo'].eq('')
+    extrato['centavos'] = (extrato['valor'].astype(float).fillna(0) * 100).round().astype('int64')
+
+    # 1) Referência = ID da cobrança.
+    ref = pd.to_numeric(extrato['referencia'].where(extrato['referencia'].str.fullmatch(r'\d+', na=False)), errors='coerce')
+    tem_ref = validas & ref.isin(pend.index)
+    centavos_ref = ref[tem_ref].astype('int64').map(pend['centavos'])
+    bate = centavos_ref.eq(extrato.loc[tem_ref, 'centavos'])
+    idx_bate = bate[bate].index
+    idx_difere = bate[~bate].index
+    extrato.loc[idx_bate, 'financeiro_id'] = ref[idx_bate].astype('int64')
+    extrato.loc[idx_bate, 'criterio'] = 'referência'
+    extrato.loc[idx_difere, 'motivo'] = "valor diferente da cobrança " + ref[idx_difere].astype('int64').astype(str)
+
+    repetidas = extrato['financeiro_id'].notna() & extrato['financeiro_id'].duplicated(keep='first')
+    extrato.loc[repetidas, 'motivo'] = "cobrança já conciliada por outra linha"
+    extrato.loc[repetidas, ['financeiro_id', 'criterio']] = [pd.NA, '']
+
+    # 2) Valor + data, para o que sobrou.
+    restantes = extrato[extrato['financeiro_id'].isna() & extrato['motivo'].eq('')]
+    livres = pend[~pend['id'].isin(extrato['financeiro_id'].dropna())]
+    if not restantes.empty and not livres.empty:
+        pares = restantes[['centavos', 'data']].reset_index().merge(livres[['id', 'centavos', 'vencimento']], on='centavos')
+        pares = pares[(pd.to_datetime(pares['data']) - pares['vencimento']).abs().dt.days <= tolerancia_dias]
+        # Só vale quando a linha tem um único candidato e o candidato uma única linha.
+        pares = pares[~pares['index'].duplicated(keep=False) & ~pares['id'].duplicated(keep=False)]
+        extrato.loc[pares['index'], 'financeiro_id'] = pares['id'].to_numpy()
+        extrato.loc[pares['index'], 'criterio'] = 'valor e data'
+
+    sem_par = extrato['financeiro_id'].isna() & extrato['motivo'].eq('')
+    extrato.loc[sem_par, 'motivo'] = "nenhuma cobrança pendente única com este valor e data"
+
+    ok = extrato['financeiro_id'].notna()
+    conciliados = extrato[ok].merge(pend[['nome', 'descricao', 'vencimento']].rename(columns={'descricao': 'cobranca'}),
+                                    left_on='financeiro_id', right_index=True)
+    colunas = ['linha', 'data', 'valor', 'referencia', 'descricao']
+    return (conciliados[colunas + ['financeiro_id', 'nome', 'cobranca', 'vencimento', 'criterio']].reset_index(drop=True),
+            extrato.loc[~ok, colunas + ['motivo']].reset_index(drop=True))
+
+def baixar_pagamentos(conn, ids):
+    """Quita as cobranças num único UPDATE ... IN (VALUES ...), que vale no
+    PostgreSQL e no SQLite. Devolve quantas estavam pendentes e foram baixadas."""
+    ids = [(int(i),) for i in ids]
+    if not ids:
+        return 0
+    try:
+        with conn.cursor() as c:
+            execute_values(c, """
+                UPDATE financeiro SET status = 'Pago'
+                WHERE status = 'Pendente' AND id IN (VALUES %s)
+            """, ids, page_size=len(ids))
+            baixadas = c.rowcount
+        conn.commit()
+        return baixadas
+    except Exception:
+        conn.rollback()
+        raise
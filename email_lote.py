@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+# ==============================================================================
+# ENVIO DE E-MAILS EM LOTE
+# ==============================================================================
+# Mantém poucas sessões SMTP autenticadas abertas durante todo o lote, em vez
+# de conectar, fazer STARTTLS e login a cada mensagem.
+#
+# smtplib e email.mime só são importados no primeiro envio: o app importa
+# este módulo na partida, mas a maioria das sessões nunca manda e-mail.
+
+SMTP_HOST_PADRAO = "smtp.gmail.com"
+SMTP_PORTA_PADRAO = 587
+MAX_SESSOES_PADRAO = 3
+ENVIOS_POR_MINUTO_PADRAO = 120
+CHAVES_CONFIG_EMAIL = ('email_envio', 'senha_app', 'smtp_host', 'smtp_porta', 'smtp_tls', 'smtp_limite_minuto')
+
+
+def config_smtp(valores):
+    # valores: dicionário chave -> valor vindo da tabela config_sistema
+    return {
+        'email': valores.get('email_envio', ''),
+        'senha': valores.get('senha_app', ''),
+        'host': valores.get('smtp_host') or SMTP_HOST_PADRAO,
+        'porta': int(valores.get('smtp_porta') or SMTP_PORTA_PADRAO),
+        'starttls': valores.get('smtp_tls', '1') != '0',
+        'envios_por_minuto': int(valores.get('smtp_limite_minuto') or ENVIOS_POR_MINUTO_PADRAO),
+    }
+
+
+class LimitadorTaxa:
+    def __init__(self, envios_por_minuto):
+        self.intervalo = 60.0 / envios_por_minuto if envios_por_minuto else 0.0
+        self.proximo = 0.0
+        self.lock = threading.Lock()
+
+    def aguardar(self):
+        if not self.intervalo:
+            return
+        with self.lock:
+            agora = time.monotonic()
+            espera = self.proximo - agora
+            self.proximo = max(agora, self.proximo) + self.intervalo
+        if espera > 0:
+            time.sleep(espera)
+
+
+class PoolSMTP:
+    def __init__(self, config, max_sessoes=MAX_SESSOES_PADRAO):
+        self.config = config
+        self.livres = queue.LifoQueue()
+        self.todas = []
+        self.lock = threading.Lock()
+        self.max_sessoes = max_sessoes
+        # Primeira falha ao conectar/autenticar: o resto do lote falha com ela
+        # em vez de repetir o login (senha errada pode bloquear a conta).
+        self.erro_conexao = None
+
+    def _abrir_sessao(self):
+        import smtplib
+
+        cfg = self.config
+        server = smtplib.SMTP(cfg.get('host') or SMTP_HOST_PADRAO,
+                              int(cfg.get('porta') or SMTP_PORTA_PADRAO),
+                              timeout=cfg.get('timeout', 30))
+        if cfg.get('starttls', True):
+            server.starttls()
+        if cfg.get('senha') and server.has_extn('auth'):
+            server.login(cfg['email'], cfg['senha'])
+        return server
+
+    def _obter_sessao(self):
+        if self.erro_conexao is not None:
+            raise self.erro_conexao
+        try:
+            return self.livres.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            if self.erro_conexao is not None:
+                raise self.erro_conexao
+            if len(self.todas) < self.max_sessoes:
+                try:
+                    server = self._abrir_sessao()
+                except Exception as e:
+                    self.erro_conexao = e
+                    raise
+                self.todas.append(server)
+                return server
+        return self.livres.get()
+
+    def _descartar(self, server):
+        with self.lock:
+            if server in self.todas:
+                self.todas.remove(server)
+        try:
+            server.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def sessao(self):
+        import smtplib
+
+        server = self._obter_sessao()
+        try:
+            yield server
+        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError):
+            # Recusa do destinatário ou da mensagem: a sessão continua válida.
+            self.livres.put(server)
+            raise
+        except Exception:
+            # Desconexão, timeout, conexão resetada: a sessão pode estar morta.
+            self._descartar(server)
+            raise
+        else:
+            self.livres.put(server)
+
+    def enviar(self, destinatario, msg_str):
+        import smtplib
+
+        # Uma sessão pode cair no meio do lote: tenta de novo com uma sessão nova.
+        for tentativa in range(2):
+            try:
+                with self.sessao() as server:
+                    server.sendmail(self.config['email'], destinatario, msg_str)
+                return
+            except smtplib.SMTPServerDisconnected:
+                if tentativa:
+                    raise
+
+    def fechar(self):
+        with self.lock:
+            sessoes, self.todas = self.todas, []
+        for server in sessoes:
+            try:
+                server.quit()
+            except Exception:
+                try:
+                    server.close()
+                except Exception:
+                    pass
+
+
+def montar_mensagem(remetente, destinatario, assunto, corpo):
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+
+    msg = MIMEMultipart()
+    msg['From'] = remetente
+    msg['To'] = destinatario
+    msg['Subject'] = assunto
+    msg.attach(MIMEText(corpo, 'plain'))
+    return msg.as_string()
+
+
+def enviar_emails_lote(config, mensagens, max_sessoes=None, envios_por_minuto=None):
+    """Envia uma lista de mensagens ({'destinatario', 'assunto', 'corpo', ...})
+    reaproveitando as sessões SMTP. Retorna um resultado por mensagem, na mesma
+    ordem da entrada, com as chaves originais mais 'ok' e 'detalhe'."""
+    mensagens = list(mensagens)
+    if not mensagens:
+        return []
+
+    max_sessoes = max_sessoes or config.get('max_sessoes') or MAX_SESSOES_PADRAO
+    if envios_por_minuto is None:
+        envios_por_minuto = config.get('envios_por_minuto', ENVIOS_POR_MINUTO_PADRAO)
+
+    pool_smtp = PoolSMTP(config, max_sessoes=min(max_sessoes, len(mensagens)))
+    limitador = LimitadorTaxa(envios_por_minuto)
+
+    def enviar_uma(item):
+        resultado = dict(item)
+        destinatario = item.get('destinatario')
+        if not destinatario or "@" not in destinatario:
+            resultado.update(ok=False, detalhe="E-mail inválido.")
+            return resultado
+        try:
+            limitador.aguardar()
+            msg_str = montar_mensagem(config['email'], destinatario, item['assunto'], item['corpo'])
+            pool_smtp.enviar(destinatario, msg_str)
+            resultado.update(ok=True, detalhe="E-mail enviado!")
+        except Exception as e:
+            resultado.update(ok=False, detalhe=str(e))
+        return resultado
+
+    try:
+        with ThreadPoolExecutor(max_workers=pool_smtp.max_sessoes) as executor:
+            return list(executor.map(enviar_uma, mensagens))
+    finally:
+        pool_smtp.fechar()
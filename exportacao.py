@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+import csv
+import io
+
+import pyarrow as pa
+
+from banco import dialeto
+from importacao import normalizar_nome
+
+# ==============================================================================
+# EXPORTAÇÃO EM LOTE (CSV / XLSX / PARQUET)
+# ==============================================================================
+# As linhas saem do banco em lotes de tamanho fixo (cursor nomeado, no
+# servidor) e vão direto para o arquivo de destino: a memória usada é a de um
+# lote, exporte mil ou um milhão de linhas. O CSV no PostgreSQL nem passa
+# pelo Python: COPY ... TO STDOUT escreve no arquivo.
+#
+# Os nomes das colunas de alunos e cobranças são os mesmos da importação,
+# então o arquivo exportado pode ser reimportado.
+
+TAMANHO_LOTE = 5000
+LINHAS_POR_ABA = 1048575     # limite do Excel, menos o cabeçalho
+FORMATOS_EXPORTACAO = {
+    'CSV': ('csv', 'text/csv'),
+    'Excel (XLSX)': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'Parquet': ('parquet', 'application/vnd.apache.parquet'),
+}
+BOM = '\ufeff'          # o Excel só reconhece UTF-8 com ele
+
+# colunas: (nome, tipo) com tipo inteiro, texto, data ou numero.
+EXPORTACOES = {
+    'Alunos': {
+        'sql': """
+            SELECT a.id, a.nome, a.data_nascimento, a.cpf, a.rg, a.naturalidade, a.mae_nome, a.pai_nome,
+                   t.nome_turma AS turma, a.status, a.telefone_contato, a.email_responsavel,
+                   a.endereco, a.bairro, a.cep, a.cidade
+            FROM alunos a
+            LEFT JOIN turmas t ON t.id = a.turma_id
+            ORDER BY a.id
+        """,
+        'colunas': [('id', 'inteiro'), ('nome', 'texto'), ('data_nascimento', 'data'), ('cpf', 'texto'),
+                    ('rg', 'texto'), ('naturalidade', 'texto'), ('mae_nome', 'texto'), ('pai_nome', 'texto'),
+                    ('turma', 'texto'), ('status', 'texto'), ('telefone_contato', 'texto'),
+                    ('email_responsavel', 'texto'), ('endereco', 'texto'), ('bairro', 'texto'), ('cep', 'texto'),
+                    ('cidade', 'texto')],
+    },
+    'Cobranças': {
+        'sql': """
+            SELECT f.id, a.nome AS aluno, a.cpf AS aluno_cpf, t.nome_turma AS turma, f.descricao, f.valor,
+                   f.vencimento, f.status, f.competencia
+            FROM financeiro f
+            JOIN alunos a ON a.id = f.aluno_id
+            LEFT JOIN turmas t ON t.id = a.turma_id
+            WHERE (%(status)s::text IS NULL OR f.status = %(status)s)
+            AND (%(inicio)s::date IS NULL OR f.vencimento >= %(inicio)s)
+            AND (%(fim)s::date IS NULL OR f.vencimento <= %(fim)s)
+            ORDER BY f.id
+        """,
+        'colunas': [('id', 'inteiro'), ('aluno', 'texto'), ('aluno_cpf', 'texto'), ('turma', 'texto'),
+                    ('descricao', 'texto'), ('valor', 'numero'), ('vencimento', 'data'), ('status', 'texto'),
+                    ('competencia', 'data')],
+        'filtros': ('status', 'inicio', 'fim'),
+    },
+    'Log de envios': {
+        'sql': """
+            SELECT l.id, l.data_envio, l.tipo_aviso, l.canal, l.financeiro_id, a.nome AS aluno, f.descricao, f.vencimento
+            FROM log_envios l
+            LEFT JOIN financeiro f ON f.id = l.financeiro_id
+            LEFT JOIN alunos a ON a.id = f.aluno_id
+            ORDER BY l.id
+        """,
+        'colunas': [('id', 'inteiro'), ('data_envio', 'texto'), ('tipo_aviso', 'texto'), ('canal', 'texto'),
+                    ('financeiro_id', 'inteiro'), ('aluno', 'texto'), ('descricao', 'texto'), ('vencimento', 'data')],
+    },
+}
+
+TIPOS_ARROW = {'inteiro': pa.int64(), 'texto': pa.string(), 'data': pa.date32(), 'numero': pa.float64()}
+
+def parametros_exportacao(nome, status=None, inicio=None, fim=None):
+    valores = {'status': status or None, 'inicio': inicio, 'fim': fim}
+    return {chave: valores[chave] for chave in EXPORTACOES[nome].get('filtros', ())}
+
+def nome_arquivo_exportacao(nome, formato):
+    return f"{normalizar_nome(nome)}.{FORMATOS_EXPORTACAO[formato][0]}"
+
+def lotes(conn, sql, params, tamanho_lote=TAMANHO_LOTE):
+    # Cursor nomeado: o PostgreSQL guarda o resultado e entrega um lote por vez.
+    with conn.cursor(name='exportacao') as c:
+        c.itersize = tamanho_lote
+        c.execute(sql, params)
+        while True:
+            linhas = c.fetchmany(tamanho_lote)
+            if not linhas:
+                break
+            yield linhas
+
+# ==============================================================================
+# ESCRITORES
+# ==============================================================================
+
+def _csv_copy(conn, sql, params, destino):
+    with conn.cursor() as c:
+        # Um único comando para o arquivo inteiro: o statement_timeout do pool
+        # cortaria uma exportação grande no meio (vale só nesta transação).
+        c.execute("SET LOCAL statement_timeout = 0")
+        # COPY não aceita parâmetros: os valores entram já escapados pelo mogrify.
+        consulta = c.mogrify(sql, params).decode('utf-8')
+        destino.write(BOM.encode('utf-8'))
+        c.copy_expert(f"COPY ({consulta}) TO STDOUT WITH (FORMAT csv, HEADER)", destino)
+        return c.rowcount
+
+def _csv(conn, sql, params, destino, colunas, tamanho_lote):
+    texto = io.TextIOWrapper(destino, encoding='utf-8-sig', newline='', write_through=True)
+    escritor = csv.writer(texto)
+    escritor.writerow([nome for nome, _ in colunas])
+    total = 0
+    for linhas in lotes(conn, sql, params, tamanho_lote):
+        escritor.writerows(linhas)
+        total += len(linhas)
+    texto.detach()      # não fecha o destino
+    return total
+
+def _xlsx(conn, sql, params, destino, colunas, tamanho_lote):
+    from openpyxl import Workbook     # só quem exporta XLSX paga a importação
+
+    # write_only: as linhas vão para um arquivo temporário à medida que chegam.
+    livro = Workbook(write_only=True)
+    cabecalho = [nome for nome, _ in colunas]
+    aba, na_aba, total = None, LINHAS_POR_ABA, 0
+    for linhas in lotes(conn, sql, params, tamanho_lote):
+        for linha in linhas:
+            if na_aba >= LINHAS_POR_ABA:
+                aba = livro.create_sheet(f"dados_{len(livro.worksheets) + 1}" if aba else "dados")
+                aba.append(cabecalho)
+                na_aba = 0
+            aba.append(linha)
+            na_aba += 1
+        total += len(linhas)
+    if aba is None:
+        livro.create_sheet("dados").append(cabecalho)
+    livro.save(destino)
+    return total
+
+def _parquet(conn, sql, params, destino, colunas, tamanho_lote):
+    import pyarrow.parquet as pq
+
+    # Esquema fixo: um lote só com nulos não muda o tipo da coluna.
+    esquema = pa.schema([(nome, TIPOS_ARROW[tipo]) for nome, tipo in colunas])
+    numeros = [i for i, (_, tipo) in enumerate(colunas) if tipo == 'numero']
+    total = 0
+    with pq.ParquetWriter(destino, esquema, compression='zstd') as escritor:
+        for linhas in lotes(conn, sql, params, tamanho_lote):
+            valores = [list(coluna) for coluna in zip(*linhas)]
+            for i in numeros:
+                valores[i] = [float(v) if v is not None else None for v in valores[i]]
+            escritor.write_batch(pa.RecordBatch.from_arrays(
+                [pa.array(coluna, type=campo.type) for coluna, campo in zip(valores, esquema)], schema=esquema))
+            total += len(linhas)
+    return total
+
+def exportar(conn, nome, formato, destino, params=None, tamanho_lote=TAMANHO_LOTE):
+    """Escreve a exportação `nome` no arquivo binário `destino` e devolve o
+    número de linhas. `params` vem de parametros_exportacao."""
+    config = EXPORTACOES[nome]
+    sql, colunas = config['sql'], config['colunas']
+    params = params if params is not None else parametros_exportacao(nome)
+    extensao = FORMATOS_EXPORTACAO[formato][0]
+    try:
+        if extensao == 'csv' and dialeto(conn) == 'postgres':
+            total = _csv_copy(conn, sql, params, destino)
+        elif extensao == 'csv':
+            total = _csv(conn, sql, params, destino, colunas, tamanho_lote)
+        elif extensao == 'xlsx':
+            total = _xlsx(conn, sql, params, destino, colunas, tamanho_lote)
+        else:
+            total = _parquet(conn, sql, params, destino, colunas, tamanho_lote)
+    finally:
+        conn.rollback()     # fecha a transação do cursor nomeado
+    return total
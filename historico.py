@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+from fpdf import FPDF
+from psycopg2.extras import execute_values
+
+from carnes import NOME_ESCOLA, latin1, logo_preparado
+
+# ==============================================================================
+# HISTÓRICO ESCOLAR
+# ==============================================================================
+# Fechamento do ano letivo de uma turma inteira numa só operação: médias,
+# frequência e resultado calculados de forma vetorizada e gravados com um
+# único INSERT ... ON CONFLICT. Os históricos da turma saem num só PDF.
+
+# Mesmas colunas da tabela historico_escolar do escola.db original.
+DISCIPLINAS = {
+    'media_portugues': "Português",
+    'media_matematica': "Matemática",
+    'nota_historia': "História",
+    'nota_geografia': "Geografia",
+    'nota_ciencias': "Ciências",
+    'nota_ingles': "Inglês",
+    'nota_artes': "Artes",
+    'nota_ed_fisica': "Ed. Física",
+    'nota_religiao': "Religião",
+}
+
+MEDIA_APROVACAO = 6.0
+FREQUENCIA_MINIMA = 75.0
+DIAS_LETIVOS_PADRAO = 200
+
+QUERY_FECHAMENTO = f"""
+SELECT a.id AS aluno_id, a.nome,
+       {', '.join(f'h.{col}' for col in DISCIPLINAS)},
+       h.frequencia_aluno, h.obs
+FROM alunos a
+LEFT JOIN historico_escolar h ON h.aluno_id = a.id AND h.ano_letivo = %s
+WHERE a.turma_id = %s AND a.status = 'Cursando'
+ORDER BY a.nome
+"""
+
+QUERY_HISTORICOS = f"""
+SELECT a.id AS aluno_id, a.nome, a.data_nascimento, a.naturalidade, a.mae_nome, a.pai_nome,
+       h.ano_letivo, h.turma_nome, h.dias_letivos, h.frequencia_aluno, h.percentual_frequencia,
+       {', '.join(f'h.{col}' for col in DISCIPLINAS)},
+       h.media_geral, h.resultado_final, h.obs
+FROM alunos a
+JOIN historico_escolar h ON h.aluno_id = a.id
+WHERE a.turma_id = %s
+ORDER BY a.nome, a.id, h.ano_letivo
+"""
+
+COLUNAS_GRAVACAO = (['aluno_id', 'ano_letivo', 'turma_nome', 'dias_letivos', 'frequencia_aluno', 'percentual_frequencia']
+                    + list(DISCIPLINAS) + ['media_geral', 'resultado_final', 'obs'])
+
+def fechar_ano(notas, dias_letivos, media_minima=MEDIA_APROVACAO, frequencia_minima=FREQUENCIA_MINIMA):
+    """Calcula média geral, percentual de frequência e resultado para todos
+    os alunos de uma vez. `notas` tem uma linha por aluno com as colunas de
+    DISCIPLINAS e frequencia_aluno (dias presentes)."""
+    df = notas.copy()
+    materias = df[list(DISCIPLINAS)].apply(pd.to_numeric, errors='coerce').astype(float)
+
+    df['media_geral'] = materias.mean(axis=1, skipna=True).round(2)
+    presentes = pd.to_numeric(df['frequencia_aluno'], errors='coerce').astype(float)
+    df['percentual_frequencia'] = (presentes / dias_letivos * 100).clip(upper=100).round(2)
+
+    sem_notas = materias.isna().all(axis=1)
+    falta = df['percentual_frequencia'] < frequencia_minima
+    nota = (df['media_geral'] < media_minima) | materias.lt(media_minima).any(axis=1)
+
+    df['resultado_final'] = np.select([sem_notas, falta, nota], ['', 'Reprovado', 'Reprovado'], 'Aprovado')
+    obs_auto = np.select([falta & ~sem_notas], ["Frequência insuficiente"], '')
+    obs = df['obs'].fillna('').astype(str) if 'obs' in df else pd.Series('', index=df.index)
+    df['obs'] = obs.where(obs.ne(''), obs_auto)
+    return df
+
+def gravar_fechamento(conn, df, ano_letivo, turma_nome, dias_letivos):
+    """Grava (ou regrava) o ano da turma inteira num único comando."""
+    df = df[df['resultado_final'].ne('')].copy()
+    if df.empty:
+        return 0
+
+    df['ano_letivo'] = int(ano_letivo)
+    df['turma_nome'] = turma_nome
+    df['dias_letivos'] = int(dias_letivos)
+    valores = df[COLUNAS_GRAVACAO].astype(object).where(df[COLUNAS_GRAVACAO].notna(), None).values.tolist()
+    atualizar = ', '.join(f"{col} = EXCLUDED.{col}" for col in COLUNAS_GRAVACAO[2:])
+
+    try:
+        with conn.cursor() as c:
+            execute_values(c, f"""
+                INSERT INTO historico_escolar ({', '.join(COLUNAS_GRAVACAO)}) VALUES %s
+                ON CONFLICT (aluno_id, ano_letivo) DO UPDATE SET {atualizar}
+            """, valores, page_size=len(valores))
+            gravados = c.rowcount
+        conn.commit()
+        return gravados
+    except Exception:
+        conn.rollback()
+        raise
+
+# ==============================================================================
+# EMISSÃO EM PDF
+# ==============================================================================
+
+class HistoricoPDF(FPDF):
+    def __init__(self, nome_escola=NOME_ESCOLA):
+        super().__init__('L', 'mm', 'A4')
+        self.nome_escola = latin1(nome_escola)
+        self.set_auto_page_break(True, 12)
+        self.logo = logo_preparado()
+        # Larguras das colunas (277 mm úteis no A4 paisagem).
+        self.colunas = ([("Ano", 14), ("Turma", 32)] + [(rotulo, 19) for rotulo in DISCIPLINAS.values()]
+                        + [("Média", 16), ("Freq. %", 16), ("Resultado", 28)])
+
+    def historico(self, aluno, anos):
+        self.add_page()
+        if self.logo:
+            self.image(self.logo, 10, 8, 20)
+        self.set_xy(34, 10)
+        self.set_font('Arial', 'B', 14)
+        self.cell(0, 7, self.nome_escola)
+        self.set_xy(34, 17)
+        self.set_font('Arial', '', 10)
+        self.cell(0, 6, "HISTÓRICO ESCOLAR")
+        self.ln(14)
+
+        nascimento = aluno['data_nascimento'].strftime('%d/%m/%Y') if aluno['data_nascimento'] else ''
+        self.set_font('Arial', '', 9)
+        for rotulo, valor in [("Aluno(a)", aluno['nome']), ("Nascimento", f"{nascimento}   Naturalidade: {aluno['naturalidade'] or ''}"),
+                              ("Filiação", ' e '.join(n for n in (aluno['mae_nome'], aluno['pai_nome']) if n))]:
+            self.set_font('Arial', 'B', 9)
+            self.cell(24, 6, rotulo + ":")
+            self.set_font('Arial', '', 9)
+            self.cell(0, 6, latin1(valor), ln=1)
+        self.ln(3)
+
+        self.set_font('Arial', 'B', 8)
+        self.set_fill_color(230, 230, 230)
+        for rotulo, largura in self.colunas:
+            self.cell(largura, 7, rotulo, 1, 0, 'C', True)
+        self.ln()
+
+        self.set_font('Arial', '', 8)
+        for ano in anos:
+            valores = ([ano['ano_letivo'], ano['turma_nome']] + [ano[col] for col in DISCIPLINAS]
+                       + [ano['media_geral'], ano['percentual_frequencia'], ano['resultado_final']])
+            for (_, largura), valor in zip(self.colunas, valores):
+                if isinstance(valor, float):
+                    texto = f"{valor:.1f}".replace('.', ',')
+                else:
+                    texto = latin1(valor)
+                self.cell(largura, 6, texto, 1, 0, 'C')
+            self.ln()
+
+        observacoes = [f"{ano['ano_letivo']}: {ano['obs']}" for ano in anos if ano['obs']]
+        if observacoes:
+            self.ln(3)
+            self.set_font('Arial', 'B', 9)
+            self.cell(0, 6, "Observações:", ln=1)
+            self.set_font('Arial', '', 9)
+            self.multi_cell(0, 5, latin1('\n'.join(observacoes)))
+
+        self.ln(14)
+        self.cell(120, 6, "_" * 45, 0, 0, 'C')
+        self.cell(0, 6, "_" * 45, 0, 1, 'C')
+        self.cell(120, 5, "Secretário(a)", 0, 0, 'C')
+        self.cell(0, 5, "Diretor(a)", 0, 1, 'C')
+
+def renderizar_historicos(linhas, nome_escola=NOME_ESCOLA):
+    """Um só PDF com uma página por aluno. `linhas` vem de QUERY_HISTORICOS
+    (DataFrame ordenado por aluno)."""
+    pdf = HistoricoPDF(nome_escola)
+    linhas = linhas.astype(object).where(linhas.notna(), None)
+    for _, anos in linhas.groupby('aluno_id', sort=False):
+        registros = anos.to_dict('records')
+        pdf.historico(registros[0], registros)
+    return pdf.output('', 'S').encode('latin-1')
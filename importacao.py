@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+import io
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+from banco import dialeto
+
+# ==============================================================================
+# IMPORTAÇÃO EM LOTE (CSV / XLSX)
+# ==============================================================================
+# Validação vetorizada em pandas e carga via COPY numa tabela temporária,
+# seguida de um único INSERT ... SELECT na mesma transação.
+
+# tipo: texto, data, numero, cpf ou uma busca ('turma', 'aluno_cpf').
+ENTIDADES_IMPORTACAO = {
+    'Alunos': {
+        'tabela': 'alunos',
+        'campos': {
+            'nome': ('texto', True),
+            'data_nascimento': ('data', False),
+            'cpf': ('cpf', False),
+            'rg': ('texto', False),
+            'naturalidade': ('texto', False),
+            'mae_nome': ('texto', False),
+            'pai_nome': ('texto', False),
+            'turma': ('turma', True),
+            'telefone_contato': ('texto', False),
+            'email_responsavel': ('texto', False),
+            'endereco': ('texto', False),
+            'bairro': ('texto', False),
+            'cep': ('texto', False),
+            'cidade': ('texto', False),
+        },
+    },
+    'Professores': {
+        'tabela': 'professores',
+        'campos': {
+            'nome': ('texto', True),
+            'cpf': ('cpf', True),
+            'rg': ('texto', False),
+            'telefone': ('texto', False),
+            'cargo': ('texto', False),
+            'data_admissao': ('data', False),
+            'salario_base': ('numero', False),
+            'carga_horaria': ('texto', False),
+            'endereco': ('texto', False),
+        },
+    },
+    'Cobranças': {
+        'tabela': 'financeiro',
+        'campos': {
+            'aluno_cpf': ('aluno_cpf', True),
+            'descricao': ('texto', False),
+            'valor': ('numero', True),
+            'vencimento': ('data', True),
+        },
+    },
+}
+
+def normalizar_nome(texto):
+    texto = unicodedata.normalize('NFKD', str(texto)).encode('ascii', 'ignore').decode()
+    return ''.join(ch if ch.isalnum() else '_' for ch in texto.strip().lower()).strip('_')
+
+def ler_arquivo(arquivo, nome_arquivo):
+    if nome_arquivo.lower().endswith(('.xlsx', '.xls')):
+        return pd.read_excel(arquivo, dtype=str)
+    return pd.read_csv(arquivo, dtype=str, sep=None, engine='python', encoding='utf-8-sig')
+
+def sugerir_mapeamento(colunas_arquivo, campos):
+    normalizadas = {normalizar_nome(c): c for c in colunas_arquivo}
+    return {campo: normalizadas.get(campo) for campo in campos}
+
+def so_digitos(serie):
+    return serie.fillna('').astype(str).str.replace(r'\D', '', regex=True)
+
+def cpf_valido(digitos):
+    # Dígitos verificadores calculados para todas as linhas de uma vez.
+    ok = digitos.str.len().eq(11) & digitos.ne(digitos.str[0].str.repeat(11))
+    validos = digitos[ok]
+    if validos.empty:
+        return ok
+
+    matriz = (np.frombuffer(''.join(validos).encode('ascii'), dtype=np.uint8).reshape(-1, 11) - ord('0')).astype(np.int64)
+    dv1 = (matriz[:, :9] @ np.arange(10, 1, -1)) * 10 % 11 % 10
+    dv2 = (np.column_stack([matriz[:, :9], dv1]) @ np.arange(11, 1, -1)) * 10 % 11 % 10
+    ok.loc[validos.index] = (dv1 == matriz[:, 9]) & (dv2 == matriz[:, 10])
+    return ok
+
+def converter_datas(serie):
+    texto = serie.fillna('').astype(str).str.strip()
+    iso = pd.to_datetime(texto, format='%Y-%m-%d', errors='coerce')
+    br = pd.to_datetime(texto, format='%d/%m/%Y', errors='coerce')
+    return iso.fillna(br).dt.date
+
+# Formatos aceitos. Ponto seguido de três dígitos, sem vírgula ("1.500"), é
+# separador de milhar; o resto ("1,500.00", "1.5.0") fica NaN e a linha é
+# rejeitada, em vez de virar um valor mil vezes menor.
+RE_NUMERO_BR = r'^-?(?:\d{1,3}(?:\.\d{3})+|\d+),\d+$'      # 1.234,56 / 1234,5
+RE_NUMERO_MILHAR = r'^-?\d{1,3}(?:\.\d{3})+$'                # 1.500 / 1.234.567
+RE_NUMERO_PONTO = r'^-?\d+(?:\.\d+)?$'                       # 1234.56 / 1500
+FORMATOS_NUMERO = "1.234,56, 1.234 ou 1234.56"
+
+def converter_numeros(serie):
+    texto = serie.fillna('').astype(str).str.strip().str.replace('R$', '', regex=False).str.strip()
+    brasileiro = texto.str.match(RE_NUMERO_BR)
+    milhar = texto.str.match(RE_NUMERO_MILHAR)
+    texto = texto.where(~(brasileiro | milhar), texto.str.replace('.', '', regex=False).str.replace(',', '.', regex=False))
+    aceito = brasileiro | milhar | texto.str.match(RE_NUMERO_PONTO)
+    return pd.to_numeric(texto.where(aceito), errors='coerce')
+
+def validar(df_origem, entidade, mapeamento, turmas, alunos_cpf, cpfs_existentes):
+    """Devolve (válidos, erros). `válidos` já tem as colunas da tabela de
+    destino; `erros` tem a linha do arquivo (1 = primeira linha de dados),
+    os dados originais e o motivo da rejeição."""
+    campos = ENTIDADES_IMPORTACAO[entidade]['campos']
+    n = len(df_origem)
+    saida = pd.DataFrame(index=df_origem.index)
+    motivos = pd.Series([''] * n, index=df_origem.index, dtype=object)
+
+    def rejeitar(mascara, motivo):
+        motivos.loc[mascara] = motivos.loc[mascara] + motivo + '; '
+
+    for campo, (tipo, obrigatorio) in campos.items():
+        coluna = mapeamento.get(campo)
+        bruto = df_origem[coluna] if coluna else pd.Series([None] * n, index=df_origem.index, dtype=object)
+        vazio = bruto.isna() | bruto.astype(str).str.strip().eq('')
+
+        if obrigatorio:
+            rejeitar(vazio, f"{campo} obrigatório")
+
+        if tipo == 'texto':
+            saida[campo] = bruto.where(~vazio).astype(object).str.strip()
+        elif tipo == 'data':
+            datas = converter_datas(bruto)
+            rejeitar(~vazio & datas.isna(), f"{campo} com data inválida")
+            saida[campo] = datas
+        elif tipo == 'numero':
+            numeros = converter_numeros(bruto)
+            rejeitar(~vazio & numeros.isna(), f"{campo} não numérico ou ambíguo (use {FORMATOS_NUMERO})")
+            saida[campo] = numeros
+        elif tipo == 'cpf':
+            digitos = so_digitos(bruto)
+            rejeitar(~vazio & ~cpf_valido(digitos), "CPF inválido")
+            rejeitar(~vazio & digitos.duplicated(keep='first'), "CPF repetido no arquivo")
+            rejeitar(~vazio & digitos.isin(cpfs_existentes), "CPF já cadastrado")
+            saida[campo] = bruto.where(~vazio).astype(object).str.strip()
+        elif tipo == 'turma':
+            ids = bruto.astype(str).str.strip().str.lower().map(
+                dict(zip(turmas['nome_turma'].str.strip().str.lower(), turmas['id'])))
+            rejeitar(~vazio & ids.isna(), "turma não encontrada")
+            saida['turma_id'] = ids.astype('Int64')
+        elif tipo == 'aluno_cpf':
+            ids = so_digitos(bruto).map(dict(zip(so_digitos(alunos_cpf['cpf']), alunos_cpf['id'])))
+            rejeitar(~vazio & ids.isna(), "aluno não encontrado pelo CPF")
+            saida['aluno_id'] = ids.astype('Int64')
+
+    ok = motivos.eq('')
+    erros = df_origem[~ok].copy()
+    erros.insert(0, 'motivo', motivos[~ok].str.rstrip('; '))
+    erros.insert(0, 'linha', erros.index + 1)
+    return saida[ok].reset_index(drop=True), erros.reset_index(drop=True)
+
+def carregar_copy(conn, tabela, df):
+    """Carrega `df` em `tabela` com COPY numa tabela temporária e um único
+    INSERT ... SELECT, tudo na mesma transação. No SQLite (sem COPY nem
+    LIKE ... INCLUDING) as linhas vão direto para a tabela num executemany.
+    Devolve as linhas inseridas."""
+    if df.empty:
+        return 0
+
+    colunas = ', '.join(df.columns)
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+
+    try:
+        with conn.cursor() as c:
+            if dialeto(conn) == 'sqlite':
+                c.copy_expert(f"COPY {tabela} ({colunas}) FROM STDIN WITH (FORMAT csv)", buffer)
+            else:
+                c.execute(f"CREATE TEMP TABLE stage_importacao (LIKE {tabela} INCLUDING DEFAULTS) ON COMMIT DROP")
+                c.copy_expert(f"COPY stage_importacao ({colunas}) FROM STDIN WITH (FORMAT csv)", buffer)
+                c.execute(f"INSERT INTO {tabela} ({colunas}) SELECT {colunas} FROM stage_importacao")
+            inseridas = c.rowcount
+        conn.commit()
+        return inseridas
+    except Exception:
+        conn.rollback()
+        raise
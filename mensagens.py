@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+import functools
+import string
+import urllib.parse
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+# ==============================================================================
+# MODELOS DE MENSAGEM
+# ==============================================================================
+# Os textos ficam nas tabelas templates_email e templates_whatsapp, com campos
+# entre chaves ({aluno}, {valor}...). Cada texto é analisado uma única vez e
+# vira uma sequência de trechos fixos e campos; a compilação fica em cache pelo
+# próprio texto, então editar um modelo gera uma compilação nova e a antiga sai
+# do cache sozinha. Renderizar um lote é concatenar colunas do pandas: o custo
+# por destinatário não passa por um replace por campo.
+#
+# Modelo que não está no banco usa o texto padrão abaixo (o mesmo que o
+# sistema enviava antes de os modelos serem editáveis).
+
+CAMPOS_MODELO = {
+    'aluno': "Nome do aluno",
+    'responsavel': "Nome da mãe/responsável",
+    'descricao': "Descrição da cobrança",
+    'valor': "Valor (ex.: 150.00)",
+    'vencimento': "Vencimento (dd/mm/aaaa)",
+    'dias': "Dias até o vencimento",
+}
+
+# tipo_aviso -> nome_interno do modelo de e-mail. O de WhatsApp tem o mesmo
+# nome com " Zap", como no escola.db.
+MODELOS_AVISO = {
+    'cobranca': 'Nova Cobrança',
+    'lembrete': 'Aviso 5 Dias',
+    'hoje': 'Aviso Hoje',
+    'atrasado': 'Aviso Atraso',
+}
+SUFIXO_WHATSAPP = " Zap"
+
+MODELOS_EMAIL_PADRAO = {
+    'Nova Cobrança': ("Aviso de Cobrança",
+                      "Olá!\n\nNova cobrança para {aluno}, com vencimento em {vencimento}.\n\n"
+                      "Descrição: {descricao}\nValor: R$ {valor}\n\nAtenciosamente,\nSecretaria"),
+    'Aviso 5 Dias': ("Lembrete de Vencimento",
+                     "Olá!\n\nA cobrança de {aluno} vence em {dias} dias ({vencimento}).\n\n"
+                     "Descrição: {descricao}\nValor: R$ {valor}\n\nAtenciosamente,\nSecretaria"),
+    'Aviso Hoje': ("Fatura Vence Hoje!",
+                   "Olá!\n\nA cobrança de {aluno} VENCE HOJE!\n\n"
+                   "Descrição: {descricao}\nValor: R$ {valor}\n\nAtenciosamente,\nSecretaria"),
+    'Aviso Atraso': ("Fatura em Atraso",
+                     "Olá!\n\nA cobrança de {aluno} está vencida desde {vencimento}.\n\n"
+                     "Descrição: {descricao}\nValor: R$ {valor}\n\nAtenciosamente,\nSecretaria"),
+}
+
+MODELOS_WHATSAPP_PADRAO = {
+    'Nova Cobrança Zap': "Olá! Nova cobrança para {aluno}.\n\nDescrição: {descricao}\nValor: R$ {valor}\nVencimento: {vencimento}",
+    'Aviso 5 Dias Zap': "Olá! A mensalidade de {aluno} vence em {dias} dias. Valor: R$ {valor}",
+    'Aviso Hoje Zap': "🚨 Atenção! A mensalidade de {aluno} vence HOJE. Valor: R$ {valor}",
+    'Aviso Atraso Zap': "Olá! A mensalidade de {aluno} está vencida desde {vencimento}. Valor: R$ {valor}",
+}
+
+QUERY_MODELOS_EMAIL = "SELECT nome_interno, assunto, corpo FROM templates_email ORDER BY nome_interno"
+QUERY_MODELOS_WHATSAPP = "SELECT nome_interno, mensagem FROM templates_whatsapp ORDER BY nome_interno"
+
+
+class ModeloCompilado:
+    def __init__(self, texto, partes):
+        self.texto = texto
+        self.partes = partes        # ((trecho fixo, campo ou None), ...)
+        self.campos = frozenset(campo for _, campo in partes if campo)
+
+
+@functools.lru_cache(maxsize=256)
+def compilar(texto):
+    """Analisa o modelo uma vez. Levanta ValueError com chaves desbalanceadas
+    ou campo fora de CAMPOS_MODELO; {{ e }} escrevem chaves literais."""
+    partes = []
+    try:
+        analisado = list(string.Formatter().parse(texto or ''))
+    except ValueError as e:
+        raise ValueError(f"Chaves desbalanceadas no modelo ({e}).")
+    for fixo, campo, formato, conversao in analisado:
+        if campo is not None:
+            if campo not in CAMPOS_MODELO:
+                raise ValueError(f"Campo desconhecido: {{{campo}}}. Use {', '.join('{' + c + '}' for c in CAMPOS_MODELO)}.")
+            if formato or conversao:
+                raise ValueError(f"O campo {{{campo}}} não aceita formatação.")
+        partes.append((fixo, campo))
+    return ModeloCompilado(texto, tuple(partes))
+
+# ==============================================================================
+# RENDERIZAÇÃO EM LOTE
+# ==============================================================================
+
+def _texto(serie):
+    return serie.fillna('').astype(str)
+
+def _por_valor_distinto(serie, formatar):
+    # Datas e valores se repetem muito num lote (mesmo vencimento, mesma
+    # mensalidade): formata cada valor distinto uma vez e espalha pelas linhas.
+    codigos, distintos = pd.factorize(serie)
+    formatados = np.append(np.asarray(formatar(distintos), dtype=object), '')
+    return pd.Series(formatados[codigos], index=serie.index)
+
+def colunas_modelo(df, campos, hoje=None):
+    # Uma Series de texto por campo usado, calculada para o lote inteiro.
+    hoje = hoje or date.today()
+    colunas = {}
+    if 'aluno' in campos:
+        colunas['aluno'] = _texto(df['nome'])
+    if 'responsavel' in campos:
+        colunas['responsavel'] = _texto(df['mae_nome']) if 'mae_nome' in df else pd.Series('', index=df.index)
+    if 'descricao' in campos:
+        colunas['descricao'] = _texto(df['descricao'])
+    if 'valor' in campos:
+        valores = pd.to_numeric(df['valor'].astype(float), errors='coerce')
+        colunas['valor'] = _por_valor_distinto(valores, lambda v: np.char.mod('%.2f', v.to_numpy(dtype=float)))
+    if campos & {'vencimento', 'dias'}:
+        vencimentos = pd.to_datetime(df['vencimento'], errors='coerce')
+        if 'vencimento' in campos:
+            colunas['vencimento'] = _por_valor_distinto(vencimentos, lambda v: v.strftime('%d/%m/%Y'))
+        if 'dias' in campos:
+            colunas['dias'] = _por_valor_distinto(vencimentos, lambda v: (v - pd.Timestamp(hoje)).days.astype(str))
+    return colunas
+
+def renderizar_lote(modelo, df, hoje=None, codificar=None):
+    """Aplica o modelo compilado a todas as linhas de `df` (colunas nome,
+    mae_nome, descricao, valor, vencimento) e devolve uma Series de textos.
+    Com `codificar` (ex.: urllib.parse.quote), trechos fixos e valores são
+    codificados separadamente, uma vez cada, e o resultado já sai codificado."""
+    colunas = colunas_modelo(df, modelo.campos, hoje)
+    partes = modelo.partes
+    if codificar:
+        colunas = {campo: _por_valor_distinto(serie, lambda v: [codificar(x) for x in v]) for campo, serie in colunas.items()}
+        partes = [(codificar(fixo), campo) for fixo, campo in partes]
+    resultado = pd.Series('', index=df.index, dtype=object)
+    for fixo, campo in partes:
+        if fixo:
+            resultado = resultado + fixo
+        if campo:
+            resultado = resultado + colunas[campo]
+    return resultado
+
+def links_whatsapp(telefones, textos_codificados):
+    # Um link wa.me por linha, ou None para quem não tem telefone válido.
+    # Decide pelo tamanho: DDD + número (10-11 dígitos, inclusive DDD 55)
+    # ganha o 55 do país; 12-13 dígitos começando com 55 já o têm.
+    tel = _texto(telefones).str.replace(r'\D', '', regex=True).str.lstrip('0')
+    tamanho = tel.str.len()
+    tel = tel.where(~tamanho.between(10, 11), '55' + tel)
+    tel = tel.where(tamanho.between(10, 11) | (tamanho.between(12, 13) & tel.str.startswith('55')))
+    links = "https://wa.me/" + tel + "?text=" + textos_codificados
+    return links.astype(object).where(tel.notna(), None)
+
+# ==============================================================================
+# MODELOS GRAVADOS
+# ==============================================================================
+
+def modelos_email(linhas=()):
+    # linhas: (nome_interno, assunto, corpo) da tabela; completa com os padrões.
+    modelos = dict(MODELOS_EMAIL_PADRAO)
+    modelos.update({nome: (assunto or '', corpo or '') for nome, assunto, corpo in linhas})
+    return modelos
+
+def modelos_whatsapp(linhas=()):
+    modelos = dict(MODELOS_WHATSAPP_PADRAO)
+    modelos.update({nome: mensagem or '' for nome, mensagem in linhas})
+    return modelos
+
+def ler_modelos(conn):
+    # Para quem roda fora do Streamlit (robô de avisos).
+    with conn.cursor() as c:
+        c.execute(QUERY_MODELOS_EMAIL)
+        email = modelos_email(c.fetchall())
+        c.execute(QUERY_MODELOS_WHATSAPP)
+        whatsapp = modelos_whatsapp(c.fetchall())
+    conn.rollback()
+    return email, whatsapp
+
+def renderizar_emails(df, tipo_aviso, modelos, hoje=None):
+    # Devolve (assuntos, corpos) para as linhas de `df`.
+    assunto, corpo = modelos[MODELOS_AVISO[tipo_aviso]]
+    return renderizar_lote(compilar(assunto), df, hoje), renderizar_lote(compilar(corpo), df, hoje)
+
+def renderizar_whatsapp(df, tipo_aviso, modelos, hoje=None):
+    # Devolve (textos, links) para as linhas de `df` (coluna telefone_contato).
+    modelo = compilar(modelos[MODELOS_AVISO[tipo_aviso] + SUFIXO_WHATSAPP])
+    textos = renderizar_lote(modelo, df, hoje)
+    codificados = renderizar_lote(modelo, df, hoje, codificar=urllib.parse.quote)
+    return textos, links_whatsapp(df['telefone_contato'], codificados)
+
+def planilha_whatsapp(df, modelos, hoje=None):
+    """Uma linha por cobrança de `df` (com a coluna tipo_aviso), com o texto
+    pronto e o link wa.me, para enviar os avisos do dia pelo WhatsApp."""
+    partes = []
+    for tipo_aviso, grupo in df.groupby('tipo_aviso', sort=False):
+        textos, links = renderizar_whatsapp(grupo, tipo_aviso, modelos, hoje)
+        partes.append(pd.DataFrame({
+            'tipo_aviso': tipo_aviso,
+            'aluno': grupo['nome'],
+            'responsavel': grupo['mae_nome'],
+            'telefone': grupo['telefone_contato'],
+            'vencimento': grupo['vencimento'],
+            'valor': grupo['valor'],
+            'mensagem': textos,
+            'link': links,
+        }))
+    if not partes:
+        return pd.DataFrame(columns=['tipo_aviso', 'aluno', 'responsavel', 'telefone', 'vencimento', 'valor', 'mensagem', 'link'])
+    return pd.concat(partes).loc[df.index].dropna(subset=['link'])
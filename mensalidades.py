@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+import json
+from datetime import date
+
+from banco import dialeto
+
+# ==============================================================================
+# GERAÇÃO DE MENSALIDADES EM LOTE
+# ==============================================================================
+# Uma única instrução gera as cobranças do mês para todos os alunos cursando
+# (opcionalmente de uma turma) e, se pedido, enfileira os avisos por e-mail.
+# A competência fica gravada em financeiro; o índice único (aluno_id,
+# competencia) impede que o mesmo mês seja cobrado duas vezes.
+
+FILTRO_ALUNOS = """
+a.status = 'Cursando'
+AND (%(turma_id)s::int IS NULL OR a.turma_id = %(turma_id)s)
+"""
+
+QUERY_PREVIA = f"""
+SELECT a.id, a.nome, t.nome_turma, a.email_responsavel,
+       EXISTS (SELECT 1 FROM financeiro f WHERE f.aluno_id = a.id AND f.competencia = %(competencia)s) AS ja_gerada
+FROM alunos a
+LEFT JOIN turmas t ON a.turma_id = t.id
+WHERE {FILTRO_ALUNOS}
+ORDER BY t.nome_turma, a.nome
+"""
+
+# As cobranças novas saem do RETURNING e alimentam a fila na mesma instrução.
+QUERY_GERAR = f"""
+WITH novas AS (
+    INSERT INTO financeiro (aluno_id, descricao, valor, vencimento, competencia)
+    SELECT a.id, %(descricao)s, %(valor)s, %(vencimento)s, %(competencia)s
+    FROM alunos a
+    WHERE {FILTRO_ALUNOS}
+    ON CONFLICT (aluno_id, competencia) WHERE competencia IS NOT NULL DO NOTHING
+    RETURNING id, aluno_id
+), avisos AS (
+    INSERT INTO fila_envios (financeiro_id, tipo_aviso, canal, destinatario)
+    SELECT n.id, 'cobranca', 'email', a.email_responsavel
+    FROM novas n
+    JOIN alunos a ON a.id = n.aluno_id
+    WHERE %(notificar)s AND a.email_responsavel LIKE '%%@%%'
+    ON CONFLICT (financeiro_id, tipo_aviso, canal) DO NOTHING
+    RETURNING 1
+)
+SELECT (SELECT COUNT(*) FROM novas), (SELECT COUNT(*) FROM avisos)
+"""
+
+# O SQLite não aceita INSERT dentro de WITH: as duas etapas vão em sequência,
+# na mesma transação, com os ids novos passados como lista JSON.
+QUERY_GERAR_SQLITE = f"""
+INSERT INTO financeiro (aluno_id, descricao, valor, vencimento, competencia)
+SELECT a.id, %(descricao)s, %(valor)s, %(vencimento)s, %(competencia)s
+FROM alunos a
+WHERE {FILTRO_ALUNOS}
+ON CONFLICT (aluno_id, competencia) WHERE competencia IS NOT NULL DO NOTHING
+RETURNING id
+"""
+
+QUERY_AVISOS_SQLITE = """
+INSERT INTO fila_envios (financeiro_id, tipo_aviso, canal, destinatario)
+SELECT f.id, 'cobranca', 'email', a.email_responsavel
+FROM financeiro f
+JOIN alunos a ON a.id = f.aluno_id
+WHERE f.id IN (SELECT value FROM json_each(%(ids)s)) AND a.email_responsavel LIKE '%%@%%'
+ON CONFLICT (financeiro_id, tipo_aviso, canal) DO NOTHING
+"""
+
+def parametros_geracao(ano, mes, dia_vencimento, valor, descricao='', turma_id=None, notificar=False):
+    return {
+        'competencia': date(ano, mes, 1),
+        'vencimento': date(ano, mes, dia_vencimento),
+        'valor': valor,
+        'descricao': descricao or f"Mensalidade {mes:02d}/{ano}",
+        'turma_id': turma_id,
+        'notificar': notificar,
+    }
+
+def gerar_mensalidades(conn, parametros):
+    """Gera as cobranças e devolve (criadas, avisos enfileirados). Alunos que
+    já têm cobrança da competência são ignorados."""
+    try:
+        with conn.cursor() as c:
+            if dialeto(conn) == 'sqlite':
+                c.execute(QUERY_GERAR_SQLITE, parametros)
+                ids = [linha[0] for linha in c.fetchall()]
+                criadas, enfileiradas = len(ids), 0
+                if ids and parametros['notificar']:
+                    c.execute(QUERY_AVISOS_SQLITE, {'ids': json.dumps(ids)})
+                    enfileiradas = c.rowcount
+            else:
+                c.execute(QUERY_GERAR, parametros)
+                criadas, enfileiradas = c.fetchone()
+        conn.commit()
+        return criadas, enfileiradas
+    except Exception:
+        conn.rollback()
+        raise
@@ -0,0 +1,478 @@
+# -*- coding: utf-8 -*-
+"""Migrações versionadas do esquema do banco.
+
+Cada passo é aplicado uma única vez, em ordem, dentro da sua própria
+transação, e registrado em `schema_version`. Na inicialização basta ler a
+versão atual: se já estiver na última, nenhum DDL é executado.
+
+Também pode ser executado diretamente: `python migracoes.py`.
+"""
+import hashlib
+import re
+import sqlite3
+
+from psycopg2 import errors
+
+from banco import dialeto
+from notificacoes import CANAL, TABELAS_AVISADAS
+
+# ==============================================================================
+# PASSOS
+# ==============================================================================
+
+HASH_ADMIN_PADRAO = hashlib.sha256("1234".encode()).hexdigest()
+
+MAX_IDS_INVALIDOS = 20
+MSG_DATAS_INVALIDAS = "{tabela}.{coluna}: {total} valor(es) que não são data AAAA-MM-DD nem DD/MM/AAAA (ids: {ids}). Corrija e reinicie."
+
+def converter_coluna(tabela, coluna, tipo_origem, tipo_destino, expressao, invalidas=None):
+    # Só converte se a coluna ainda estiver no tipo antigo (passo idempotente).
+    # Com `invalidas` (condição SQL), aborta listando os ids das linhas que
+    # a conversão perderia, em vez de gravar NULL nelas.
+    verificacao = ''
+    if invalidas:
+        mensagem = MSG_DATAS_INVALIDAS.format(tabela=tabela, coluna=coluna, total='%', ids='%')
+        verificacao = f'''
+            SELECT COUNT(*), string_agg(id::text, ', ' ORDER BY id) FILTER (WHERE ordem <= {MAX_IDS_INVALIDOS})
+            INTO total, ids
+            FROM (SELECT id, row_number() OVER (ORDER BY id) AS ordem FROM {tabela} WHERE {invalidas}) AS invalidas;
+            IF total > 0 THEN
+                RAISE EXCEPTION '{mensagem}', total, ids;
+            END IF;'''
+    return f'''
+    DO $$
+    DECLARE
+        total BIGINT;
+        ids TEXT;
+    BEGIN
+        IF (SELECT data_type FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = '{tabela}' AND column_name = '{coluna}') = '{tipo_origem}' THEN{verificacao}
+            ALTER TABLE {tabela} ALTER COLUMN {coluna} TYPE {tipo_destino} USING {expressao};
+        END IF;
+    END $$;
+    '''
+
+def _data_texto(coluna):
+    # AAAA-MM-DD (com ou sem hora depois) ou DD/MM/AAAA, como texto ISO.
+    return (rf"CASE WHEN {coluna} ~ '^\d{{4}}-(0[1-9]|1[0-2])-(0[1-9]|[12]\d|3[01])' THEN LEFT({coluna}, 10) "
+            rf"WHEN btrim({coluna}) ~ '^(0[1-9]|[12]\d|3[01])/(0[1-9]|1[0-2])/\d{{4}}$' "
+            rf"THEN regexp_replace(btrim({coluna}), '^(\d{{2}})/(\d{{2}})/(\d{{4}})$', '\3-\2-\1') END")
+
+def data_iso(coluna):
+    return f"({_data_texto(coluna)})::date"
+
+def data_invalida(coluna):
+    # Preenchida, mas fora dos dois formatos ou com dia além do fim do mês (31/02).
+    texto = _data_texto(coluna)
+    return (f"NULLIF(btrim({coluna}), '') IS NOT NULL AND ({texto} IS NULL OR RIGHT({texto}, 2)::int > "
+            f"EXTRACT(DAY FROM date_trunc('month', (LEFT({texto}, 7) || '-01')::date) + interval '1 month - 1 day'))")
+
+def converter_data(tabela, coluna):
+    return converter_coluna(tabela, coluna, 'text', 'DATE', data_iso(coluna), data_invalida(coluna))
+
+CRIAR_CODIGOS_RECUPERACAO = '''CREATE TABLE IF NOT EXISTS codigos_recuperacao (email TEXT PRIMARY KEY, codigo TEXT, criado_em TIMESTAMP NOT NULL DEFAULT NOW())'''
+
+# Índices com a mesma sintaxe no PostgreSQL e no SQLite.
+INDICES_CONSULTAS = [
+    "CREATE INDEX IF NOT EXISTS idx_financeiro_status_vencimento ON financeiro (status, vencimento)",
+    "CREATE INDEX IF NOT EXISTS idx_financeiro_aluno ON financeiro (aluno_id)",
+    "CREATE INDEX IF NOT EXISTS idx_alunos_status_nome ON alunos (status, nome)",
+    "CREATE INDEX IF NOT EXISTS idx_alunos_turma ON alunos (turma_id)",
+    "CREATE INDEX IF NOT EXISTS idx_fila_envios_status ON fila_envios (status, proxima_tentativa)",
+    "ANALYZE financeiro",
+    "ANALYZE alunos",
+]
+
+INDICES_KEYSET = [
+    "CREATE INDEX IF NOT EXISTS idx_alunos_status_nome_id ON alunos (status, nome, id)",
+    "DROP INDEX IF EXISTS idx_alunos_status_nome",
+    "CREATE INDEX IF NOT EXISTS idx_professores_nome_id ON professores (nome, id)",
+    "CREATE INDEX IF NOT EXISTS idx_turmas_nome_id ON turmas (nome_turma, id)",
+    "CREATE INDEX IF NOT EXISTS idx_financeiro_pendente_venc_id ON financeiro (vencimento, id) WHERE status = 'Pendente'",
+]
+
+MIGRACOES = [
+    (1, "Tabelas base", [
+        '''CREATE TABLE IF NOT EXISTS professores (id SERIAL PRIMARY KEY, nome TEXT, telefone TEXT, cargo TEXT DEFAULT 'Professor', cpf TEXT, rg TEXT, data_admissao TEXT, salario_base REAL, carga_horaria TEXT, endereco TEXT, status_rh TEXT DEFAULT 'Ativo')''',
+        '''CREATE TABLE IF NOT EXISTS turmas (id SERIAL PRIMARY KEY, nome_turma TEXT UNIQUE, professor_id INTEGER, ativa INTEGER DEFAULT 1, FOREIGN KEY(professor_id) REFERENCES professores(id))''',
+        '''CREATE TABLE IF NOT EXISTS alunos (id SERIAL PRIMARY KEY, nome TEXT, data_nascimento TEXT, naturalidade TEXT, cpf TEXT, rg TEXT, pai_nome TEXT, mae_nome TEXT, turma_id INTEGER, status TEXT DEFAULT 'Cursando', endereco TEXT, bairro TEXT, cep TEXT, cidade TEXT, telefone_contato TEXT, email_responsavel TEXT, saude_alergias TEXT, saude_problemas TEXT, saude_plano TEXT, seguranca_autorizados TEXT, seguranca_transporte TEXT, FOREIGN KEY(turma_id) REFERENCES turmas(id))''',
+        '''CREATE TABLE IF NOT EXISTS config_sistema (chave TEXT PRIMARY KEY, valor TEXT)''',
+        '''CREATE TABLE IF NOT EXISTS financeiro (id SERIAL PRIMARY KEY, aluno_id INTEGER, descricao TEXT, valor REAL, vencimento TEXT, status TEXT DEFAULT 'Pendente', FOREIGN KEY(aluno_id) REFERENCES alunos(id))''',
+        '''CREATE TABLE IF NOT EXISTS usuarios (id SERIAL PRIMARY KEY, username TEXT UNIQUE, password TEXT, setor TEXT, email TEXT)''',
+        '''CREATE TABLE IF NOT EXISTS templates_email (id SERIAL PRIMARY KEY, nome_interno TEXT UNIQUE, assunto TEXT, corpo TEXT)''',
+        '''CREATE TABLE IF NOT EXISTS templates_whatsapp (id SERIAL PRIMARY KEY, nome_interno TEXT UNIQUE, mensagem TEXT)''',
+        '''CREATE TABLE IF NOT EXISTS log_envios (id SERIAL PRIMARY KEY, financeiro_id INTEGER, tipo_aviso TEXT, data_envio TEXT, canal TEXT, FOREIGN KEY(financeiro_id) REFERENCES financeiro(id))''',
+        '''CREATE TABLE IF NOT EXISTS fila_envios (id SERIAL PRIMARY KEY, financeiro_id INTEGER NOT NULL, tipo_aviso TEXT NOT NULL, canal TEXT NOT NULL DEFAULT 'email', destinatario TEXT, status TEXT NOT NULL DEFAULT 'pendente', tentativas INTEGER NOT NULL DEFAULT 0, proxima_tentativa TIMESTAMP NOT NULL DEFAULT NOW(), ultimo_erro TEXT, criado_em TIMESTAMP NOT NULL DEFAULT NOW(), atualizado_em TIMESTAMP NOT NULL DEFAULT NOW(), enviado_em TIMESTAMP, UNIQUE (financeiro_id, tipo_aviso, canal), FOREIGN KEY(financeiro_id) REFERENCES financeiro(id))''',
+        f'''INSERT INTO usuarios (username, password, setor, email)
+            SELECT 'admin', '{HASH_ADMIN_PADRAO}', 'Administrador', 'admin@escola.com'
+            WHERE NOT EXISTS (SELECT 1 FROM usuarios WHERE username = 'admin')''',
+    ]),
+    (2, "Colunas de data como DATE e valores como NUMERIC", [
+        converter_data('financeiro', 'vencimento'),
+        converter_data('alunos', 'data_nascimento'),
+        converter_data('professores', 'data_admissao'),
+        converter_coluna('financeiro', 'valor', 'real', 'NUMERIC(12,2)', 'valor::numeric(12,2)'),
+        converter_coluna('professores', 'salario_base', 'real', 'NUMERIC(12,2)', 'salario_base::numeric(12,2)'),
+    ]),
+    (3, "Índices das consultas principais", INDICES_CONSULTAS),
+    (4, "Índices para paginação por chave (keyset)", INDICES_KEYSET),
+    (5, "Busca por trigramas sem acentos (nome e CPF)", [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE EXTENSION IF NOT EXISTS unaccent",
+        # unaccent() não é IMMUTABLE; o invólucro permite usá-la em colunas geradas e índices.
+        """CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text AS
+           $$ SELECT public.unaccent('public.unaccent', $1) $$
+           LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT""",
+        "ALTER TABLE alunos ADD COLUMN IF NOT EXISTS nome_busca TEXT GENERATED ALWAYS AS (lower(f_unaccent(coalesce(nome, '')))) STORED",
+        r"ALTER TABLE alunos ADD COLUMN IF NOT EXISTS cpf_digitos TEXT GENERATED ALWAYS AS (regexp_replace(coalesce(cpf, ''), '\D', '', 'g')) STORED",
+        "ALTER TABLE professores ADD COLUMN IF NOT EXISTS nome_busca TEXT GENERATED ALWAYS AS (lower(f_unaccent(coalesce(nome, '')))) STORED",
+        r"ALTER TABLE professores ADD COLUMN IF NOT EXISTS cpf_digitos TEXT GENERATED ALWAYS AS (regexp_replace(coalesce(cpf, ''), '\D', '', 'g')) STORED",
+        "CREATE INDEX IF NOT EXISTS idx_alunos_nome_trgm ON alunos USING gin (nome_busca gin_trgm_ops)",
+        "CREATE INDEX IF NOT EXISTS idx_alunos_cpf_trgm ON alunos USING gin (cpf_digitos gin_trgm_ops)",
+        "CREATE INDEX IF NOT EXISTS idx_professores_nome_trgm ON professores USING gin (nome_busca gin_trgm_ops)",
+        "CREATE INDEX IF NOT EXISTS idx_professores_cpf_trgm ON professores USING gin (cpf_digitos gin_trgm_ops)",
+    ]),
+    (6, "Resumos do dashboard mantidos por gatilhos", [
+        "CREATE TABLE IF NOT EXISTS resumo_financeiro_mensal (mes DATE NOT NULL, status TEXT NOT NULL, quantidade BIGINT NOT NULL DEFAULT 0, valor_total NUMERIC(14,2) NOT NULL DEFAULT 0, PRIMARY KEY (mes, status))",
+        "CREATE TABLE IF NOT EXISTS resumo_contadores (tabela TEXT NOT NULL, grupo TEXT NOT NULL, quantidade BIGINT NOT NULL DEFAULT 0, PRIMARY KEY (tabela, grupo))",
+        # Gatilhos por comando (transition tables): um INSERT/UPDATE em lote
+        # gera uma única atualização agregada por mês/status, não uma por linha.
+        """CREATE OR REPLACE FUNCTION fn_resumo_financeiro() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                INSERT INTO resumo_financeiro_mensal AS r (mes, status, quantidade, valor_total)
+                SELECT date_trunc('month', vencimento)::date, COALESCE(status, ''), -COUNT(*), -COALESCE(SUM(valor), 0)
+                FROM antigos WHERE vencimento IS NOT NULL GROUP BY 1, 2
+                ON CONFLICT (mes, status) DO UPDATE
+                SET quantidade = r.quantidade + EXCLUDED.quantidade, valor_total = r.valor_total + EXCLUDED.valor_total;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                INSERT INTO resumo_financeiro_mensal AS r (mes, status, quantidade, valor_total)
+                SELECT date_trunc('month', vencimento)::date, COALESCE(status, ''), COUNT(*), COALESCE(SUM(valor), 0)
+                FROM novos WHERE vencimento IS NOT NULL GROUP BY 1, 2
+                ON CONFLICT (mes, status) DO UPDATE
+                SET quantidade = r.quantidade + EXCLUDED.quantidade, valor_total = r.valor_total + EXCLUDED.valor_total;
+            END IF;
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql""",
+        # TG_ARGV[0]: coluna que define o grupo contado (status, ativa, status_rh).
+        """CREATE OR REPLACE FUNCTION fn_resumo_contadores() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                INSERT INTO resumo_contadores AS r (tabela, grupo, quantidade)
+                SELECT TG_TABLE_NAME, COALESCE(to_jsonb(t) ->> TG_ARGV[0], ''), -COUNT(*)
+                FROM antigos t GROUP BY 2
+                ON CONFLICT (tabela, grupo) DO UPDATE SET quantidade = r.quantidade + EXCLUDED.quantidade;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                INSERT INTO resumo_contadores AS r (tabela, grupo, quantidade)
+                SELECT TG_TABLE_NAME, COALESCE(to_jsonb(t) ->> TG_ARGV[0], ''), COUNT(*)
+                FROM novos t GROUP BY 2
+                ON CONFLICT (tabela, grupo) DO UPDATE SET quantidade = r.quantidade + EXCLUDED.quantidade;
+            END IF;
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql""",
+    ] + [
+        # Um gatilho por evento: transition tables não aceitam gatilhos com vários eventos.
+        f"""DROP TRIGGER IF EXISTS trg_resumo_{tabela}_{evento.lower()} ON {tabela};
+        CREATE TRIGGER trg_resumo_{tabela}_{evento.lower()} AFTER {evento} ON {tabela}
+        REFERENCING {referencias} FOR EACH STATEMENT EXECUTE FUNCTION {funcao}"""
+        for tabela, funcao in [
+            ('financeiro', 'fn_resumo_financeiro()'),
+            ('alunos', "fn_resumo_contadores('status')"),
+            ('turmas', "fn_resumo_contadores('ativa')"),
+            ('professores', "fn_resumo_contadores('status_rh')"),
+        ]
+        for evento, referencias in [
+            ('INSERT', 'NEW TABLE AS novos'),
+            ('UPDATE', 'OLD TABLE AS antigos NEW TABLE AS novos'),
+            ('DELETE', 'OLD TABLE AS antigos'),
+        ]
+    ] + [
+        # Carga inicial a partir dos dados existentes.
+        "TRUNCATE resumo_financeiro_mensal, resumo_contadores",
+        """INSERT INTO resumo_financeiro_mensal (mes, status, quantidade, valor_total)
+           SELECT date_trunc('month', vencimento)::date, COALESCE(status, ''), COUNT(*), COALESCE(SUM(valor), 0)
+           FROM financeiro WHERE vencimento IS NOT NULL GROUP BY 1, 2""",
+        """INSERT INTO resumo_contadores (tabela, grupo, quantidade)
+           SELECT 'alunos', COALESCE(status, ''), COUNT(*) FROM alunos GROUP BY 2
+           UNION ALL SELECT 'turmas', COALESCE(ativa::text, ''), COUNT(*) FROM turmas GROUP BY 2
+           UNION ALL SELECT 'professores', COALESCE(status_rh, ''), COUNT(*) FROM professores GROUP BY 2""",
+    ]),
+    (7, "Competência das mensalidades geradas em lote", [
+        "ALTER TABLE financeiro ADD COLUMN IF NOT EXISTS competencia DATE",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_financeiro_aluno_competencia ON financeiro (aluno_id, competencia) WHERE competencia IS NOT NULL",
+    ]),
+    (8, "Histórico escolar", [
+        # Mesmas colunas do escola.db, mais o percentual de frequência calculado no fechamento.
+        '''CREATE TABLE IF NOT EXISTS historico_escolar (id SERIAL PRIMARY KEY, aluno_id INTEGER NOT NULL, ano_letivo INTEGER NOT NULL, turma_nome TEXT, dias_letivos INTEGER, frequencia_aluno INTEGER, percentual_frequencia NUMERIC(5,2), media_portugues NUMERIC(4,2), media_matematica NUMERIC(4,2), media_geral NUMERIC(4,2), resultado_final TEXT, obs TEXT, nota_historia NUMERIC(4,2), nota_geografia NUMERIC(4,2), nota_ciencias NUMERIC(4,2), nota_ingles NUMERIC(4,2), nota_artes NUMERIC(4,2), nota_ed_fisica NUMERIC(4,2), nota_religiao NUMERIC(4,2), UNIQUE (aluno_id, ano_letivo), FOREIGN KEY(aluno_id) REFERENCES alunos(id))''',
+    ]),
+    (9, "Códigos de recuperação de senha", [
+        # Mesma tabela do escola.db, mais o contador de tentativas.
+        CRIAR_CODIGOS_RECUPERACAO,
+        "ALTER TABLE codigos_recuperacao ADD COLUMN IF NOT EXISTS tentativas INTEGER NOT NULL DEFAULT 0",
+    ]),
+    (10, "Avisos de escrita para o cache (LISTEN/NOTIFY)", [
+        # Um aviso por comando, com o nome da tabela; o ouvinte do app
+        # (notificacoes.py) invalida o cache dessa tabela.
+        f"""CREATE OR REPLACE FUNCTION fn_avisar_escrita() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('{CANAL}', TG_TABLE_NAME);
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql""",
+    ] + [
+        f"""DROP TRIGGER IF EXISTS trg_aviso_{tabela} ON {tabela};
+        CREATE TRIGGER trg_aviso_{tabela} AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {tabela}
+        FOR EACH STATEMENT EXECUTE FUNCTION fn_avisar_escrita()"""
+        for tabela in TABELAS_AVISADAS
+    ]),
+]
+
+# ==============================================================================
+# PASSOS NO SQLITE (INSTALAÇÃO NUM SÓ COMPUTADOR)
+# ==============================================================================
+# Mesmas versões e mesmo resultado das migrações acima, com o que o SQLite
+# oferece: sem ALTER COLUMN TYPE (a tabela é recriada), gatilhos por linha
+# em vez de por comando e sem índices de trigramas (a busca varre a tabela,
+# o que é rápido no tamanho de uma escola). Um passo pode ser uma função
+# que recebe o cursor.
+
+def tabela_sqlite(ddl):
+    return ddl.replace("SERIAL PRIMARY KEY", "INTEGER PRIMARY KEY AUTOINCREMENT").replace(
+        "DEFAULT NOW()", "DEFAULT (datetime('now', 'localtime'))")
+
+def data_iso_sqlite(coluna):
+    return (f"CASE WHEN {coluna} GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]*' THEN substr({coluna}, 1, 10) "
+            f"WHEN trim({coluna}) GLOB '[0-9][0-9]/[0-9][0-9]/[0-9][0-9][0-9][0-9]' "
+            f"THEN substr(trim({coluna}), 7, 4) || '-' || substr(trim({coluna}), 4, 2) || '-' || substr(trim({coluna}), 1, 2) END")
+
+def verificar_datas_sqlite(tabela, coluna):
+    # Mesmo papel de data_invalida: date(..., '+0 days') devolve NULL ou
+    # normaliza (31/02 vira 02/03) quando a data não existe.
+    def passo(c):
+        texto = data_iso_sqlite(coluna)
+        c.execute(f"""SELECT id FROM {tabela} WHERE trim(coalesce({coluna}, '')) <> ''
+                      AND ({texto} IS NULL OR date({texto}, '+0 days') IS NOT {texto}) ORDER BY id""")
+        ids = [linha[0] for linha in c.fetchall()]
+        if ids:
+            raise sqlite3.DataError(MSG_DATAS_INVALIDAS.format(tabela=tabela, coluna=coluna, total=len(ids),
+                                                               ids=', '.join(map(str, ids[:MAX_IDS_INVALIDOS]))))
+    return passo
+
+def recriar_tabela_sqlite(tabela, conversoes):
+    """Troca o tipo das colunas em `conversoes` ({coluna: (tipo, expressão)})
+    recriando a tabela, como manda a documentação do SQLite. Não faz nada
+    se as colunas já estiverem no tipo novo."""
+    def passo(c):
+        c.execute(f"PRAGMA table_info({tabela})")
+        colunas = {linha[1]: linha[2] for linha in c.fetchall()}
+        if all(colunas.get(coluna, tipo).upper() == tipo for coluna, (tipo, _) in conversoes.items()):
+            return
+        c.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = %s", (tabela,))
+        ddl = c.fetchone()[0]
+        for coluna, (tipo, _) in conversoes.items():
+            ddl = re.sub(rf'(\b{coluna}\s+)\w+', rf'\g<1>{tipo}', ddl, count=1)
+        ddl = re.sub(rf'^CREATE TABLE\s+"?{tabela}"?', f'CREATE TABLE {tabela}_nova', ddl)
+        expressoes = [conversoes[col][1] if col in conversoes else col for col in colunas]
+        c.execute(ddl)
+        c.execute(f"INSERT INTO {tabela}_nova ({', '.join(colunas)}) SELECT {', '.join(expressoes)} FROM {tabela}")
+        c.execute(f"DROP TABLE {tabela}")
+        c.execute(f"ALTER TABLE {tabela}_nova RENAME TO {tabela}")
+    return passo
+
+def gatilhos_resumo_sqlite(tabela, coluna):
+    # resumo_contadores por linha: -1 no grupo antigo, +1 no novo.
+    grupo = lambda linha: f"COALESCE(CAST({linha}.{coluna} AS TEXT), '')"
+    soma = lambda linha, delta: (f"INSERT INTO resumo_contadores (tabela, grupo, quantidade) VALUES ('{tabela}', {grupo(linha)}, {delta}) "
+                                 f"ON CONFLICT (tabela, grupo) DO UPDATE SET quantidade = quantidade + excluded.quantidade;")
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS trg_resumo_{tabela}_insert AFTER INSERT ON {tabela} BEGIN {soma('NEW', 1)} END",
+        f"CREATE TRIGGER IF NOT EXISTS trg_resumo_{tabela}_update AFTER UPDATE OF {coluna} ON {tabela} BEGIN {soma('OLD', -1)} {soma('NEW', 1)} END",
+        f"CREATE TRIGGER IF NOT EXISTS trg_resumo_{tabela}_delete AFTER DELETE ON {tabela} BEGIN {soma('OLD', -1)} END",
+    ]
+
+def _soma_financeiro(linha, sinal):
+    return (f"INSERT INTO resumo_financeiro_mensal (mes, status, quantidade, valor_total) "
+            f"SELECT date({linha}.vencimento, 'start of month'), COALESCE({linha}.status, ''), {sinal}1, {sinal}COALESCE({linha}.valor, 0) "
+            f"WHERE {linha}.vencimento IS NOT NULL "
+            f"ON CONFLICT (mes, status) DO UPDATE SET quantidade = quantidade + excluded.quantidade, valor_total = valor_total + excluded.valor_total;")
+
+def gatilhos_aviso_sqlite(tabela):
+    # Sem NOTIFY: cada escrita incrementa a versão da tabela, relida pelo ouvinte.
+    soma = f"UPDATE versoes_tabelas SET versao = versao + 1 WHERE tabela = '{tabela}';"
+    return [f"CREATE TRIGGER IF NOT EXISTS trg_aviso_{tabela}_{evento.lower()} AFTER {evento} ON {tabela} BEGIN {soma} END"
+            for evento in ('INSERT', 'UPDATE', 'DELETE')]
+
+COLUNAS_HISTORICO_LEGADO = ('aluno_id, ano_letivo, turma_nome, dias_letivos, frequencia_aluno, media_portugues, media_matematica, '
+                            'media_geral, resultado_final, obs, nota_historia, nota_geografia, nota_ciencias, nota_ingles, '
+                            'nota_artes, nota_ed_fisica, nota_religiao')
+
+MIGRACOES_SQLITE = [
+    (1, "Tabelas base", [tabela_sqlite(cmd) for cmd in MIGRACOES[0][2]]),
+    (2, "Colunas de data como DATE e valores como NUMERIC", [
+        verificar_datas_sqlite('financeiro', 'vencimento'),
+        verificar_datas_sqlite('alunos', 'data_nascimento'),
+        verificar_datas_sqlite('professores', 'data_admissao'),
+        recriar_tabela_sqlite('financeiro', {'vencimento': ('DATE', data_iso_sqlite('vencimento')), 'valor': ('REAL', 'round(valor, 2)')}),
+        recriar_tabela_sqlite('alunos', {'data_nascimento': ('DATE', data_iso_sqlite('data_nascimento'))}),
+        recriar_tabela_sqlite('professores', {'data_admissao': ('DATE', data_iso_sqlite('data_admissao')),
+                                              'salario_base': ('REAL', 'round(salario_base, 2)')}),
+    ]),
+    (3, "Índices das consultas principais", INDICES_CONSULTAS),
+    (4, "Índices para paginação por chave (keyset)", INDICES_KEYSET),
+    (5, "Busca sem acentos (nome e CPF)", [
+        # f_unaccent é registrada em cada conexão (banco_sqlite.FUNCOES).
+        f"ALTER TABLE {tabela} ADD COLUMN nome_busca TEXT GENERATED ALWAYS AS (lower(f_unaccent(coalesce(nome, '')))) VIRTUAL"
+        for tabela in ('alunos', 'professores')
+    ] + [
+        f"ALTER TABLE {tabela} ADD COLUMN cpf_digitos TEXT GENERATED ALWAYS AS "
+        f"(replace(replace(replace(replace(coalesce(cpf, ''), '.', ''), '-', ''), '/', ''), ' ', '')) VIRTUAL"
+        for tabela in ('alunos', 'professores')
+    ]),
+    (6, "Resumos do dashboard mantidos por gatilhos", [
+        "CREATE TABLE IF NOT EXISTS resumo_financeiro_mensal (mes DATE NOT NULL, status TEXT NOT NULL, quantidade INTEGER NOT NULL DEFAULT 0, valor_total REAL NOT NULL DEFAULT 0, PRIMARY KEY (mes, status))",
+        "CREATE TABLE IF NOT EXISTS resumo_contadores (tabela TEXT NOT NULL, grupo TEXT NOT NULL, quantidade INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (tabela, grupo))",
+        f"CREATE TRIGGER IF NOT EXISTS trg_resumo_financeiro_insert AFTER INSERT ON financeiro BEGIN {_soma_financeiro('NEW', '')} END",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_resumo_financeiro_update AFTER UPDATE OF vencimento, status, valor ON financeiro
+            BEGIN {_soma_financeiro('OLD', '-')} {_soma_financeiro('NEW', '')} END""",
+        f"CREATE TRIGGER IF NOT EXISTS trg_resumo_financeiro_delete AFTER DELETE ON financeiro BEGIN {_soma_financeiro('OLD', '-')} END",
+    ] + gatilhos_resumo_sqlite('alunos', 'status') + gatilhos_resumo_sqlite('turmas', 'ativa') + gatilhos_resumo_sqlite('professores', 'status_rh') + [
+        "DELETE FROM resumo_financeiro_mensal",
+        "DELETE FROM resumo_contadores",
+        """INSERT INTO resumo_financeiro_mensal (mes, status, quantidade, valor_total)
+           SELECT date(vencimento, 'start of month'), COALESCE(status, ''), COUNT(*), COALESCE(SUM(valor), 0)
+           FROM financeiro WHERE vencimento IS NOT NULL GROUP BY 1, 2""",
+        """INSERT INTO resumo_contadores (tabela, grupo, quantidade)
+           SELECT 'alunos', COALESCE(status, ''), COUNT(*) FROM alunos GROUP BY 2
+           UNION ALL SELECT 'turmas', COALESCE(CAST(ativa AS TEXT), ''), COUNT(*) FROM turmas GROUP BY 2
+           UNION ALL SELECT 'professores', COALESCE(status_rh, ''), COUNT(*) FROM professores GROUP BY 2""",
+    ]),
+    (7, "Competência das mensalidades geradas em lote", [
+        "ALTER TABLE financeiro ADD COLUMN competencia DATE",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_financeiro_aluno_competencia ON financeiro (aluno_id, competencia) WHERE competencia IS NOT NULL",
+    ]),
+    (8, "Histórico escolar", [
+        # O escola.db já tem a tabela, sem o percentual e sem a chave (aluno, ano): recria.
+        f"CREATE TABLE IF NOT EXISTS historico_escolar (id INTEGER PRIMARY KEY AUTOINCREMENT, {COLUNAS_HISTORICO_LEGADO})",
+        '''CREATE TABLE historico_escolar_nova (id INTEGER PRIMARY KEY AUTOINCREMENT, aluno_id INTEGER NOT NULL, ano_letivo INTEGER NOT NULL, turma_nome TEXT, dias_letivos INTEGER, frequencia_aluno INTEGER, percentual_frequencia REAL, media_portugues REAL, media_matematica REAL, media_geral REAL, resultado_final TEXT, obs TEXT, nota_historia REAL, nota_geografia REAL, nota_ciencias REAL, nota_ingles REAL, nota_artes REAL, nota_ed_fisica REAL, nota_religiao REAL, UNIQUE (aluno_id, ano_letivo), FOREIGN KEY(aluno_id) REFERENCES alunos(id))''',
+        f"""INSERT OR IGNORE INTO historico_escolar_nova ({COLUNAS_HISTORICO_LEGADO})
+            SELECT {COLUNAS_HISTORICO_LEGADO} FROM historico_escolar WHERE aluno_id IS NOT NULL AND ano_letivo IS NOT NULL""",
+        "DROP TABLE historico_escolar",
+        "ALTER TABLE historico_escolar_nova RENAME TO historico_escolar",
+    ]),
+    (9, "Códigos de recuperação de senha", [
+        tabela_sqlite(CRIAR_CODIGOS_RECUPERACAO),
+        recriar_tabela_sqlite('codigos_recuperacao', {'criado_em': ('TIMESTAMP', 'criado_em')}),
+        "ALTER TABLE codigos_recuperacao ADD COLUMN tentativas INTEGER NOT NULL DEFAULT 0",
+    ]),
+    (10, "Avisos de escrita para o cache (versões por tabela)", [
+        "CREATE TABLE IF NOT EXISTS versoes_tabelas (tabela TEXT PRIMARY KEY, versao INTEGER NOT NULL DEFAULT 0)",
+        "INSERT OR IGNORE INTO versoes_tabelas (tabela) VALUES " + ", ".join(f"('{tabela}')" for tabela in TABELAS_AVISADAS),
+    ] + [cmd for tabela in TABELAS_AVISADAS for cmd in gatilhos_aviso_sqlite(tabela)]),
+]
+
+assert [m[0] for m in MIGRACOES_SQLITE] == [m[0] for m in MIGRACOES]
+
+VERSAO_ATUAL = MIGRACOES[-1][0]
+
+# Chave fixa do advisory lock: só um processo migra por vez.
+LOCK_MIGRACOES = 7310451
+
+# ==============================================================================
+# EXECUÇÃO
+# ==============================================================================
+
+def versao_do_banco(conn):
+    try:
+        with conn.cursor() as c:
+            c.execute("SELECT MAX(versao) FROM schema_version")
+            versao = c.fetchone()[0] or 0
+    except (errors.UndefinedTable, sqlite3.OperationalError):
+        conn.rollback()
+        return 0
+    conn.commit()
+    return versao
+
+def _chaves_estrangeiras_sqlite(conn, ligadas):
+    # O PRAGMA não tem efeito dentro de uma transação.
+    conn.set_session(autocommit=True)
+    with conn.cursor() as c:
+        c.execute(f"PRAGMA foreign_keys = {'ON' if ligadas else 'OFF'}")
+    conn.set_session(autocommit=False)
+
+def _aplicar_sqlite(conn):
+    # Um só processo escreve por vez no arquivo: BEGIN IMMEDIATE faz o papel do advisory lock.
+    # Recriar uma tabela referenciada exige as chaves estrangeiras desligadas; a
+    # integridade é conferida com foreign_key_check antes de cada commit.
+    aplicadas = []
+    _chaves_estrangeiras_sqlite(conn, False)
+    try:
+        with conn.cursor() as c:
+            c.execute("CREATE TABLE IF NOT EXISTS schema_version (versao INTEGER PRIMARY KEY, descricao TEXT, aplicada_em TIMESTAMP NOT NULL DEFAULT (datetime('now', 'localtime')))")
+            conn.commit()
+
+            for versao, descricao, comandos in MIGRACOES_SQLITE:
+                try:
+                    conn.iniciar_escrita()
+                    c.execute("SELECT 1 FROM schema_version WHERE versao = %s", (versao,))
+                    if c.fetchone():
+                        conn.commit()
+                        continue
+
+                    for cmd in comandos:
+                        cmd(c) if callable(cmd) else c.execute(cmd)
+                    c.execute("PRAGMA foreign_key_check")
+                    if c.fetchone():
+                        raise sqlite3.IntegrityError(f"Migração {versao} deixou chaves estrangeiras inválidas.")
+                    c.execute("INSERT INTO schema_version (versao, descricao) VALUES (%s, %s)", (versao, descricao))
+                    conn.commit()
+                    aplicadas.append(versao)
+                except Exception:
+                    conn.rollback()
+                    raise
+    finally:
+        _chaves_estrangeiras_sqlite(conn, True)
+
+    return aplicadas
+
+def aplicar_migracoes(conn):
+    if versao_do_banco(conn) >= VERSAO_ATUAL:
+        return []
+    if dialeto(conn) == 'sqlite':
+        return _aplicar_sqlite(conn)
+
+    aplicadas = []
+    with conn.cursor() as c:
+        c.execute("CREATE TABLE IF NOT EXISTS schema_version (versao INTEGER PRIMARY KEY, descricao TEXT, aplicada_em TIMESTAMP NOT NULL DEFAULT NOW())")
+        conn.commit()
+
+        for versao, descricao, comandos in MIGRACOES:
+            try:
+                c.execute("SELECT pg_advisory_xact_lock(%s)", (LOCK_MIGRACOES,))
+                # Conversões e índices em tabelas grandes não respeitam o timeout do pool.
+                c.execute("SET LOCAL statement_timeout = 0")
+                c.execute("SELECT 1 FROM schema_version WHERE versao = %s", (versao,))
+                if c.fetchone():
+                    conn.commit()
+                    continue
+
+                for cmd in comandos:
+                    c.execute(cmd)
+                c.execute("INSERT INTO schema_version (versao, descricao) VALUES (%s, %s)", (versao, descricao))
+                conn.commit()
+                aplicadas.append(versao)
+            except Exception:
+                conn.rollback()
+                raise
+
+    return aplicadas
+
+if __name__ == "__main__":
+    from avisos import conectar_banco
+
+    conn = conectar_banco()
+    try:
+        aplicadas = aplicar_migracoes(conn)
+        print(f"Migrações aplicadas: {aplicadas}" if aplicadas else f"Banco já está na versão {VERSAO_ATUAL}.")
+    finally:
+        conn.close()
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+import select
+import threading
+import time
+
+import psycopg2
+from psycopg2 import extensions
+
+from banco import dialeto
+from banco_sqlite import conectar_sqlite
+
+# ==============================================================================
+# INVALIDAÇÃO DO CACHE POR AVISO DO BANCO
+# ==============================================================================
+# Gatilhos por comando nas tabelas abaixo (migração 10) fazem
+# pg_notify(CANAL, tabela) em toda escrita, venha ela de onde vier: outra
+# réplica do app, o robô de avisos, o psql. O aviso só é entregue no COMMIT
+# e o PostgreSQL junta avisos iguais da mesma transação, então uma carga de
+# mil linhas gera um aviso por tabela.
+#
+# Uma thread por processo escuta o canal numa conexão própria (fora do pool)
+# e invalida só as entradas do CacheTabelas marcadas com a tabela. Enquanto
+# ela está conectada o cache pode usar TTLs longos; se a conexão cai, o
+# cache é esvaziado (avisos podem ter se perdido) e volta aos TTLs curtos
+# até a reconexão, que esvazia de novo.
+#
+# No SQLite não há LISTEN: gatilhos por linha incrementam versoes_tabelas e
+# a thread relê essa tabela quando PRAGMA data_version indica que outra
+# conexão gravou no arquivo.
+
+CANAL = 'tabelas_alteradas'
+TABELAS_AVISADAS = ('alunos', 'turmas', 'professores', 'financeiro', 'config_sistema', 'usuarios',
+                    'templates_email', 'templates_whatsapp', 'log_envios', 'fila_envios', 'historico_escolar',
+                    'resumo_financeiro_mensal', 'resumo_contadores')
+SEM_AVISO_TESTAR = 30.0      # s sem aviso antes de testar a conexão com SELECT 1
+ESPERA_SELECT = 1.0          # s por espera no socket (para parar() não demorar)
+INTERVALO_SQLITE = 2.0       # s entre leituras do PRAGMA data_version
+ESPERA_RECONEXAO = 5.0
+
+
+class OuvinteTabelas:
+    def __init__(self, pool, cache, intervalo_sqlite=INTERVALO_SQLITE, espera_reconexao=ESPERA_RECONEXAO):
+        self.pool = pool
+        self.cache = cache
+        self.intervalo_sqlite = intervalo_sqlite
+        self.espera_reconexao = espera_reconexao
+        self.ativo = False           # conectado e recebendo avisos
+        self.avisos = 0
+        self.conexoes = 0
+        self.ultimo_erro = None
+        self._parar = threading.Event()
+        self.thread = threading.Thread(target=self._executar, name='ouvinte-tabelas', daemon=True)
+
+    def iniciar(self):
+        self.thread.start()
+        return self
+
+    def parar(self, espera=None):
+        self._parar.set()
+        self.thread.join(espera)
+
+    def _executar(self):
+        while not self._parar.is_set():
+            try:
+                if dialeto(self.pool) == 'sqlite':
+                    self._ouvir_sqlite()
+                else:
+                    self._ouvir_postgres()
+            except Exception as e:
+                if str(e) != self.ultimo_erro:
+                    print(f"Log: ouvinte de tabelas: {e}")
+                self.ultimo_erro = str(e)
+            self._desconectado()
+            self._parar.wait(self.espera_reconexao)
+
+    def _conectado(self):
+        # O que mudou antes de a escuta começar não gerou aviso para este processo.
+        self.cache.limpar()
+        self.ativo = True
+        self.conexoes += 1
+        self.ultimo_erro = None
+
+    def _desconectado(self):
+        if self.ativo:
+            self.ativo = False
+            self.cache.limpar()
+
+    def _invalidar(self, tabelas):
+        self.avisos += 1
+        self.cache.invalidar(tabelas)
+
+    def _ouvir_postgres(self):
+        conn = psycopg2.connect(**self.pool.dsn)
+        try:
+            conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as c:
+                # Sem os gatilhos (migração ainda não aplicada) ninguém avisaria.
+                c.execute("SELECT to_regprocedure('fn_avisar_escrita()') IS NOT NULL")
+                if not c.fetchone()[0]:
+                    raise RuntimeError("gatilhos de aviso ainda não instalados")
+                c.execute(f"LISTEN {CANAL}")
+            self._conectado()
+
+            ultimo_contato = time.monotonic()
+            while not self._parar.is_set():
+                if select.select([conn], [], [], ESPERA_SELECT)[0]:
+                    conn.poll()
+                    ultimo_contato = time.monotonic()
+                elif time.monotonic() - ultimo_contato > SEM_AVISO_TESTAR:
+                    with conn.cursor() as c:
+                        c.execute("SELECT 1")
+                    ultimo_contato = time.monotonic()
+                tabelas = {aviso.payload for aviso in conn.notifies}
+                conn.notifies.clear()
+                if tabelas:
+                    self._invalidar(tabelas)
+        finally:
+            conn.close()
+
+    def _ouvir_sqlite(self):
+        conn = conectar_sqlite(self.pool.caminho)
+        try:
+            conn.set_session(autocommit=True)
+            with conn.cursor() as c:
+                versoes = self._versoes_sqlite(c)
+                c.execute("PRAGMA data_version")
+                dados = c.fetchone()[0]
+                self._conectado()
+
+                while not self._parar.wait(self.intervalo_sqlite):
+                    c.execute("PRAGMA data_version")
+                    atual = c.fetchone()[0]
+                    if atual == dados:
+                        continue
+                    dados = atual
+                    novas = self._versoes_sqlite(c)
+                    tabelas = {tabela for tabela, versao in novas.items() if versoes.get(tabela) != versao}
+                    versoes = novas
+                    if tabelas:
+                        self._invalidar(tabelas)
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _versoes_sqlite(c):
+        c.execute("SELECT tabela, versao FROM versoes_tabelas")
+        return dict(c.fetchall())
+
+    def estatisticas(self):
+        return {
+            'ativo': self.ativo,
+            'avisos': self.avisos,
+            'conexoes': self.conexoes,
+            'ultimo_erro': self.ultimo_erro,
+        }
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+import functools
+import re
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# ==============================================================================
+# RASTREAMENTO DE CONSULTAS E PÁGINAS
+# ==============================================================================
+# Cada chamada de get_data/run_query/get_dashboard_metrics registra duração,
+# linhas, acerto de cache e a página que a fez. Consultas acima do limite
+# vão para um buffer circular, com o plano (EXPLAIN) capturado em segundo
+# plano numa conexão do pool.
+
+LIMITE_LENTA_MS = 250
+MAX_AMOSTRAS = 500          # por impressão digital / página
+MAX_LENTAS = 50
+INTERVALO_PLANO = 300       # s entre dois EXPLAIN da mesma consulta
+
+RE_STRING = re.compile(r"'(?:[^']|'')*'")
+RE_NUMERO = re.compile(r'\b\d+(?:\.\d+)?\b')
+RE_ESPACOS = re.compile(r'\s+')
+RE_LISTA = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+# O plano mostra os valores dos parâmetros: nada de senhas e códigos no painel.
+RE_SENSIVEL = re.compile(r'\b(?:usuarios|codigos_recuperacao)\b', re.IGNORECASE)
+RE_ESCRITA = re.compile(r'^\s*(?:INSERT|UPDATE|DELETE|TRUNCATE|WITH\b.*\b(?:INSERT|UPDATE|DELETE)\b)', re.IGNORECASE | re.DOTALL)
+
+_local = threading.local()
+
+def impressao_digital(sql):
+    # Mesma consulta com valores diferentes -> mesma impressão digital.
+    sql = RE_STRING.sub('?', sql).replace('%s', '?')
+    sql = RE_NUMERO.sub('?', sql)
+    sql = RE_LISTA.sub('(...)', sql)
+    return RE_ESPACOS.sub(' ', sql).strip()
+
+def marcar_cache(acertou):
+    _local.cache = acertou
+
+def pagina_atual():
+    return getattr(_local, 'pagina', None)
+
+
+class Rastreador:
+    def __init__(self, obter_pool=None, limite_lenta_ms=LIMITE_LENTA_MS):
+        self.obter_pool = obter_pool
+        self.limite_lenta_ms = limite_lenta_ms
+        self.lock = threading.Lock()
+        self.consultas = defaultdict(lambda: {'duracoes': deque(maxlen=MAX_AMOSTRAS), 'chamadas': 0,
+                                              'hits': 0, 'misses': 0, 'linhas': 0, 'paginas': set()})
+        self.paginas = defaultdict(lambda: deque(maxlen=MAX_AMOSTRAS))
+        self.lentas = deque(maxlen=MAX_LENTAS)
+        self.ultimo_plano = {}
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='explain')
+
+    def registrar(self, sql, params, ms, linhas, cache, escrita=False, explicar=True):
+        digital = impressao_digital(sql)
+        pagina = pagina_atual()
+        with self.lock:
+            item = self.consultas[digital]
+            item['duracoes'].append(ms)
+            item['chamadas'] += 1
+            item['linhas'] += linhas or 0
+            if cache is True:
+                item['hits'] += 1
+            elif cache is False:
+                item['misses'] += 1
+            if pagina:
+                item['paginas'].add(pagina)
+
+            lenta = ms >= self.limite_lenta_ms and cache is not True
+            capturar = lenta and time.monotonic() - self.ultimo_plano.get(digital, -INTERVALO_PLANO) >= INTERVALO_PLANO
+            if lenta:
+                registro = {'quando': datetime.now(), 'pagina': pagina, 'consulta': digital, 'ms': round(ms, 1),
+                            'linhas': linhas, 'plano': None}
+                self.lentas.appendleft(registro)
+            if capturar:
+                self.ultimo_plano[digital] = time.monotonic()
+
+        if capturar and explicar and self.obter_pool and not RE_SENSIVEL.search(sql):
+            self.executor.submit(self._capturar_plano, registro, sql, params, escrita)
+
+    def _capturar_plano(self, registro, sql, params, escrita):
+        # Escritas não são reexecutadas: só o plano estimado.
+        opcoes = "(COSTS, VERBOSE)" if escrita else "(ANALYZE, BUFFERS)"
+        pool_obj = self.obter_pool()
+        if not pool_obj:
+            return
+        try:
+            with pool_obj.conexao() as conn:
+                with conn.cursor() as c:
+                    c.execute(f"EXPLAIN {opcoes} {sql.replace('?', '%s')}", params)
+                    # PostgreSQL: uma coluna de texto; SQLite (EXPLAIN QUERY PLAN): o detalhe é a última.
+                    plano = '\n'.join(str(linha[-1]) for linha in c.fetchall())
+                conn.rollback()
+        except Exception as e:
+            plano = f"(plano indisponível: {e})"
+        with self.lock:
+            registro['plano'] = plano
+
+    def registrar_pagina(self, pagina, ms):
+        with self.lock:
+            self.paginas[pagina].append(ms)
+
+    @contextmanager
+    def pagina(self, nome):
+        anterior = pagina_atual()
+        _local.pagina = nome
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.registrar_pagina(nome, (time.perf_counter() - inicio) * 1000)
+            _local.pagina = anterior
+
+    def resumo_consultas(self):
+        with self.lock:
+            linhas = [
+                {
+                    'consulta': digital,
+                    'chamadas': item['chamadas'],
+                    'p50_ms': float(np.percentile(item['duracoes'], 50)),
+                    'p95_ms': float(np.percentile(item['duracoes'], 95)),
+                    'max_ms': max(item['duracoes']),
+                    'cache_hits': item['hits'],
+                    'cache_misses': item['misses'],
+                    'linhas_media': item['linhas'] / item['chamadas'],
+                    'paginas': ', '.join(sorted(item['paginas'])),
+                }
+                for digital, item in self.consultas.items() if item['duracoes']
+            ]
+        df = pd.DataFrame(linhas, columns=['consulta', 'chamadas', 'p50_ms', 'p95_ms', 'max_ms', 'cache_hits',
+                                           'cache_misses', 'linhas_media', 'paginas'])
+        return df.sort_values('p95_ms', ascending=False).round(1).reset_index(drop=True)
+
+    def resumo_paginas(self):
+        with self.lock:
+            linhas = [
+                {'pagina': pagina, 'renders': len(duracoes),
+                 'p50_ms': float(np.percentile(duracoes, 50)), 'p95_ms': float(np.percentile(duracoes, 95))}
+                for pagina, duracoes in self.paginas.items() if duracoes
+            ]
+        df = pd.DataFrame(linhas, columns=['pagina', 'renders', 'p50_ms', 'p95_ms'])
+        return df.sort_values('p95_ms', ascending=False).round(1).reset_index(drop=True)
+
+    def consultas_lentas(self):
+        with self.lock:
+            return [dict(registro) for registro in self.lentas]
+
+    def limpar(self):
+        with self.lock:
+            self.consultas.clear()
+            self.paginas.clear()
+            self.lentas.clear()
+            self.ultimo_plano.clear()
+
+
+def rastrear(obter_rastreador, sql=None):
+    """Decorador: mede cada chamada. `sql` fixa o texto registrado (para
+    funções sem consulta no primeiro argumento, como get_dashboard_metrics)."""
+    def decorador(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            _local.cache = None
+            inicio = time.perf_counter()
+            resultado = func(*args, **kwargs)
+            ms = (time.perf_counter() - inicio) * 1000
+
+            texto = sql or (args[0] if args else kwargs['query'])
+            params = kwargs.get('params', args[1] if len(args) > 1 else ())
+            if hasattr(resultado, 'num_rows'):
+                linhas = resultado.num_rows
+            elif hasattr(resultado, '__len__') and not isinstance(resultado, (str, dict)):
+                linhas = len(resultado)
+            else:
+                linhas = None
+            escrita = bool(RE_ESCRITA.match(texto))
+            try:
+                obter_rastreador().registrar(texto, params, ms, linhas, _local.cache, escrita, explicar=sql is None)
+            except Exception as e:
+                print(f"Log: {e}")
+            return resultado
+        return wrapper
+    return decorador